@@ -1,5 +1,9 @@
+import base64
+import json
 import logging
 import os
+import threading
+import time
 
 import requests
 from dotenv import load_dotenv
@@ -7,20 +11,58 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Renova o token um pouco antes de expirar, para não enviar um token vencido no meio de um job.
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("SATX_TOKEN_REFRESH_MARGIN_SECONDS", "120"))
+# Validade assumida quando a resposta de login não informa a expiração.
+TOKEN_DEFAULT_TTL_SECONDS = int(os.getenv("SATX_TOKEN_TTL_SECONDS", "3600"))
 
-def obter_token(timeout_seconds: int = 15):
-    """Obtém AccessToken da API systemsatx.
+_token = None
+_expires_at = 0.0
+_token_lock = threading.Lock()
 
-    Mantém assinatura compatível (chamada sem argumentos), mas adiciona:
-    - timeout
-    - validação de variáveis SATX_USERNAME/SATX_PASSWORD
-    - tratamento de exceções de rede
+
+def obter_token(timeout_seconds: int = 15, *, forcar: bool = False):
+    """Obtém AccessToken da API systemsatx, reaproveitando o token em cache.
+
+    O token fica em cache no processo até pouco antes de expirar; chamadas
+    concorrentes compartilham um único login. Use `invalidar_token` quando a
+    API responder 401.
+    """
+    global _token, _expires_at
+    with _token_lock:
+        if not forcar and _token and time.time() < _expires_at - TOKEN_REFRESH_MARGIN_SECONDS:
+            return _token
+
+        token, ttl = _login(timeout_seconds)
+        if token:
+            _token = token
+            _expires_at = time.time() + ttl
+        return token
+
+
+def invalidar_token(token=None):
+    """Descarta o token em cache (ex.: após 401).
+
+    Se `token` for informado, só descarta se ainda for o token em cache, para
+    que vários 401 do mesmo token vencido não disparem vários logins.
+    """
+    global _token, _expires_at
+    with _token_lock:
+        if token is None or token == _token:
+            _token = None
+            _expires_at = 0.0
+
+
+def _login(timeout_seconds: int):
+    """Faz o login; retorna (token, validade em segundos) ou (None, 0).
+
+    Valida SATX_USERNAME/SATX_PASSWORD e trata exceções de rede.
     """
     username = os.getenv("SATX_USERNAME")
     password = os.getenv("SATX_PASSWORD")
     if not username or not password:
         logging.error("SATX_USERNAME/SATX_PASSWORD não configurados no ambiente (.env).")
-        return None
+        return None, 0
 
     auth_url = "https://integration.systemsatx.com.br/Login"
     params = {"Username": username, "Password": password}
@@ -29,7 +71,7 @@ def obter_token(timeout_seconds: int = 15):
         auth_response = requests.post(auth_url, params=params, timeout=timeout_seconds)
     except requests.RequestException as e:
         logging.error(f"Erro de rede ao autenticar na systemsatx: {e}")
-        return None
+        return None, 0
 
     if auth_response.status_code != 200:
         logging.error(
@@ -37,20 +79,37 @@ def obter_token(timeout_seconds: int = 15):
             auth_response.status_code,
             auth_response.text,
         )
-        return None
+        return None, 0
 
     try:
         auth_data = auth_response.json()
     except ValueError:
         logging.error("Resposta de autenticação não é JSON válido.")
-        return None
+        return None, 0
 
     token = auth_data.get("AccessToken")
     if not token:
         logging.error("AccessToken não encontrado na resposta de autenticação.")
-        return None
+        return None, 0
+
+    return token, _validade_token(token, auth_data)
 
-    return token
+
+def _validade_token(token, auth_data):
+    """Segundos de validade: `ExpiresIn` da resposta, claim `exp` do JWT ou o padrão."""
+    expires_in = auth_data.get("ExpiresIn") or auth_data.get("expires_in")
+    try:
+        if expires_in:
+            return max(0, int(expires_in))
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return max(0, int(claims["exp"] - time.time()))
+    except (IndexError, KeyError, TypeError, ValueError):
+        return TOKEN_DEFAULT_TTL_SECONDS
 
 if __name__ == '__main__':
-    obter_token()
\ No newline at end of file
+    obter_token()
@@ -2,13 +2,19 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
-import requests
 import datetime
 import hashlib
 import mysql.connector
 import pytz
+import requests
 import time
-from authtoken import obter_token
+from concurrent.futures import ThreadPoolExecutor
+from satx_client import GRID_LIST_PATH, get_client, iter_json_items
+
+# Quantos dias (a partir de hoje, para trás) são conferidos a cada execução.
+GRID_DIAS_A_VERIFICAR = int(os.getenv("GRID_DIAS_A_VERIFICAR", "1"))
+# Quantos dias são baixados da API ao mesmo tempo.
+GRID_FETCH_CONCURRENCY = int(os.getenv("GRID_FETCH_CONCURRENCY", "4"))
 
 def format_date(date_str):
     if not date_str:
@@ -56,41 +62,88 @@ def gerar_dedupe_slot(line, route_integration_code, direction_name, shift, estim
     ])
     return hashlib.sha1(chave_bruta.encode("utf-8")).hexdigest()
 
-def garantir_indice_deduplicacao(cursor, conn):
-    """
-    Garante que o índice único use (route_integration_code, data_registro, dedupe_slot).
-    Assim, apenas a linha 50614 pode ter múltiplas viagens/dia via dedupe_slot.
-    """
-    cursor.execute("""
-        SELECT COLUMN_NAME
-        FROM information_schema.statistics
-        WHERE TABLE_SCHEMA = DATABASE()
-          AND TABLE_NAME = 'historico_grades'
-          AND INDEX_NAME = 'idx_codigo_data'
-        ORDER BY SEQ_IN_INDEX
-    """)
-    idx_cols = [row[0] for row in cursor.fetchall()]
+def parse_data_br(date_str):
+    """Valor DATETIME das colunas *_dt a partir do texto 'dd/mm/YYYY HH:MM:SS'."""
+    if not date_str:
+        return None
+    try:
+        return datetime.datetime.strptime(date_str, "%d/%m/%Y %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
 
-    alvo = ['route_integration_code', 'data_registro', 'dedupe_slot']
-    if idx_cols != alvo:
-        if idx_cols:
-            cursor.execute("ALTER TABLE historico_grades DROP INDEX idx_codigo_data")
-        cursor.execute("""
-            ALTER TABLE historico_grades
-            ADD UNIQUE KEY idx_codigo_data (route_integration_code, data_registro, dedupe_slot)
-        """)
-        conn.commit()
+def parse_numero(valor):
+    """Valor DECIMAL das colunas *_num; None se não for numérico."""
+    try:
+        return float(valor) if valor not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
 
-def processar_grid():
-    token = obter_token()
-    if not token:
-        return
+def hash_linha_grade(row):
+    """Hash do conteúdo de uma linha da grade, para pular itens que não mudaram."""
+    return hashlib.sha1(repr(row).encode("utf-8")).hexdigest()
+
+def carregar_hashes_do_dia(cursor, data_registro):
+    cursor.execute(
+        "SELECT route_integration_code, dedupe_slot, grid_hash FROM historico_grades WHERE data_registro = %s",
+        (data_registro,),
+    )
+    return {(r[0], r[1] or ''): r[2] for r in cursor.fetchall()}
+
+def carregar_clientes_por_rota(cursor):
+    """route_integration_code -> client_name mais recente (tabela rotas_clientes)."""
+    cursor.execute("SELECT route_integration_code, client_name FROM rotas_clientes")
+    return dict(cursor.fetchall())
+
+def registrar_clientes_por_rota(cursor, clientes):
+    cursor.executemany(
+        """
+        INSERT INTO rotas_clientes (route_integration_code, client_name) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE client_name = VALUES(client_name)
+        """,
+        list(clientes.items()),
+    )
+
+def buscar_grid_do_dia(client, data_alvo):
+    """Itens não cancelados da grade do dia na API, ou None em caso de erro.
+
+    A resposta é lida item a item e as viagens canceladas são descartadas
+    durante a leitura.
+    """
+    data_formatada = data_alvo.strftime("%d/%m/%Y")
+    payload = [{"PropertyName": "EffectiveDate", "Condition": "Equal", "Value": to_iso(data_formatada)}]
+    try:
+        response_api = client.post(GRID_LIST_PATH, params={"paramClientIntegrationCode": 1003}, json=payload, stream=True)
+    except Exception as e:
+        print(f"Erro de rede na API para {data_formatada}: {e}")
+        return None
+    if response_api.status_code != 200:
+        print(f"Erro na API para {data_formatada}: {response_api.status_code}")
+        response_api.close()
+        return None
+    itens = []
+    cancelados = 0
+    try:
+        for item in iter_json_items(response_api):
+            if item.get('IsTripCanceled') is True:
+                cancelados += 1
+            else:
+                itens.append(item)
+    except (ValueError, requests.RequestException) as e:
+        print(f"Resposta inválida da API para {data_formatada}: {e}")
+        return None
+    if not itens:
+        if cancelados:
+            print(f"Todas as viagens canceladas em {data_formatada}")
+        else:
+            print(f"Nenhuma grade encontrada para {data_formatada}")
+    return itens
 
-    api_url = "https://integration.systemsatx.com.br/GlobalBus/Grid/List?paramClientIntegrationCode=1003"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
+def processar_grid(dias_a_verificar=None):
+    if dias_a_verificar is None:
+        dias_a_verificar = GRID_DIAS_A_VERIFICAR
+    client = get_client()
+    if not client.token():
+        return
 
     try:
         conn = mysql.connector.connect(
@@ -106,66 +159,15 @@ def processar_grid():
     cursor = conn.cursor()
     cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS historico_grades (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        line VARCHAR(50),
-        estimated_departure VARCHAR(50),
-        estimated_arrival VARCHAR(50),
-        real_departure VARCHAR(50),
-        real_arrival VARCHAR(50),
-        route_integration_code VARCHAR(255),
-        route_name VARCHAR(255),
-        direction_name VARCHAR(255),
-        shift VARCHAR(50),
-        estimated_vehicle VARCHAR(255),
-        real_vehicle VARCHAR(255),
-        estimated_distance VARCHAR(50),
-        travelled_distance VARCHAR(50),
-        odometro VARCHAR(50),
-        dedupe_slot VARCHAR(64) DEFAULT '',
-        client_name VARCHAR(255),
-        data_registro DATE,
-        UNIQUE KEY idx_codigo_data (route_integration_code, data_registro, dedupe_slot)
-    );
-    """)
-    conn.commit()
-
-    cursor.execute("""
-    ALTER TABLE historico_grades ADD COLUMN IF NOT EXISTS travelled_distance_original VARCHAR(50) DEFAULT NULL;
-    """)
-    conn.commit()
-
-    cursor.execute("""
-    ALTER TABLE historico_grades ADD COLUMN IF NOT EXISTS dedupe_slot VARCHAR(64) DEFAULT '';
-    """)
-    conn.commit()
-
-    garantir_indice_deduplicacao(cursor, conn)
-
-    cursor.execute("""
-    UPDATE historico_grades
-    SET dedupe_slot = CASE
-        WHEN TRIM(COALESCE(line, '')) = '50614' THEN
-            SHA1(CONCAT_WS('|',
-                COALESCE(route_integration_code, ''),
-                COALESCE(direction_name, ''),
-                COALESCE(shift, ''),
-                COALESCE(NULLIF(estimated_departure, ''), NULLIF(real_departure, ''), NULLIF(estimated_arrival, ''), NULLIF(real_arrival, ''), '')
-            ))
-        ELSE ''
-    END
-    WHERE dedupe_slot IS NULL OR dedupe_slot = '';
-    """)
-    conn.commit()
-
     insert_historico_query = '''
     INSERT INTO historico_grades (
         line, estimated_departure, estimated_arrival, real_departure, real_arrival,
         route_integration_code, route_name, direction_name, shift,
-        estimated_vehicle, real_vehicle, estimated_distance, travelled_distance, client_name, data_registro, travelled_distance_original, dedupe_slot, odometro
-    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        estimated_vehicle, real_vehicle, estimated_distance, travelled_distance, client_name, data_registro, travelled_distance_original, dedupe_slot, odometro, grid_hash,
+        estimated_departure_dt, estimated_arrival_dt, real_departure_dt, real_arrival_dt, estimated_distance_num, travelled_distance_num
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     ON DUPLICATE KEY UPDATE
+        grid_hash = VALUES(grid_hash),
         odometro = IF(VALUES(odometro) IS NOT NULL AND VALUES(odometro) != '', VALUES(odometro), odometro),
         travelled_distance_original = IF((travelled_distance_original IS NULL OR travelled_distance_original = '' OR travelled_distance_original = 'NULL') AND VALUES(travelled_distance_original) IS NOT NULL, VALUES(travelled_distance_original), travelled_distance_original),
         travelled_distance = IF((travelled_distance IS NULL OR travelled_distance = '' OR travelled_distance = 'NULL') AND VALUES(travelled_distance) IS NOT NULL, VALUES(travelled_distance), travelled_distance),
@@ -204,47 +206,34 @@ def processar_grid():
         ),
         line = IF(
             real_arrival IS NULL OR real_arrival = '', VALUES(line), line
-        )
+        ),
+        -- Colunas tipadas: acompanham a coluna texto já atualizada acima.
+        estimated_departure_dt = IF(estimated_departure <=> VALUES(estimated_departure), VALUES(estimated_departure_dt), estimated_departure_dt),
+        estimated_arrival_dt = IF(estimated_arrival <=> VALUES(estimated_arrival), VALUES(estimated_arrival_dt), estimated_arrival_dt),
+        real_departure_dt = IF(real_departure <=> VALUES(real_departure), VALUES(real_departure_dt), real_departure_dt),
+        real_arrival_dt = IF(real_arrival <=> VALUES(real_arrival), VALUES(real_arrival_dt), real_arrival_dt),
+        estimated_distance_num = IF(estimated_distance <=> VALUES(estimated_distance), VALUES(estimated_distance_num), estimated_distance_num),
+        travelled_distance_num = IF(travelled_distance <=> VALUES(travelled_distance), VALUES(travelled_distance_num), travelled_distance_num)
     '''
 
-    dias_a_verificar = 1
-    for i in range(dias_a_verificar):
-        data_alvo = datetime.datetime.now(pytz.timezone("America/Sao_Paulo")) - datetime.timedelta(days=i)
-        data_formatada = data_alvo.strftime("%d/%m/%Y")
-        data_iso = to_iso(data_formatada)
-
-        payload = [{"PropertyName": "EffectiveDate", "Condition": "Equal", "Value": data_iso}]
-        response_api = requests.post(api_url, headers=headers, json=payload)
+    # Os dias são independentes na API: baixa todos em paralelo e grava em sequência.
+    agora = datetime.datetime.now(pytz.timezone("America/Sao_Paulo"))
+    datas = [agora - datetime.timedelta(days=i) for i in range(dias_a_verificar)]
+    with ThreadPoolExecutor(max_workers=max(1, min(GRID_FETCH_CONCURRENCY, len(datas)))) as executor:
+        respostas = list(executor.map(lambda d: buscar_grid_do_dia(client, d), datas))
 
-        if response_api.status_code != 200:
-            print(f"Erro na API para {data_formatada}: {response_api.status_code}")
-            continue
+    # Dimensão rota -> cliente: carregada uma vez por execução e mantida a cada gravação.
+    clientes_por_rota = carregar_clientes_por_rota(cursor)
 
-        data = response_api.json()
+    for data_alvo, data in zip(datas, respostas):
+        data_formatada = data_alvo.strftime("%d/%m/%Y")
+        # buscar_grid_do_dia já descartou as canceladas e avisou se o dia ficou vazio.
         if not data:
-            print(f"Nenhuma grade encontrada para {data_formatada}")
-            continue
-
-        raw_items = []
-        for item in data:
-            if item.get('IsTripCanceled') is True:
-                continue
-            raw_items.append(item)
-        if not raw_items:
-            print(f"Todas as viagens canceladas em {data_formatada}")
             continue
-        route_codes = { (itm.get('RouteIntegrationCode') or '').strip() for itm in raw_items }
-        existing_routes = {}
-        if route_codes:
-            route_codes_list = list(route_codes)
-            chunk_size = 1000
-            for c in range(0, len(route_codes_list), chunk_size):
-                chunk = route_codes_list[c:c+chunk_size]
-                placeholders = ','.join(['%s'] * len(chunk))
-                cursor.execute(f"SELECT route_integration_code, client_name FROM historico_grades WHERE route_integration_code IN ({placeholders})", chunk)
-                for r in cursor.fetchall():
-                    existing_routes[r[0]] = r[1]
+        raw_items = data
 
+        hashes_existentes = carregar_hashes_do_dia(cursor, data_alvo.date())
+        clientes_alterados = {}
         batch_data = []
         for item in raw_items:
             line = item.get('LineIntegrationCode')
@@ -272,26 +261,46 @@ def processar_grid():
                 travelled_distance = str(abs(trav_dist))
             elif trav_dist is not None:
                 travelled_distance = str(abs(trav_dist))
-            client_name = item.get('ClientName') or existing_routes.get(route_integration_code)
-            if client_name:
-                client_name = client_name.strip()
-                dedupe_slot = gerar_dedupe_slot(
-                    line,
-                    route_integration_code,
-                    direction_name,
-                    shift,
-                    estimated_departure,
-                    estimated_arrival,
-                    real_departure,
-                    real_arrival,
-                )
-            batch_data.append((
+            client_name_api = (item.get('ClientName') or '').strip()
+            if client_name_api and route_integration_code and clientes_por_rota.get(route_integration_code) != client_name_api:
+                clientes_por_rota[route_integration_code] = client_name_api
+                clientes_alterados[route_integration_code] = client_name_api
+            client_name = client_name_api or clientes_por_rota.get(route_integration_code)
+            dedupe_slot = gerar_dedupe_slot(
+                line,
+                route_integration_code,
+                direction_name,
+                shift,
+                estimated_departure,
+                estimated_arrival,
+                real_departure,
+                real_arrival,
+            )
+            row = (
                 line, estimated_departure, estimated_arrival, real_departure, real_arrival,
                 route_integration_code, route_name, direction_name, shift,
                 estimated_vehicle, real_vehicle, estimated_distance, travelled_distance,
-                    client_name, data_alvo.date(), travelled_distance_original, dedupe_slot, None  # odometro
+                client_name, data_alvo.date(), travelled_distance_original, dedupe_slot, None  # odometro
+            )
+            row_hash = hash_linha_grade(row)
+            # Mesmo conteúdo da última gravação: o upsert não mudaria nada.
+            if hashes_existentes.get((route_integration_code, dedupe_slot)) == row_hash:
+                continue
+            batch_data.append(row + (row_hash,) + (
+                parse_data_br(estimated_departure), parse_data_br(estimated_arrival),
+                parse_data_br(real_departure), parse_data_br(real_arrival),
+                parse_numero(estimated_distance), parse_numero(travelled_distance),
             ))
 
+        if clientes_alterados:
+            registrar_clientes_por_rota(cursor, clientes_alterados)
+            conn.commit()
+
+        ignoradas = len(raw_items) - len(batch_data)
+        if not batch_data:
+            print(f"✅ Grades sem alterações para {data_formatada} ({ignoradas} itens)")
+            continue
+
         for attempt in range(3):
             try:
                 cursor.executemany(insert_historico_query, batch_data)
@@ -306,14 +315,15 @@ def processar_grid():
                 else:
                     raise
 
-        print(f"✅ Grades processadas para {data_formatada}")
+        print(f"✅ Grades processadas para {data_formatada}: {len(batch_data)} gravadas, {ignoradas} sem alterações")
 
     update_travelled_distance_query = """
     UPDATE historico_grades
-    SET travelled_distance = FLOOR(estimated_distance)
-    WHERE real_arrival IS NOT NULL 
-      AND travelled_distance_original IS NOT NULL
-      AND STR_TO_DATE(estimated_departure, '%d/%m/%Y %H:%i:%s') >= DATE_SUB(NOW(), INTERVAL 7 DAY);
+    SET travelled_distance = FLOOR(estimated_distance),
+        travelled_distance_num = FLOOR(estimated_distance_num)
+    WHERE estimated_departure_dt >= DATE_SUB(NOW(), INTERVAL 7 DAY)
+      AND real_arrival IS NOT NULL
+      AND travelled_distance_original IS NOT NULL;
     """
     cursor.execute(update_travelled_distance_query)
     conn.commit()
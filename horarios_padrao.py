@@ -0,0 +1,237 @@
+"""Horários padrão por matrícula (ida, escola e volta), usados para ajustar os logs de tags.
+
+Os horários ficam na tabela `horarios_padrao` (colunas TIME; migração v10, com a
+carga inicial abaixo). `obter_indice` os mantém compilados em memória, já em
+minutos desde a meia-noite, e só relê a tabela quando ela muda (contagem de
+linhas ou maior `atualizado_em`).
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+CAMPOS = ('ida_entrada', 'ida_saida', 'escola_entrada', 'escola_saida', 'volta_entrada', 'volta_saida')
+
+# Ordem de preferência do horário que define o turno quando não há entrada na escola.
+_CAMPOS_REFERENCIA_TURNO = ('escola_entrada', 'ida_entrada', 'volta_entrada', 'ida_saida', 'volta_saida', 'escola_saida')
+
+# Carga inicial da tabela (migração v10) e reserva caso ela não possa ser lida.
+HORARIOS_PADRAO_INICIAIS = {
+    "5809670":   {"ida_entrada":"06:32","ida_saida":"06:33","escola_entrada":"12:10","escola_saida":"12:14","volta_entrada":"12:15","volta_saida":"12:17"},
+    "19808897":  {"ida_entrada":"06:39","ida_saida":"06:46","escola_entrada":"06:47","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:27"},
+    "11563534":  {"ida_entrada":"12:42","ida_saida":"12:47","escola_entrada":"12:48","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:24"},
+    "14599025":  {"ida_entrada":"12:40","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:17","volta_entrada":"18:17","volta_saida":"18:20"},
+    "14611467":  {"ida_entrada":"12:44","ida_saida":"12:45","escola_entrada":"12:49","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:17"},
+    "14612269":  {"ida_entrada":"12:40","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:16"},
+    "16498552":  {"ida_entrada":"12:42","ida_saida":"12:47","escola_entrada":"12:48","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:20"},
+    "183317":    {"ida_entrada":"12:40","ida_saida":"12:47","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:25"},
+    "4233022":   {"ida_entrada":"06:35","ida_saida":"06:37","escola_entrada":"06:42","escola_saida":"12:14","volta_entrada":"12:15","volta_saida":"12:23"},
+    "913443":    {"ida_entrada":"06:35","ida_saida":"06:36","escola_entrada":"06:55","escola_saida":"12:13","volta_entrada":"12:15","volta_saida":"12:22"},
+    "17519090":  {"ida_entrada":"06:40","ida_saida":"06:47","escola_entrada":"06:57","escola_saida":"12:20","volta_entrada":"12:21","volta_saida":"12:31"},
+    "30893251":  {"ida_entrada":"06:40","ida_saida":"06:46","escola_entrada":"06:47","escola_saida":"12:21","volta_entrada":"12:22","volta_saida":"12:31"},
+    "7906753":   {"ida_entrada":"06:38","ida_saida":"06:47","escola_entrada":"06:47","escola_saida":"12:17","volta_entrada":"12:22","volta_saida":"12:24"},
+    "933196":    {"ida_entrada":"06:39","ida_saida":"06:47","escola_entrada":"06:47","escola_saida":"12:26","volta_entrada":"12:27","volta_saida":"12:28"},
+    "14597596":  {"ida_entrada":"12:39","ida_saida":"12:46","escola_entrada":"12:46","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:18"},
+    "5809017":   {"ida_entrada":"06:31","ida_saida":"06:32","escola_entrada":"06:59","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:25"},
+    "863580":    {"ida_entrada":"06:28","ida_saida":"06:29","escola_entrada":"06:51","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:24"},
+    "863660":    {"ida_entrada":"06:39","ida_saida":"06:48","escola_entrada":"06:49","escola_saida":"12:17","volta_entrada":"12:17","volta_saida":"12:19"},
+    "2367271":   {"ida_entrada":"06:38","ida_saida":"06:45","escola_entrada":"06:50","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:27"},
+    "12265855":  {"ida_entrada":"06:28","ida_saida":"06:35","escola_entrada":"06:56","escola_saida":"12:14","volta_entrada":"12:15","volta_saida":"12:24"},
+    "12562698":  {"ida_entrada":"12:44","ida_saida":"12:45","escola_entrada":"12:45","escola_saida":"18:18","volta_entrada":"18:19","volta_saida":"18:20"},
+    "17205346":  {"ida_entrada":"06:39","ida_saida":"06:40","escola_entrada":"06:43","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:17"},
+    "6604079":   {"ida_entrada":"06:34","ida_saida":"06:39","escola_entrada":"06:44","escola_saida":"12:14","volta_entrada":"12:15","volta_saida":"12:21"},
+    "19309253":  {"ida_entrada":"06:32","ida_saida":"06:39","escola_entrada":"06:56","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:26"},
+    "12428428":  {"ida_entrada":"12:41","ida_saida":"12:49","escola_entrada":"12:49","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:23"},
+    "11852927":  {"ida_entrada":"06:45","ida_saida":"06:48","escola_entrada":"06:51","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:26"},
+    "12988318":  {"ida_entrada":"06:41","ida_saida":"06:48","escola_entrada":"06:48","escola_saida":"12:27","volta_entrada":"12:28","volta_saida":"12:31"},
+    "17109550":  {"ida_entrada":"06:41","ida_saida":"06:43","escola_entrada":"06:49","escola_saida":"12:27","volta_entrada":"12:28","volta_saida":"12:31"},
+    "32191025":  {"ida_entrada":"06:41","ida_saida":"06:42","escola_entrada":"06:47","escola_saida":"12:17","volta_entrada":"12:21","volta_saida":"12:25"},
+    "4247767":   {"ida_entrada":"06:40","ida_saida":"06:42","escola_entrada":"06:47","escola_saida":"12:26","volta_entrada":"12:27","volta_saida":"12:29"},
+    "6855837":   {"ida_entrada":"06:39","ida_saida":"06:45","escola_entrada":"06:47","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:20"},
+    "6856264":   {"ida_entrada":"06:38","ida_saida":"06:39","escola_entrada":"06:47","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:23"},
+    "746712":    {"ida_entrada":"06:45","ida_saida":"06:47","escola_entrada":"06:48","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:20"},
+    "7895239":   {"ida_entrada":"06:37","ida_saida":"06:46","escola_entrada":"06:49","escola_saida":"12:21","volta_entrada":"12:22","volta_saida":"12:23"},
+    "7896022":   {"ida_entrada":"06:48","ida_saida":"06:53","escola_entrada":"06:55","escola_saida":"12:18","volta_entrada":"12:18","volta_saida":"12:23"},
+    "810213":    {"ida_entrada":"06:39","ida_saida":"06:48","escola_entrada":"06:49","escola_saida":"12:18","volta_entrada":"12:18","volta_saida":"12:22"},
+    "1366996":   {"ida_entrada":"06:41","ida_saida":"06:42","escola_entrada":"06:52","escola_saida":"12:26","volta_entrada":"12:27","volta_saida":"12:29"},
+    "580994":    {"ida_entrada":"06:31","ida_saida":"06:39","escola_entrada":"06:52","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:23"},
+    "5997778":   {"ida_entrada":"06:29","ida_saida":"06:35","escola_entrada":"06:56","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:31"},
+    "9519327":   {"ida_entrada":"06:38","ida_saida":"06:42","escola_entrada":"06:44","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:23"},
+    "11541611":  {"ida_entrada":"12:18","ida_saida":"12:26","escola_entrada":"12:27","escola_saida":"18:28","volta_entrada":"18:29","volta_saida":"18:34"},
+    "1257957":   {"ida_entrada":"12:31","ida_saida":"12:33","escola_entrada":"12:40","escola_saida":"18:18","volta_entrada":"18:19","volta_saida":"18:24"},
+    "14297363":  {"ida_entrada":"12:37","ida_saida":"12:39","escola_entrada":"12:44","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:18"},
+    "14597456":  {"ida_entrada":"12:29","ida_saida":"12:30","escola_entrada":"12:40","escola_saida":"18:13","volta_entrada":"18:14","volta_saida":"18:16"},
+    "16399333":  {"ida_entrada":"12:25","ida_saida":"12:34","escola_entrada":"12:44","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:24"},
+    "16554886":  {"ida_entrada":"12:27","ida_saida":"12:35","escola_entrada":"12:37","escola_saida":"18:18","volta_entrada":"18:18","volta_saida":"18:20"},
+    "171251":    {"ida_entrada":"12:34","ida_saida":"12:37","escola_entrada":"12:38","escola_saida":"18:15","volta_entrada":"18:15","volta_saida":"18:20"},
+    "17166359":  {"ida_entrada":"12:31","ida_saida":"12:39","escola_entrada":"12:40","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:32"},
+    "17839388":  {"ida_entrada":"12:29","ida_saida":"12:35","escola_entrada":"12:40","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:25"},
+    "19805596":  {"ida_entrada":"12:27","ida_saida":"12:36","escola_entrada":"12:38","escola_saida":"18:18","volta_entrada":"18:19","volta_saida":"18:28"},
+    "201531":    {"ida_entrada":"06:45","ida_saida":"06:46","escola_entrada":"06:46","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:19"},
+    "29915454":  {"ida_entrada":"12:31","ida_saida":"12:39","escola_entrada":"12:39","escola_saida":"18:18","volta_entrada":"18:19","volta_saida":"18:28"},
+    "32184720":  {"ida_entrada":"12:27","ida_saida":"12:35","escola_entrada":"12:46","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:28"},
+    "32185564":  {"ida_entrada":"12:27","ida_saida":"12:35","escola_entrada":"12:49","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:28"},
+    "5946316":   {"ida_entrada":"06:29","ida_saida":"06:35","escola_entrada":"06:56","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:21"},
+    "681823":    {"ida_entrada":"06:35","ida_saida":"06:37","escola_entrada":"06:37","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:21"},
+    "7893368":   {"ida_entrada":"12:20","ida_saida":"12:21","escola_entrada":"12:22","escola_saida":"18:15","volta_entrada":"18:15","volta_saida":"18:19"},
+    "7897851":   {"ida_entrada":"06:46","ida_saida":"06:54","escola_entrada":"06:56","escola_saida":"12:30","volta_entrada":"12:31","volta_saida":"12:37"},
+    "9963959":   {"ida_entrada":"06:46","ida_saida":"06:47","escola_entrada":"06:48","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:18"},
+    "9991766":   {"ida_entrada":"06:35","ida_saida":"06:40","escola_entrada":"06:46","escola_saida":"12:27","volta_entrada":"12:28","volta_saida":"12:33"},
+    "10654919":  {"ida_entrada":"12:42","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:18"},
+    "14611661":  {"ida_entrada":"12:41","ida_saida":"12:45","escola_entrada":"12:46","escola_saida":"18:23","volta_entrada":"18:24","volta_saida":"18:28"},
+    "1534315":   {"ida_entrada":"12:42","ida_saida":"12:45","escola_entrada":"12:51","escola_saida":"18:17","volta_entrada":"18:26","volta_saida":"18:29"},
+    "1724510":   {"ida_entrada":"06:32","ida_saida":"06:39","escola_entrada":"06:42","escola_saida":"12:30","volta_entrada":"12:30","volta_saida":"12:37"},
+    "5148720":   {"ida_entrada":"06:50","ida_saida":"06:56","escola_entrada":"06:57","escola_saida":"12:15","volta_entrada":"12:18","volta_saida":"12:21"},
+    "5808690":   {"ida_entrada":"06:34","ida_saida":"06:39","escola_entrada":"06:46","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:20"},
+    "686094":    {"ida_entrada":"06:26","ida_saida":"06:27","escola_entrada":"06:47","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:18"},
+    "7977561":   {"ida_entrada":"12:46","ida_saida":"12:47","escola_entrada":"18:18","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:22"},
+    "873682":    {"ida_entrada":"06:50","ida_saida":"06:53","escola_entrada":"06:54","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:18"},
+    "9966095":   {"ida_entrada":"12:43","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:20"},
+    "10257286":  {"ida_entrada":"12:31","ida_saida":"12:39","escola_entrada":"12:40","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:24"},
+    "1390970":   {"ida_entrada":"06:43","ida_saida":"06:46","escola_entrada":"06:47","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:19"},
+    "4395332":   {"ida_entrada":"12:42","ida_saida":"12:47","escola_entrada":"12:48","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:20"},
+    "11294231":  {"ida_entrada":"06:44","ida_saida":"06:48","escola_entrada":"06:50","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:19"},
+    "1320806":   {"ida_entrada":"06:40","ida_saida":"06:45","escola_entrada":"06:49","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:19"},
+    "16211024":  {"ida_entrada":"06:40","ida_saida":"06:43","escola_entrada":"06:44","escola_saida":"12:27","volta_entrada":"12:28","volta_saida":"12:31"},
+    "27959039":  {"ida_entrada":"12:39","ida_saida":"12:46","escola_entrada":"12:48","escola_saida":"18:17","volta_entrada":"18:17","volta_saida":"18:18"},
+    "33754260":  {"ida_entrada":"12:44","ida_saida":"12:45","escola_entrada":"12:46","escola_saida":"18:15","volta_entrada":"18:15","volta_saida":"18:17"},
+    "4249190":   {"ida_entrada":"06:39","ida_saida":"06:47","escola_entrada":"06:52","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:23"},
+    "4269752":   {"ida_entrada":"06:26","ida_saida":"06:35","escola_entrada":"06:46","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:27"},
+    "9208220":   {"ida_entrada":"06:39","ida_saida":"06:43","escola_entrada":"06:44","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:19"},
+    "935566":    {"ida_entrada":"12:45","ida_saida":"12:46","escola_entrada":"12:46","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:17"},
+    "9441550":   {"ida_entrada":"06:39","ida_saida":"06:44","escola_entrada":"06:45","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:20"},
+    "12428355":  {"ida_entrada":"12:43","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:22"},
+    "14598690":  {"ida_entrada":"12:42","ida_saida":"12:46","escola_entrada":"12:49","escola_saida":"18:17","volta_entrada":"18:18","volta_saida":"18:20"},
+    "9962685":   {"ida_entrada":"12:39","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:25"},
+    "16678119":  {"ida_entrada":"06:41","ida_saida":"06:45","escola_entrada":"06:46","escola_saida":"12:26","volta_entrada":"12:27","volta_saida":"12:30"},
+    "30893260":  {"ida_entrada":"12:31","ida_saida":"12:38","escola_entrada":"12:39","escola_saida":"18:18","volta_entrada":"18:18","volta_saida":"18:22"},
+    "633272":    {"ida_entrada":"06:46","ida_saida":"06:47","escola_entrada":"06:48","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:18"},
+    "7899242":   {"ida_entrada":"06:49","ida_saida":"06:52","escola_entrada":"06:53","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:18"},
+    "7893554":   {"ida_entrada":"06:49","ida_saida":"06:55","escola_entrada":"06:56","escola_saida":"12:14","volta_entrada":"12:14","volta_saida":"12:20"},
+    "8852118":   {"ida_entrada":"06:46","ida_saida":"06:47","escola_entrada":"06:48","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:18"},
+    "12734049":  {"ida_entrada":"12:41","ida_saida":"12:45","escola_entrada":"12:46","escola_saida":"18:27","volta_entrada":"18:28","volta_saida":"18:32"},
+    "15417354":  {"ida_entrada":"12:39","ida_saida":"12:41","escola_entrada":"12:42","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:18"},
+    "27608910":  {"ida_entrada":"06:40","ida_saida":"06:43","escola_entrada":"06:44","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:19"},
+    "5999010":   {"ida_entrada":"06:39","ida_saida":"06:42","escola_entrada":"06:43","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:19"},
+    "686517":    {"ida_entrada":"12:27","ida_saida":"12:28","escola_entrada":"12:29","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:18"},
+    "12508715":  {"ida_entrada":"06:46","ida_saida":"06:57","escola_entrada":"06:58","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:24"},
+    "2373479":   {"ida_entrada":"12:28","ida_saida":"12:37","escola_entrada":"12:39","escola_saida":"18:17","volta_entrada":"18:17","volta_saida":"18:25"},
+    "7894354":   {"ida_entrada":"06:39","ida_saida":"06:43","escola_entrada":"06:44","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:20"},
+    "14708878":  {"ida_entrada":"12:42","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:21"},
+    "7902294":   {"ida_entrada":"12:35","ida_saida":"12:39","escola_entrada":"12:40","escola_saida":"18:15","volta_entrada":"18:15","volta_saida":"18:21"},
+    "5809360":   {"ida_entrada":"06:39","ida_saida":"06:51","escola_entrada":"06:52","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:26"},
+    "12428380":  {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:19","volta_entrada":"18:19","volta_saida":"18:22"},
+    "1258076":   {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:29","volta_entrada":"18:30","volta_saida":"18:34"},
+    "1263162":   {"ida_entrada":"12:38","ida_saida":"12:43","escola_entrada":"12:44","escola_saida":"18:28","volta_entrada":"18:29","volta_saida":"18:34"},
+    "14293163":  {"ida_entrada":"12:38","ida_saida":"12:43","escola_entrada":"12:44","escola_saida":"18:27","volta_entrada":"18:28","volta_saida":"18:32"},
+    "14304122":  {"ida_entrada":"12:36","ida_saida":"12:43","escola_entrada":"12:44","escola_saida":"18:18","volta_entrada":"18:29","volta_saida":"18:35"},
+    "1588253":   {"ida_entrada":"12:36","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:17","volta_entrada":"18:18","volta_saida":"18:28"},
+    "16495340":  {"ida_entrada":"12:43","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:14","volta_entrada":"18:32","volta_saida":"18:33"},
+    "17145084":  {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:22"},
+    "1765293":   {"ida_entrada":"12:41","ida_saida":"12:42","escola_entrada":"12:43","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:16"},
+    "17808431":  {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:15","volta_entrada":"18:34","volta_saida":"18:38"},
+    "18808079":  {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:32","volta_entrada":"18:32","volta_saida":"18:35"},
+    "29853246":  {"ida_entrada":"12:41","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:16","volta_entrada":"18:33","volta_saida":"18:36"},
+    "5875125":   {"ida_entrada":"12:41","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:17","volta_entrada":"18:28","volta_saida":"18:31"},
+    "884342":    {"ida_entrada":"12:40","ida_saida":"12:43","escola_entrada":"12:44","escola_saida":"18:33","volta_entrada":"18:34","volta_saida":"18:36"},
+    "13391595":  {"ida_entrada":"12:45","ida_saida":"12:50","escola_entrada":"12:51","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:22"},
+    "1706262":   {"ida_entrada":"12:42","ida_saida":"12:46","escola_entrada":"12:47","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:22"},
+    "12428517":  {"ida_entrada":"12:42","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:20"},
+    "9962120":   {"ida_entrada":"06:50","ida_saida":"06:52","escola_entrada":"06:53","escola_saida":"12:14","volta_entrada":"12:14","volta_saida":"12:16"},
+}
+
+
+
+def para_minutos(valor):
+    """Minutos desde a meia-noite de "HH:MM[:SS]", TIME (timedelta) ou time; None se inválido."""
+    if valor is None:
+        return None
+    if isinstance(valor, timedelta):
+        return int(valor.total_seconds() // 60)
+    if hasattr(valor, 'hour') and hasattr(valor, 'minute'):
+        return valor.hour * 60 + valor.minute
+    try:
+        hh, mm = map(int, str(valor).split(':')[:2])
+        return hh * 60 + mm
+    except Exception:
+        return None
+
+
+class IndiceHorarios:
+    """Horários padrão compilados: matriz (matrículas x CAMPOS) em minutos, NaN onde ausente.
+
+    `turnos` traz 'manha'/'tarde' por matrícula (pelo horário de entrada na
+    escola ou, na falta dele, o primeiro disponível) e `medianas` os horários
+    medianos de cada campo por turno, usados para preencher lacunas.
+    """
+
+    def __init__(self, horarios):
+        import numpy as np
+
+        self.matriculas = [str(m) for m in horarios]
+        self.posicao = {m: i for i, m in enumerate(self.matriculas)}
+        self.minutos = np.full((len(self.matriculas), len(CAMPOS)), np.nan)
+        for i, m in enumerate(self.matriculas):
+            for j, campo in enumerate(CAMPOS):
+                valor = para_minutos(horarios[m].get(campo))
+                if valor is not None:
+                    self.minutos[i, j] = valor
+
+        referencia = np.full(len(self.matriculas), np.nan)
+        for campo in reversed(_CAMPOS_REFERENCIA_TURNO):
+            coluna = self.minutos[:, CAMPOS.index(campo)]
+            referencia = np.where(np.isnan(coluna), referencia, coluna)
+        self.turnos = np.where(referencia < 12 * 60, 'manha', 'tarde')
+
+        self.medianas = {}
+        for turno in ('manha', 'tarde'):
+            linhas = self.minutos[self.turnos == turno]
+            medianas = {}
+            for j, campo in enumerate(CAMPOS):
+                valores = linhas[:, j][~np.isnan(linhas[:, j])] if len(linhas) else []
+                if len(valores):
+                    medianas[campo] = int(np.median(valores))
+            self.medianas[turno] = medianas
+
+    def get(self, matricula):
+        """Horários da matrícula como {campo: minutos ou None}; None se não houver padrão."""
+        i = self.posicao.get(str(matricula))
+        if i is None:
+            return None
+        return {campo: (None if v != v else int(v)) for campo, v in zip(CAMPOS, self.minutos[i])}
+
+
+_indice = None
+_assinatura = None
+_lock = threading.Lock()
+
+
+def carregar_horarios(cursor):
+    """Lê a tabela horarios_padrao como {matricula: {campo: TIME}}."""
+    cursor.execute(f"SELECT matricula, {', '.join(CAMPOS)} FROM horarios_padrao")
+    return {str(row[0]): dict(zip(CAMPOS, row[1:])) for row in cursor.fetchall()}
+
+
+def obter_indice(conn=None):
+    """Índice compilado dos horários padrão.
+
+    Com `conn`, confere se a tabela mudou desde a última carga e a recompila se
+    preciso. Sem conexão (ou se a tabela não puder ser lida), usa o índice já
+    carregado ou, na falta dele, HORARIOS_PADRAO_INICIAIS.
+    """
+    global _indice, _assinatura
+    with _lock:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(1), MAX(atualizado_em) FROM horarios_padrao")
+                assinatura = tuple(cursor.fetchone())
+                if _indice is None or assinatura != _assinatura:
+                    _indice = IndiceHorarios(carregar_horarios(cursor))
+                    _assinatura = assinatura
+                cursor.close()
+            except Exception as e:
+                logging.warning(f"Não foi possível ler horarios_padrao: {e}")
+        if _indice is None:
+            _indice = IndiceHorarios(HORARIOS_PADRAO_INICIAIS)
+        return _indice
@@ -0,0 +1,396 @@
+"""Migrações versionadas do banco POWERBI (historico_grades, informacoes, tags...).
+
+Cada migração roda uma única vez e fica registrada em `schema_migrations`, de
+modo que os jobs de ingestão (grid, odometer, routeviolation, tags,
+ultima_execucao) não executam DDL nem backfills a cada execução.
+
+Rodam no início do worker de jobs (pelo processo líder) ou manualmente no deploy:
+
+    python migrations.py
+
+Para alterar o schema, acrescente uma nova função ao final de MIGRATIONS; nunca
+edite uma migração já aplicada. As migrações iniciais usam `IF NOT EXISTS`
+porque reproduzem o DDL que os jobs executavam: em bancos existentes só
+registram a versão.
+"""
+
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import mysql.connector
+
+from horarios_padrao import CAMPOS as CAMPOS_HORARIOS, HORARIOS_PADRAO_INICIAIS
+
+# Lock nomeado do MySQL: impede que dois processos migrem ao mesmo tempo.
+MIGRATIONS_LOCK_NAME = "powerbi_schema_migrations"
+MIGRATIONS_LOCK_TIMEOUT_SECONDS = 300
+
+
+def _v1_historico_grades(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS historico_grades (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        line VARCHAR(50),
+        estimated_departure VARCHAR(50),
+        estimated_arrival VARCHAR(50),
+        real_departure VARCHAR(50),
+        real_arrival VARCHAR(50),
+        route_integration_code VARCHAR(255),
+        route_name VARCHAR(255),
+        direction_name VARCHAR(255),
+        shift VARCHAR(50),
+        estimated_vehicle VARCHAR(255),
+        real_vehicle VARCHAR(255),
+        estimated_distance VARCHAR(50),
+        travelled_distance VARCHAR(50),
+        odometro VARCHAR(50),
+        dedupe_slot VARCHAR(64) DEFAULT '',
+        client_name VARCHAR(255),
+        data_registro DATE,
+        UNIQUE KEY idx_codigo_data (route_integration_code, data_registro, dedupe_slot)
+    )
+    """)
+    cursor.execute("ALTER TABLE historico_grades ADD COLUMN IF NOT EXISTS travelled_distance_original VARCHAR(50) DEFAULT NULL")
+    cursor.execute("ALTER TABLE historico_grades ADD COLUMN IF NOT EXISTS dedupe_slot VARCHAR(64) DEFAULT ''")
+    cursor.execute("ALTER TABLE historico_grades ADD COLUMN IF NOT EXISTS grid_hash CHAR(40) DEFAULT NULL")
+
+
+def _v2_historico_grades_deduplicacao(cursor):
+    """Índice único (route_integration_code, data_registro, dedupe_slot) e backfill do dedupe_slot.
+
+    Só a linha 50614 pode ter várias viagens por dia, distinguidas pelo dedupe_slot.
+    """
+    cursor.execute("""
+        UPDATE historico_grades
+        SET dedupe_slot = CASE
+            WHEN TRIM(COALESCE(line, '')) = '50614' THEN
+                SHA1(CONCAT_WS('|',
+                    COALESCE(route_integration_code, ''),
+                    COALESCE(direction_name, ''),
+                    COALESCE(shift, ''),
+                    COALESCE(NULLIF(estimated_departure, ''), NULLIF(real_departure, ''), NULLIF(estimated_arrival, ''), NULLIF(real_arrival, ''), '')
+                ))
+            ELSE ''
+        END
+        WHERE dedupe_slot IS NULL OR dedupe_slot = ''
+    """)
+
+    cursor.execute("""
+        SELECT COLUMN_NAME
+        FROM information_schema.statistics
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'historico_grades'
+          AND INDEX_NAME = 'idx_codigo_data'
+        ORDER BY SEQ_IN_INDEX
+    """)
+    idx_cols = [row[0] for row in cursor.fetchall()]
+    if idx_cols != ['route_integration_code', 'data_registro', 'dedupe_slot']:
+        if idx_cols:
+            cursor.execute("ALTER TABLE historico_grades DROP INDEX idx_codigo_data")
+        cursor.execute("""
+            ALTER TABLE historico_grades
+            ADD UNIQUE KEY idx_codigo_data (route_integration_code, data_registro, dedupe_slot)
+        """)
+
+
+def _v3_informacoes(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS informacoes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            LineName VARCHAR(255),
+            RouteName VARCHAR(255),
+            Direction VARCHAR(255),
+            RealVehicle VARCHAR(255),
+            url VARCHAR(512),
+            data_execucao DATE,
+            violation_type VARCHAR(255),
+            UNIQUE (RouteName, data_execucao)
+        )
+    """)
+    for coluna in ['url', 'violation_type']:
+        cursor.execute(f"ALTER TABLE informacoes ADD COLUMN IF NOT EXISTS {coluna} VARCHAR(512)")
+
+
+def _v4_ultima_execucao(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ultima_execucao (
+            id INT PRIMARY KEY,
+            last_execution DATETIME
+        )
+    """)
+
+
+def _v5_tags(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Escola (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            Nome VARCHAR(255) NOT NULL,
+            EventDate DATETIME NOT NULL,
+            UpdateDate DATETIME NOT NULL,
+            Matricula VARCHAR(50) NOT NULL,
+            Data_Execucao DATE NOT NULL,
+            UNIQUE KEY uniq_escola_evento (EventDate, Matricula)
+        )
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uniq_escola_evento ON Escola (EventDate, Matricula)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Veiculo (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            Placa VARCHAR(20) NOT NULL,
+            EventDate DATETIME NOT NULL,
+            UpdateDate DATETIME NOT NULL,
+            Ignition BOOLEAN NOT NULL,
+            Matricula VARCHAR(50) NOT NULL,
+            Latitude DOUBLE NOT NULL,
+            Longitude DOUBLE NOT NULL,
+            Data_Execucao DATE NOT NULL,
+            UNIQUE KEY uniq_veic_evento (Placa, Matricula, EventDate)
+        )
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uniq_veic_evento ON Veiculo (Placa, Matricula, EventDate)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Aluno (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            Matricula VARCHAR(50) NOT NULL,
+            Escola VARCHAR(255) NOT NULL,
+            Veiculo VARCHAR(20) DEFAULT NULL,
+            Entrada_Ida_Veiculo DATETIME,
+            Saida_Ida_Veiculo DATETIME,
+            Entrada_Escola DATETIME,
+            Saida_Escola DATETIME,
+            Entrada_Volta_Veiculo DATETIME,
+            Saida_Volta_Veiculo DATETIME,
+            Data_Execucao DATE NOT NULL,
+            UNIQUE KEY uniq_aluno_dia (Matricula, Data_Execucao)
+        )
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uniq_aluno_dia ON Aluno (Matricula, Data_Execucao)")
+
+
+# Formato das datas gravadas como texto em historico_grades.
+_FORMATO_DATA_BR = "%d/%m/%Y %H:%i:%s"
+_NUMERO_REGEXP = "^-?[0-9]+([.][0-9]+)?$"
+
+
+def _v6_historico_grades_colunas_tipadas(cursor):
+    """Colunas DATETIME/DECIMAL espelhando as colunas texto, com índices para buscas por intervalo.
+
+    As colunas texto continuam sendo gravadas (dual-write) para não quebrar os
+    relatórios que as leem; as consultas dos jobs passam a usar as tipadas.
+    """
+    cursor.execute("""
+        ALTER TABLE historico_grades
+            ADD COLUMN IF NOT EXISTS estimated_departure_dt DATETIME NULL,
+            ADD COLUMN IF NOT EXISTS estimated_arrival_dt DATETIME NULL,
+            ADD COLUMN IF NOT EXISTS real_departure_dt DATETIME NULL,
+            ADD COLUMN IF NOT EXISTS real_arrival_dt DATETIME NULL,
+            ADD COLUMN IF NOT EXISTS estimated_distance_num DECIMAL(12,3) NULL,
+            ADD COLUMN IF NOT EXISTS travelled_distance_num DECIMAL(12,3) NULL,
+            ADD COLUMN IF NOT EXISTS odometro_num DECIMAL(14,3) NULL
+    """)
+    cursor.execute(f"""
+        UPDATE historico_grades
+        SET estimated_departure_dt = STR_TO_DATE(NULLIF(estimated_departure, ''), '{_FORMATO_DATA_BR}'),
+            estimated_arrival_dt = STR_TO_DATE(NULLIF(estimated_arrival, ''), '{_FORMATO_DATA_BR}'),
+            real_departure_dt = STR_TO_DATE(NULLIF(real_departure, ''), '{_FORMATO_DATA_BR}'),
+            real_arrival_dt = STR_TO_DATE(NULLIF(real_arrival, ''), '{_FORMATO_DATA_BR}'),
+            estimated_distance_num = IF(estimated_distance REGEXP '{_NUMERO_REGEXP}', CAST(estimated_distance AS DECIMAL(12,3)), NULL),
+            travelled_distance_num = IF(travelled_distance REGEXP '{_NUMERO_REGEXP}', CAST(travelled_distance AS DECIMAL(12,3)), NULL),
+            odometro_num = IF(odometro REGEXP '{_NUMERO_REGEXP}', CAST(odometro AS DECIMAL(14,3)), NULL)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hg_vehicle_arrival ON historico_grades (real_vehicle, real_arrival_dt)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hg_line_departure ON historico_grades (line, real_departure_dt)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hg_estimated_departure ON historico_grades (estimated_departure_dt)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hg_data_registro ON historico_grades (data_registro, real_vehicle)")
+
+
+def _v7_rotas_clientes(cursor):
+    """Dimensão rota -> cliente usada pelo grid para preencher client_name sem varrer o histórico."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rotas_clientes (
+            route_integration_code VARCHAR(255) PRIMARY KEY,
+            client_name VARCHAR(255) NOT NULL,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO rotas_clientes (route_integration_code, client_name)
+        SELECT h.route_integration_code, TRIM(h.client_name)
+        FROM historico_grades h
+        JOIN (
+            SELECT route_integration_code, MAX(id) AS id
+            FROM historico_grades
+            WHERE route_integration_code IS NOT NULL AND route_integration_code != ''
+              AND client_name IS NOT NULL AND TRIM(client_name) != ''
+            GROUP BY route_integration_code
+        ) ult ON ult.id = h.id
+        ON DUPLICATE KEY UPDATE client_name = VALUES(client_name)
+    """)
+
+
+def _v8_mv_incremental(cursor):
+    """Chave de rota normalizada persistida, marcas de alteração e controle da MV incremental.
+
+    `route_name_norm` é coluna gerada (TRIM(LOWER())) com índice, para o join
+    informacoes x historico_grades não recalcular a expressão linha a linha;
+    `atualizado_em` permite que refresh_mv processe só o que mudou.
+    """
+    cursor.execute("""
+        ALTER TABLE historico_grades
+            ADD COLUMN IF NOT EXISTS route_name_norm VARCHAR(255) AS (TRIM(LOWER(route_name))) STORED,
+            ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hg_route_norm_data ON historico_grades (route_name_norm, data_registro, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hg_atualizado_em ON historico_grades (atualizado_em)")
+
+    cursor.execute("""
+        ALTER TABLE informacoes
+            ADD COLUMN IF NOT EXISTS route_name_norm VARCHAR(255) AS (TRIM(LOWER(RouteName))) STORED,
+            ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_info_route_norm_data ON informacoes (route_name_norm, data_execucao)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_info_atualizado_em ON informacoes (atualizado_em)")
+
+    # Mesma ordem de colunas do SELECT de refresh_mv (o INSERT é posicional).
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS informacoes_com_cliente_mv (
+            id INT NOT NULL PRIMARY KEY,
+            LineName VARCHAR(255),
+            RouteName VARCHAR(255),
+            Direction VARCHAR(255),
+            RealVehicle VARCHAR(255),
+            data_execucao DATE,
+            url VARCHAR(512),
+            violation_type VARCHAR(512),
+            client_name VARCHAR(255),
+            real_departure VARCHAR(50),
+            real_arrival VARCHAR(50),
+            id_grade INT
+        )
+    """)
+    cursor.execute("""
+        SELECT COUNT(1) FROM information_schema.statistics
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'informacoes_com_cliente_mv'
+          AND COLUMN_NAME = 'id' AND SEQ_IN_INDEX = 1
+    """)
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("CREATE INDEX idx_mv_id ON informacoes_com_cliente_mv (id)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mv_watermarks (
+            nome VARCHAR(64) PRIMARY KEY,
+            valor DATETIME NOT NULL
+        )
+    """)
+
+
+def _v9_tags_frota_escolas(cursor):
+    """Frota e escolas consultadas pelo tags_job (antes fixas no código), com as atuais como carga inicial."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tags_veiculos (
+            placa VARCHAR(20) PRIMARY KEY,
+            ativo TINYINT(1) NOT NULL DEFAULT 1
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tags_escolas (
+            codigo VARCHAR(255) PRIMARY KEY,
+            ativo TINYINT(1) NOT NULL DEFAULT 1
+        )
+    """)
+    cursor.execute("INSERT IGNORE INTO tags_veiculos (placa) VALUES ('AXM9A53'), ('CUE2D20'), ('IUZ4F94')")
+    cursor.execute("INSERT IGNORE INTO tags_escolas (codigo) VALUES ('COL.ESTAD.DJALMA MARINHO')")
+
+
+def _v10_horarios_padrao(cursor):
+    """Horários padrão por matrícula (antes o dict HORARIOS_PADRAO em tags.py), com a carga inicial."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS horarios_padrao (
+            matricula VARCHAR(50) PRIMARY KEY,
+            ida_entrada TIME NULL,
+            ida_saida TIME NULL,
+            escola_entrada TIME NULL,
+            escola_saida TIME NULL,
+            volta_entrada TIME NULL,
+            volta_saida TIME NULL,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.executemany(
+        f"INSERT IGNORE INTO horarios_padrao (matricula, {', '.join(CAMPOS_HORARIOS)}) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        [
+            (matricula, *(horarios.get(campo) or None for campo in CAMPOS_HORARIOS))
+            for matricula, horarios in HORARIOS_PADRAO_INICIAIS.items()
+        ],
+    )
+
+
+# (versão, descrição, função). Sempre acrescente no final, com versão maior.
+MIGRATIONS = [
+    (1, "historico_grades: tabela e colunas travelled_distance_original, dedupe_slot, grid_hash", _v1_historico_grades),
+    (2, "historico_grades: backfill de dedupe_slot e índice único idx_codigo_data", _v2_historico_grades_deduplicacao),
+    (3, "informacoes: tabela e colunas url, violation_type", _v3_informacoes),
+    (4, "ultima_execucao: tabela", _v4_ultima_execucao),
+    (5, "tags: tabelas Escola, Veiculo e Aluno", _v5_tags),
+    (6, "historico_grades: colunas DATETIME/DECIMAL e índices por veículo/linha", _v6_historico_grades_colunas_tipadas),
+    (7, "rotas_clientes: dimensão rota -> cliente", _v7_rotas_clientes),
+    (8, "informacoes_com_cliente_mv: chave de rota normalizada, atualizado_em e watermarks", _v8_mv_incremental),
+    (9, "tags: tabelas tags_veiculos e tags_escolas", _v9_tags_frota_escolas),
+    (10, "horarios_padrao: horários padrão por matrícula", _v10_horarios_padrao),
+]
+
+
+def get_mysql_conn():
+    return mysql.connector.connect(
+        host=os.getenv("POWERBI_DB_HOST"),
+        database=os.getenv("POWERBI_DB_NAME"),
+        user=os.getenv("POWERBI_DB_USER"),
+        password=os.getenv("POWERBI_DB_PASSWORD")
+    )
+
+
+def aplicar_migracoes():
+    """Aplica, em ordem, as migrações ainda não registradas. Retorna quantas rodaram."""
+    conn = get_mysql_conn()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATIONS_LOCK_NAME, MIGRATIONS_LOCK_TIMEOUT_SECONDS))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("Não foi possível obter o lock de migrações (outro processo migrando?).")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        aplicadas = {row[0] for row in cursor.fetchall()}
+
+        pendentes = [m for m in sorted(MIGRATIONS, key=lambda m: m[0]) if m[0] not in aplicadas]
+        for version, description, migrar in pendentes:
+            print(f"🛠️ Aplicando migração {version}: {description}")
+            migrar(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description),
+            )
+            conn.commit()
+        return len(pendentes)
+    finally:
+        try:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATIONS_LOCK_NAME,))
+            cursor.fetchone()
+        except mysql.connector.Error:
+            pass
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    total = aplicar_migracoes()
+    print(f"✅ Schema atualizado ({total} migrações aplicadas).")
@@ -1,26 +1,25 @@
 import os
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import mysql.connector
 from dotenv import load_dotenv
-from authtoken import obter_token
-from datetime import datetime, timedelta, date
+from position_cache import buscar_posicoes
+from satx_client import HISTORY_POSITION_PATH, get_client
+from datetime import timedelta, date
 
 load_dotenv()
 
+# Quantas consultas HistoryPosition/List ficam em andamento ao mesmo tempo.
+ODOMETER_FETCH_CONCURRENCY = int(os.getenv("ODOMETER_FETCH_CONCURRENCY", "8"))
+
 def atualizar_odometro_para_veiculo(line_integration_code, real_departure_db, real_arrival_db, tracked_unit_integration_code, real_departure_api=None, real_arrival_api=None):
-    token = obter_token()
-    if not token:
+    client = get_client()
+    if not client.token():
         print('Token não obtido')
         return
 
     start_api = real_departure_api if real_departure_api else real_departure_db
     end_api = real_arrival_api if real_arrival_api else real_arrival_db
 
-    api_url = "https://integration.systemsatx.com.br/Controlws/HistoryPosition/List"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "TrackedUnitType": 1,
         "TrackedUnitIntegrationCode": tracked_unit_integration_code,
@@ -28,7 +27,7 @@ def atualizar_odometro_para_veiculo(line_integration_code, real_departure_db, re
         "EndDatePosition": end_api
     }
     print('Payload enviado para a API:', payload)
-    response = requests.post(api_url, headers=headers, json=payload)
+    response = client.post(HISTORY_POSITION_PATH, json=payload)
     print('Status code da resposta:', response.status_code)
     if response.text.startswith('['):
         try:
@@ -62,9 +61,9 @@ def atualizar_odometro_para_veiculo(line_integration_code, real_departure_db, re
         cursor = conn.cursor()
         cursor.execute("""
             UPDATE historico_grades
-            SET odometro = %s
+            SET odometro = %s, odometro_num = %s
             WHERE line = %s AND real_departure = %s AND real_arrival = %s
-        """, (str(odometro), line_integration_code, real_departure_db, real_arrival_db))
+        """, (str(odometro), _to_float(odometro), line_integration_code, real_departure_db, real_arrival_db))
         conn.commit()
         print(f"Odômetro atualizado para {odometro}")
         cursor.close()
@@ -80,202 +79,206 @@ def get_mysql_conn():
         password=os.getenv("POWERBI_DB_PASSWORD")
     )
 
-def get_estimated_distance(veiculo, line, real_departure, real_arrival):
+
+def _to_float(valor, padrao=None):
     try:
-        conn = get_mysql_conn()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT estimated_distance FROM historico_grades
-            WHERE real_vehicle = %s AND line = %s AND real_departure = %s AND real_arrival = %s
-        """, (veiculo, line, real_departure, real_arrival))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        if row and row[0] is not None:
-            try:
-                return float(row[0])
-            except Exception:
-                return None
-        return None
-    except Exception as e:
-        print('Erro ao buscar estimated_distance:', e)
-        return None
+        return float(valor) if valor is not None else padrao
+    except (TypeError, ValueError):
+        return padrao
+
+def carregar_viagens(cursor, datas):
+    """Viagens concluídas das datas informadas, agrupadas por veículo em ordem de saída.
+
+    Lê as colunas tipadas (real_*_dt, *_num). Cada viagem: dict com id, line,
+    data_registro, odometro (float ou None), estimated_distance (float ou None)
+    e dt_dep/dt_arr.
+    """
+    placeholders = ",".join(["%s"] * len(datas))
+    cursor.execute(f"""
+        SELECT id, real_vehicle, line, real_departure_dt, real_arrival_dt, data_registro, odometro_num, estimated_distance_num
+        FROM historico_grades
+        WHERE data_registro IN ({placeholders})
+          AND real_vehicle IS NOT NULL AND real_vehicle != ''
+          AND real_departure_dt IS NOT NULL
+          AND real_arrival_dt IS NOT NULL
+    """, tuple(datas))
+    por_veiculo = {}
+    for id_, veiculo, line, dt_dep, dt_arr, data_registro, odometro, estimated_distance in cursor.fetchall():
+        por_veiculo.setdefault(veiculo, []).append({
+            "id": id_,
+            "line": line,
+            "data_registro": data_registro,
+            "odometro": _to_float(odometro),
+            "estimated_distance": _to_float(estimated_distance),
+            "dt_dep": dt_dep,
+            "dt_arr": dt_arr,
+        })
+    for viagens in por_veiculo.values():
+        viagens.sort(key=lambda v: v["dt_dep"])
+    return por_veiculo
+
+def carregar_ultimos_odometros(cursor, antes_de):
+    """Último odômetro gravado por veículo (pela chegada) antes de `antes_de`.
+
+    Usa o índice (real_vehicle, real_arrival_dt).
+    """
+    cursor.execute("""
+        SELECT h.real_vehicle, h.odometro_num
+        FROM historico_grades h
+        JOIN (
+            SELECT real_vehicle, MAX(real_arrival_dt) AS ultima_chegada
+            FROM historico_grades
+            WHERE real_arrival_dt < %s AND odometro_num IS NOT NULL
+            GROUP BY real_vehicle
+        ) ult ON ult.real_vehicle = h.real_vehicle AND ult.ultima_chegada = h.real_arrival_dt
+        WHERE h.odometro_num IS NOT NULL
+    """, (antes_de,))
+    return {veiculo: _to_float(odometro, 0) for veiculo, odometro in cursor.fetchall()}
+
+def calcular_odometros(viagens, posicoes, ultimo_odometro):
+    """Odômetro de todas as viagens pendentes do dia numa passada vetorizada.
+
+    viagens: DataFrame (id, veiculo, dt_dep, odometro, estimated_distance) com as
+        viagens do dia; `odometro` NaN indica viagem pendente.
+    posicoes: DataFrame (id, EventDate, Odometer) com as posições de cada viagem consultada.
+    ultimo_odometro: veículo -> odômetro antes da primeira viagem do dia.
+
+    Regras (por viagem pendente): com 2+ posições soma |último - primeiro|; com
+    uma só soma a distância estimada; sem posições fica sem valor e não entra
+    na cadeia. A soma parte do odômetro da viagem anterior do mesmo veículo.
+    Retorna Series id -> odômetro.
+    """
+    import numpy as np
+    import pandas as pd
+
+    v = viagens.sort_values(["veiculo", "dt_dep"], kind="stable").reset_index(drop=True)
+
+    p = posicoes.assign(Odometer=pd.to_numeric(posicoes["Odometer"], errors="coerce"))
+    p = p.dropna(subset=["EventDate", "Odometer"]).sort_values(["id", "EventDate"], kind="stable")
+    agg = p.groupby("id")["Odometer"].agg(primeiro="first", ultimo="last", n="count")
+    v = v.join(agg, on="id")
+
+    pendente = v["odometro"].isna()
+    n = v["n"].fillna(0)
+    delta = pd.Series(
+        np.select(
+            [n >= 2, n == 1],
+            [(v["ultimo"] - v["primeiro"]).abs(), v["estimated_distance"].fillna(0)],
+            default=np.nan,
+        ),
+        index=v.index,
+    )
+    calcular = pendente & delta.notna()
+
+    # Cada viagem com odômetro já gravado reinicia a cadeia do veículo.
+    segmento = (~pendente).astype(int).groupby(v["veiculo"]).cumsum()
+    base = v["odometro"].groupby([v["veiculo"], segmento]).transform("first")
+    base = base.fillna(v["veiculo"].map(ultimo_odometro)).fillna(0)
+    acumulado = delta.where(calcular, 0).groupby([v["veiculo"], segmento]).cumsum()
+
+    odometro = (base + acumulado).abs()
+    return pd.Series(odometro[calcular].to_numpy(), index=v.loc[calcular, "id"].to_numpy())
+
+def main():
+    """Preenche o odômetro das viagens de hoje (e da última volta de ontem).
+
+    Usa uma única conexão: carrega todas as viagens de ontem e hoje numa
+    consulta, calcula o odômetro do dia inteiro de uma vez (`calcular_odometros`)
+    e grava tudo com `executemany`.
+    """
+    client = get_client()
+    if not client.token():
+        print('Token não obtido')
+        exit(1)
+
+    data_hoje = date.today()
+    data_ontem = data_hoje - timedelta(days=1)
 
-def get_last_odometro(veiculo, real_departure):
     try:
         conn = get_mysql_conn()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT odometro FROM historico_grades
-            WHERE real_vehicle = %s AND real_arrival < %s AND odometro IS NOT NULL AND odometro != ''
-            ORDER BY real_arrival DESC LIMIT 1
-        """, (veiculo, real_departure))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        if row and row[0] is not None:
-            try:
-                return float(row[0])
-            except Exception:
-                return 0
-        return 0
-    except Exception as e:
-        print('Erro ao buscar odômetro anterior:', e)
-        return 0
+    except mysql.connector.Error as e:
+        print('Erro ao conectar no banco de dados:', e)
+        return
 
-def update_odometro(veiculo, line, real_departure, real_arrival, data_registro, odometro):
     try:
-        conn = get_mysql_conn()
         cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE historico_grades
-            SET odometro = %s
-            WHERE real_vehicle = %s AND line = %s AND real_departure = %s AND real_arrival = %s AND data_registro = %s
-        """, (str(odometro), veiculo, line, real_departure, real_arrival, data_registro))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"Odômetro atualizado para {odometro} na linha {line} para o veículo {veiculo}")
-    except Exception as e:
-        print('Erro ao atualizar banco:', e)
+        viagens_por_veiculo = carregar_viagens(cursor, [data_ontem, data_hoje])
+        ultimo_odometro = carregar_ultimos_odometros(cursor, data_ontem)
 
-def main():
-    try:
-        conn = mysql.connector.connect(
-            host=os.getenv("POWERBI_DB_HOST"),
-            database=os.getenv("POWERBI_DB_NAME"),
-            user=os.getenv("POWERBI_DB_USER"),
-            password=os.getenv("POWERBI_DB_PASSWORD")
+        atualizacoes = []  # (odometro texto, odometro_num, id)
+        pendentes_hoje = []
+        for veiculo, viagens in viagens_por_veiculo.items():
+            ontem = [v for v in viagens if v["data_registro"] == data_ontem]
+            hoje = [v for v in viagens if v["data_registro"] == data_hoje]
+
+            # Volta do dia anterior: a última viagem de ontem ainda sem odômetro
+            # recebe o último odômetro conhecido + distância estimada.
+            carry = ultimo_odometro.get(veiculo, 0)
+            if ontem:
+                ultima = max(ontem, key=lambda v: v["dt_arr"])
+                for v in ontem:
+                    if v["odometro"] is not None and v is not ultima:
+                        carry = v["odometro"]
+                if ultima["odometro"] is None:
+                    ultima["odometro"] = carry + (ultima["estimated_distance"] or 0)
+                    atualizacoes.append((str(ultima["odometro"]), ultima["odometro"], ultima["id"]))
+                carry = ultima["odometro"]
+            ultimo_odometro[veiculo] = carry
+
+            for v in hoje:
+                if v["odometro"] is None:
+                    pendentes_hoje.append((veiculo, v))
+
+        # As consultas à API são independentes entre si: busca todas em paralelo e
+        # processa os resultados na ordem das viagens, pois o odômetro de cada
+        # viagem depende do das anteriores do mesmo veículo.
+        print(f"Consultando odômetro de {len(pendentes_hoje)} viagens ({ODOMETER_FETCH_CONCURRENCY} em paralelo)")
+        with ThreadPoolExecutor(max_workers=ODOMETER_FETCH_CONCURRENCY) as executor:
+            respostas = executor.map(
+                lambda p: buscar_posicoes(
+                    p[0],
+                    (p[1]["dt_dep"] + timedelta(hours=3)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                    (p[1]["dt_arr"] + timedelta(hours=3)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                ),
+                pendentes_hoje,
+            )
+            posicoes = {p[1]["id"]: r for p, r in zip(pendentes_hoje, respostas)}
+
+        import pandas as pd
+
+        viagens_hoje = pd.DataFrame(
+            [
+                (v["id"], veiculo, v["dt_dep"], v["odometro"], v["estimated_distance"])
+                for veiculo, viagens in viagens_por_veiculo.items()
+                for v in viagens
+                if v["data_registro"] == data_hoje
+            ],
+            columns=["id", "veiculo", "dt_dep", "odometro", "estimated_distance"],
+        ).astype({"odometro": float, "estimated_distance": float})
+        posicoes_df = pd.DataFrame(
+            [
+                (id_, item['EventDate'], item['Odometer'])
+                for id_, itens in posicoes.items()
+                for item in itens or []
+                if 'Odometer' in item and 'EventDate' in item
+            ],
+            columns=["id", "EventDate", "Odometer"],
         )
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT real_vehicle FROM historico_grades WHERE real_vehicle IS NOT NULL AND real_vehicle != '' AND (odometro IS NULL OR odometro = '' OR odometro = 'NULL')")
-        veiculos = [row[0] for row in cursor.fetchall()]
-        token = obter_token()
-        if not token:
-            print('Token não obtido')
-            exit(1)
-        mes = 9
-        ano = 2025
-        data_hoje = date.today()
-        data_ontem = date.today() - timedelta(days=1)
-        veiculos_linhas = []
-        for veiculo in veiculos:
-            try:
-                conn_prev = get_mysql_conn()
-                cursor_prev = conn_prev.cursor()
-                cursor_prev.execute("""
-                    SELECT line, real_departure, real_arrival, data_registro, odometro, estimated_distance
-                    FROM historico_grades
-                    WHERE real_vehicle = %s AND data_registro = %s AND real_departure IS NOT NULL AND real_arrival IS NOT NULL
-                    ORDER BY real_arrival DESC LIMIT 1
-                """, (veiculo, data_hoje))
-                row_prev = cursor_prev.fetchone()
-                if row_prev and (row_prev[4] is None or row_prev[4] == '' or row_prev[4] == 'NULL'):
-                    odometro_ant = get_last_odometro(veiculo, row_prev[2])
-                    try:
-                        estimated_distance_prev = float(row_prev[5]) if row_prev[5] is not None else 0
-                    except Exception:
-                        estimated_distance_prev = 0
-                    odometro_prev = odometro_ant + estimated_distance_prev
-                    update_odometro(veiculo, row_prev[0], row_prev[1], row_prev[2], odometro_prev)
-                cursor_prev.close()
-                conn_prev.close()
-            except Exception as e:
-                print('Erro ao preencher odômetro da volta do dia anterior:', e)
-            linhas_ord = []
-            try:
-                conn_ord = get_mysql_conn()
-                cursor_ord = conn_ord.cursor()
-                cursor_ord.execute("""
-                    SELECT line, real_departure, real_arrival, data_registro
-                    FROM historico_grades
-                    WHERE real_vehicle = %s AND real_departure IS NOT NULL AND real_arrival IS NOT NULL AND data_registro = %s AND (odometro IS NULL OR odometro = '' OR odometro = 'NULL')
-                    ORDER BY real_departure ASC
-                """, (veiculo, data_hoje))
-                linhas_ord = cursor_ord.fetchall()
-                cursor_ord.close()
-                conn_ord.close()
-            except Exception as e:
-                print('Erro ao buscar linhas ordenadas:', e)
-            for line, real_departure, real_arrival, data_registro in linhas_ord:
-                try:
-                    dt_dep = datetime.strptime(real_departure, "%d/%m/%Y %H:%M:%S") + timedelta(hours=3)
-                    dt_arr = datetime.strptime(real_arrival, "%d/%m/%Y %H:%M:%S") + timedelta(hours=3)
-                    start_iso = dt_dep.strftime("%Y-%m-%dT%H:%M:%S.000Z")
-                    end_iso = dt_arr.strftime("%Y-%m-%dT%H:%M:%S.000Z")
-                except Exception as e:
-                    print(f"Erro ao converter datas para linha {line}: {e}")
-                    continue
-                estimated_distance = get_estimated_distance(veiculo, line, real_departure, real_arrival)
-                payload = {
-                    "TrackedUnitType": 1,
-                    "TrackedUnitIntegrationCode": veiculo,
-                    "StartDatePosition": start_iso,
-                    "EndDatePosition": end_iso
-                }
-                print(f"Consultando odômetro para {veiculo} linha {line} no intervalo {start_iso} - {end_iso}")
-                headers = {
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json"
-                }
-                response = requests.post(
-                    "https://integration.systemsatx.com.br/Controlws/HistoryPosition/List",
-                    headers=headers, json=payload
-                )
-                if response.status_code == 401:
-                    print('Token expirado, obtendo novo token...')
-                    token = obter_token()
-                    if not token:
-                        print('Token não obtido')
-                        continue
-                    headers["Authorization"] = f"Bearer {token}"
-                    response = requests.post(
-                        "https://integration.systemsatx.com.br/Controlws/HistoryPosition/List",
-                        headers=headers, json=payload
-                    )
-                print('Status code da resposta:', response.status_code)
-                if response.text.startswith('['):
-                    try:
-                        data_preview = response.json()
-                        print(f'Resposta da API: {len(data_preview)} registros, primeiro: {data_preview[0] if data_preview else "vazio"}')
-                    except Exception:
-                        print('Resposta da API: erro ao processar preview')
-                else:
-                    print(f'Resposta da API: {response.text[:200]}...')
-                if response.status_code != 200:
-                    print('Erro na API:', response.status_code)
-                    continue
-                data_api = response.json()
-                odometro = None
-                if isinstance(data_api, list) and data_api:
-                    data_api_sorted = sorted([item for item in data_api if 'Odometer' in item and 'EventDate' in item], key=lambda x: x['EventDate'])
-                    if len(data_api_sorted) >= 2:
-                        odometro_ini = data_api_sorted[0]['Odometer']
-                        odometro_fim = data_api_sorted[-1]['Odometer']
-                        diff = abs(odometro_fim - odometro_ini)
-                        modo = 'real'
-                    elif len(data_api_sorted) == 1:
-                        odometro_ini = odometro_fim = data_api_sorted[0]['Odometer']
-                        diff = None
-                        modo = 'aproximado'
-                    else:
-                        print(f'Nenhum log de odômetro válido para {veiculo} linha {line}')
-                        continue
-                    odometro_ant = get_last_odometro(veiculo, real_departure)
-                    if modo == 'real' and diff is not None:
-                        odometro = abs(odometro_ant + diff)
-                    elif modo == 'aproximado' and estimated_distance is not None:
-                        odometro = abs(odometro_ant + estimated_distance)
-                    else:
-                        odometro = abs(odometro_ant)
-                elif isinstance(data_api, dict) and 'Odometer' in data_api:
-                    odometro = abs(data_api['Odometer'])
-                if odometro is None:
-                    print(f'Odômetro não encontrado para {veiculo} linha {line} no intervalo {start_iso} - {end_iso}')
-                    continue
-                update_odometro(veiculo, line, real_departure, real_arrival, data_registro, odometro)
+        odometros = calcular_odometros(viagens_hoje, posicoes_df, ultimo_odometro)
+        sem_dados = len(pendentes_hoje) - len(odometros)
+        if sem_dados:
+            print(f'Odômetro não encontrado para {sem_dados} viagens (sem posições válidas na API).')
+        atualizacoes.extend((str(float(odometro)), float(odometro), int(id_)) for id_, odometro in odometros.items())
+
+        if atualizacoes:
+            cursor.executemany("UPDATE historico_grades SET odometro = %s, odometro_num = %s WHERE id = %s", atualizacoes)
+            conn.commit()
+        print(f"Odômetro atualizado em {len(atualizacoes)} viagens.")
+        cursor.close()
     except Exception as e:
-        print('Erro ao buscar veículos:', e)
+        print('Erro ao atualizar odômetros:', e)
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
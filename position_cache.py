@@ -0,0 +1,352 @@
+"""Cache local das respostas de `Controlws/HistoryPosition/List`.
+
+odometer, routeviolation e tags pedem as posições dos mesmos veículos em
+janelas que se sobrepõem, e cada execução horária repete as viagens já
+encerradas. Este módulo guarda as posições em um SQLite local, indexadas por
+veículo e horário do evento, junto com os intervalos já cobertos; uma consulta
+só vai à API para os trechos ainda não cobertos.
+
+Trechos muito recentes (últimos POSITION_CACHE_SETTLE_MINUTES) não são marcados
+como cobertos, pois a API ainda pode receber posições atrasadas. Entradas antigas
+(POSITION_CACHE_MAX_AGE_DAYS) e o excesso acima de POSITION_CACHE_MAX_MB são
+descartados, dos mais antigos para os mais novos.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from satx_client import HISTORY_POSITION_PATH, get_client, iter_json_items
+
+POSITION_CACHE_ENABLED = os.getenv("POSITION_CACHE_ENABLED", "1") != "0"
+POSITION_CACHE_PATH = os.getenv(
+    "POSITION_CACHE_PATH", os.path.join(tempfile.gettempdir(), "satx_positions.sqlite3")
+)
+POSITION_CACHE_MAX_AGE_DAYS = float(os.getenv("POSITION_CACHE_MAX_AGE_DAYS", "7"))
+POSITION_CACHE_MAX_MB = float(os.getenv("POSITION_CACHE_MAX_MB", "512"))
+POSITION_CACHE_SETTLE_MINUTES = float(os.getenv("POSITION_CACHE_SETTLE_MINUTES", "30"))
+
+# Posições gravadas por executemany enquanto a resposta da API é lida.
+_STORE_CHUNK = 1000
+
+# Intervalo mínimo entre duas rodadas de limpeza no mesmo processo.
+_EVICT_INTERVAL_SECONDS = 600
+
+_ISO_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def _parse_iso(valor):
+    """Segundos (UTC) de uma data ISO da API; None se inválida."""
+    if not valor:
+        return None
+    try:
+        dt = datetime.strptime(str(valor)[:19], _ISO_FORMAT)
+    except ValueError:
+        return None
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _to_iso(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime(_ISO_FORMAT) + ".000Z"
+
+
+def iterar_posicoes_api(veiculo, start_iso, end_iso):
+    """Consulta a API e devolve um iterador das posições (lidas sob demanda), ou None em erro HTTP/rede.
+
+    Erros no meio do corpo (JSON truncado/inválido) surgem como ValueError ou
+    `requests.RequestException` durante a iteração.
+    """
+    payload = {
+        "TrackedUnitType": 1,
+        "TrackedUnitIntegrationCode": veiculo,
+        "StartDatePosition": start_iso,
+        "EndDatePosition": end_iso,
+    }
+    try:
+        response = get_client().post(HISTORY_POSITION_PATH, json=payload, stream=True)
+    except Exception as e:
+        logging.warning(f"Erro de rede ao consultar posições de {veiculo} ({start_iso} - {end_iso}): {e}")
+        return None
+    if response.status_code == 204:
+        response.close()
+        return iter(())
+    if response.status_code != 200:
+        logging.warning(f"Erro na API de posições para {veiculo} ({start_iso} - {end_iso}): {response.status_code}")
+        response.close()
+        return None
+    return iter_json_items(response)
+
+
+def buscar_posicoes_api(veiculo, start_iso, end_iso, filtro=None):
+    """Consulta a API diretamente: lista de posições ([] se não houver) ou None em erro.
+
+    Com `filtro`, só as posições aceitas são mantidas, já durante a leitura da resposta.
+    """
+    posicoes = iterar_posicoes_api(veiculo, start_iso, end_iso)
+    if posicoes is None:
+        return None
+    try:
+        return [item for item in posicoes if filtro is None or filtro(item)]
+    except (ValueError, requests.RequestException) as e:
+        logging.warning(f"Resposta inválida da API de posições para {veiculo} ({start_iso} - {end_iso}): {e}")
+        return None
+
+
+class PositionCache:
+    """Posições por veículo em SQLite, com controle dos intervalos já buscados."""
+
+    def __init__(
+        self,
+        path=POSITION_CACHE_PATH,
+        *,
+        max_age_days=POSITION_CACHE_MAX_AGE_DAYS,
+        max_mb=POSITION_CACHE_MAX_MB,
+        settle_minutes=POSITION_CACHE_SETTLE_MINUTES,
+        fetch=iterar_posicoes_api,
+    ):
+        self.path = path
+        self.max_age_seconds = max_age_days * 86400
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.settle_seconds = settle_minutes * 60
+        self.fetch = fetch
+        self._local = threading.local()
+        self._last_evict = 0.0
+        self._evict_lock = threading.Lock()
+
+        conn = self._connect()
+        try:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS coverage (
+                    vehicle TEXT NOT NULL,
+                    start_ts INTEGER NOT NULL,
+                    end_ts INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_coverage_vehicle ON coverage (vehicle, start_ts);
+                CREATE INDEX IF NOT EXISTS idx_coverage_fetched ON coverage (fetched_at);
+                CREATE TABLE IF NOT EXISTS positions (
+                    vehicle TEXT NOT NULL,
+                    event_ts INTEGER NOT NULL,
+                    digest TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (vehicle, event_ts, digest)
+                ) WITHOUT ROWID;
+                """
+            )
+        finally:
+            conn.close()
+
+    def get_positions(self, veiculo, start_iso, end_iso, filtro=None):
+        """Posições do veículo entre `start_iso` e `end_iso` (ordenadas por EventDate).
+
+        Busca na API apenas os trechos não cobertos; retorna None se algum
+        trecho falhar (como uma chamada direta à API falharia). Com `filtro`,
+        só as posições aceitas são decodificadas e devolvidas. Se o SQLite
+        falhar (ex.: banco ocupado além do timeout), consulta a API diretamente.
+        """
+        start_ts, end_ts = _parse_iso(start_iso), _parse_iso(end_iso)
+        if start_ts is None or end_ts is None or end_ts < start_ts:
+            return buscar_posicoes_api(veiculo, start_iso, end_iso, filtro)
+        try:
+            return self._get_positions_cached(veiculo, start_ts, end_ts, filtro)
+        except sqlite3.Error as e:
+            logging.warning(f"Cache de posições indisponível para {veiculo}: {e}; consultando a API.")
+            return buscar_posicoes_api(veiculo, start_iso, end_iso, filtro)
+
+    def _get_positions_cached(self, veiculo, start_ts, end_ts, filtro):
+        for gap_start, gap_end in self._gaps(veiculo, start_ts, end_ts):
+            posicoes = self.fetch(veiculo, _to_iso(gap_start), _to_iso(gap_end))
+            if posicoes is None:
+                return None
+            try:
+                self._store(veiculo, gap_start, gap_end, posicoes)
+            except (ValueError, requests.RequestException) as e:
+                logging.warning(f"Resposta inválida da API de posições para {veiculo}: {e}")
+                return None
+
+        rows = self._conn().execute(
+            "SELECT payload FROM positions WHERE vehicle = ? AND event_ts BETWEEN ? AND ? ORDER BY event_ts",
+            (veiculo, start_ts, end_ts),
+        )
+        resultado = []
+        for (payload,) in rows:
+            item = json.loads(payload)
+            if filtro is None or filtro(item):
+                resultado.append(item)
+        self._maybe_evict()
+        return resultado
+
+    def _gaps(self, veiculo, start_ts, end_ts):
+        """Trechos de [start_ts, end_ts] ainda não cobertos para o veículo."""
+        rows = self._conn().execute(
+            """
+            SELECT start_ts, end_ts FROM coverage
+            WHERE vehicle = ? AND start_ts <= ? AND end_ts >= ?
+            ORDER BY start_ts
+            """,
+            (veiculo, end_ts, start_ts),
+        ).fetchall()
+        gaps = []
+        cursor = start_ts
+        for cov_start, cov_end in rows:
+            if cov_start > cursor:
+                gaps.append((cursor, cov_start - 1))
+            cursor = max(cursor, cov_end + 1)
+            if cursor > end_ts:
+                break
+        if cursor <= end_ts:
+            gaps.append((cursor, end_ts))
+        return gaps
+
+    def _store(self, veiculo, start_ts, end_ts, posicoes):
+        """Grava as posições (lista ou iterador da API); o trecho só fica coberto se a leitura terminar.
+
+        Cada lote de até _STORE_CHUNK posições é lido da resposta antes de abrir
+        a transação, então o lock de escrita do SQLite nunca fica preso ao download.
+        """
+        # O fim recente da janela fica descoberto: novas posições ainda podem chegar.
+        covered_end = min(end_ts, int(time.time() - self.settle_seconds))
+
+        posicoes = iter(posicoes)
+        while True:
+            rows = []
+            for item in itertools.islice(posicoes, _STORE_CHUNK):
+                payload = json.dumps(item, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+                event_ts = _parse_iso(item.get("EventDate")) if isinstance(item, dict) else None
+                digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+                rows.append((veiculo, start_ts if event_ts is None else event_ts, digest, payload))
+            if not rows:
+                break
+            self._write(lambda conn: conn.executemany("INSERT OR IGNORE INTO positions VALUES (?, ?, ?, ?)", rows))
+
+        if covered_end >= start_ts:
+            self._write(lambda conn: conn.execute(
+                "INSERT INTO coverage (vehicle, start_ts, end_ts, fetched_at) VALUES (?, ?, ?, ?)",
+                (veiculo, start_ts, covered_end, time.time()),
+            ))
+
+    def _write(self, escrever):
+        """Executa `escrever(conn)` numa transação curta."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            escrever(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _maybe_evict(self):
+        now = time.time()
+        if now - self._last_evict < _EVICT_INTERVAL_SECONDS or not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_evict = now
+            self.evict()
+        except sqlite3.Error as e:
+            logging.warning(f"Falha ao limpar o cache de posições: {e}")
+        finally:
+            self._evict_lock.release()
+
+    def evict(self):
+        """Remove intervalos vencidos e, se o arquivo passar do limite, os mais antigos."""
+        conn = self._conn()
+        removidos = self._evict_where(conn, "fetched_at < ?", (time.time() - self.max_age_seconds,))
+        while self._used_bytes(conn) > self.max_bytes:
+            total = conn.execute("SELECT COUNT(1) FROM coverage").fetchone()[0]
+            if not total:
+                break
+            # Descarta ~10% dos intervalos mais antigos por rodada.
+            limite = conn.execute(
+                "SELECT fetched_at FROM coverage ORDER BY fetched_at LIMIT 1 OFFSET ?",
+                (max(0, total // 10),),
+            ).fetchone()[0]
+            removidos += self._evict_where(conn, "fetched_at <= ?", (limite,))
+        if removidos:
+            logging.info(f"Cache de posições: {removidos} intervalos descartados.")
+
+    def _evict_where(self, conn, condition, params):
+        """Remove os intervalos de `condition` e as posições que nenhum outro intervalo cobre.
+
+        Dois fetches simultâneos do mesmo trecho (ex.: odometer e tags_job) gravam
+        intervalos sobrepostos; o que sobra continua afirmando a cobertura, então
+        suas posições precisam ficar.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            alvos = conn.execute(f"SELECT vehicle, start_ts, end_ts FROM coverage WHERE {condition}", params).fetchall()
+            conn.execute(f"DELETE FROM coverage WHERE {condition}", params)
+            for vehicle, start_ts, end_ts in alvos:
+                conn.execute(
+                    """
+                    DELETE FROM positions
+                    WHERE vehicle = ? AND event_ts BETWEEN ? AND ?
+                      AND NOT EXISTS (
+                          SELECT 1 FROM coverage c
+                          WHERE c.vehicle = positions.vehicle
+                            AND c.start_ts <= positions.event_ts AND c.end_ts >= positions.event_ts
+                      )
+                    """,
+                    (vehicle, start_ts, end_ts),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(alvos)
+
+    @staticmethod
+    def _used_bytes(conn):
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    def _conn(self):
+        # Uma conexão por thread (odometer consulta em um pool de threads).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # O cache pode ser reconstruído a partir da API, então dispensa fsync.
+        conn.execute("PRAGMA synchronous=OFF")
+        return conn
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def buscar_posicoes(veiculo, start_iso, end_iso, filtro=None):
+    """Posições do veículo no intervalo, via cache local (ou direto da API se desativado).
+
+    Retorna a lista de posições ([] se não houver) ou None se a consulta falhar.
+    `filtro(posicao) -> bool` descarta posições antes de acumulá-las na lista.
+    """
+    global _cache
+    if not POSITION_CACHE_ENABLED:
+        return buscar_posicoes_api(veiculo, start_iso, end_iso, filtro)
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = PositionCache()
+            except sqlite3.Error as e:
+                logging.warning(f"Cache de posições indisponível ({POSITION_CACHE_PATH}): {e}")
+                return buscar_posicoes_api(veiculo, start_iso, end_iso, filtro)
+    return _cache.get_positions(veiculo, start_iso, end_iso, filtro)
@@ -2,21 +2,29 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
-import requests
 import datetime
 import mysql.connector
 import pytz
-from authtoken import obter_token
+from satx_client import GRID_LIST_PATH, get_client, iter_json_items
+
+def codigos_presentes_e_cancelados(resp):
+    """Lê a grade do dia item a item e guarda só os códigos de rota (presentes e cancelados)."""
+    presentes, cancelados = set(), set()
+    for item in iter_json_items(resp):
+        code = item.get('RouteIntegrationCode')
+        if not code:
+            continue
+        presentes.add(code)
+        if item.get('IsTripCanceled') is True:
+            cancelados.add(code)
+    return presentes, cancelados
 
 def remover_rotas_canceladas(dias_verificar=10):
-    token = obter_token()
-    if not token:
+    client = get_client()
+    if not client.token():
         print("Não foi possível obter token.")
         return
 
-    api_url = "https://integration.systemsatx.com.br/GlobalBus/Grid/List?paramClientIntegrationCode=1003"
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-
     try:
         conn = mysql.connector.connect(
             host=os.getenv("POWERBI_DB_HOST"),
@@ -40,27 +48,24 @@ def remover_rotas_canceladas(dias_verificar=10):
         data_iso = data_alvo.strftime("%Y-%m-%dT00:00:00Z")
         payload = [{"PropertyName": "EffectiveDate", "Condition": "Equal", "Value": data_iso}]
         try:
-            resp = requests.post(api_url, headers=headers, json=payload, timeout=30)
+            resp = client.post(GRID_LIST_PATH, params={"paramClientIntegrationCode": 1003}, json=payload, stream=True)
         except Exception as e:
             print(f"Erro ao consultar API para {data_alvo.date()}: {e}")
             continue
 
         if resp.status_code != 200:
             print(f"API retornou {resp.status_code} para {data_alvo.date()}")
+            resp.close()
             continue
 
         try:
-            items = resp.json()
+            api_present, api_canceled = codigos_presentes_e_cancelados(resp)
         except Exception:
             continue
 
-        api_present = {it.get('RouteIntegrationCode') for it in items if it.get('RouteIntegrationCode')}
-
-        for item in items:
-            if item.get('IsTripCanceled') is True:
-                code = item.get('RouteIntegrationCode')
-                if code and code in routes_in_db:
-                    canceled_map.setdefault(code, set()).add(data_alvo.date())
+        for code in api_canceled:
+            if code in routes_in_db:
+                canceled_map.setdefault(code, set()).add(data_alvo.date())
 
         cursor.execute("SELECT DISTINCT route_integration_code FROM historico_grades WHERE data_registro = %s", (data_alvo.date(),))
         db_codes_date = {row[0] for row in cursor.fetchall() if row[0]}
@@ -109,14 +114,11 @@ def remover_rotas_canceladas(dias_verificar=10):
     print("Remoção concluída.")
 
 def remover_rotas_canceladas_informacoes(dias_verificar=10):
-    token = obter_token()
-    if not token:
+    client = get_client()
+    if not client.token():
         print("Não foi possível obter token.")
         return
 
-    api_url = "https://integration.systemsatx.com.br/GlobalBus/Grid/List?paramClientIntegrationCode=1003"
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-
     try:
         conn = mysql.connector.connect(
             host=os.getenv("POWERBI_DB_HOST"),
@@ -150,29 +152,27 @@ def remover_rotas_canceladas_informacoes(dias_verificar=10):
         data_iso = data_alvo.strftime("%Y-%m-%dT00:00:00Z")
         payload = [{"PropertyName": "EffectiveDate", "Condition": "Equal", "Value": data_iso}]
         try:
-            resp = requests.post(api_url, headers=headers, json=payload, timeout=30)
+            resp = client.post(GRID_LIST_PATH, params={"paramClientIntegrationCode": 1003}, json=payload, stream=True)
         except Exception as e:
             print(f"Erro ao consultar API para {data_alvo.date()}: {e}")
             continue
 
         if resp.status_code != 200:
             print(f"API retornou {resp.status_code} para {data_alvo.date()}")
+            resp.close()
             continue
 
         try:
-            items = resp.json()
+            api_present_codes, api_canceled_codes = codigos_presentes_e_cancelados(resp)
         except Exception:
             continue
 
-        api_present_codes = {it.get('RouteIntegrationCode') for it in items if it.get('RouteIntegrationCode')}
         api_present_names = {code_to_name.get(c) for c in api_present_codes if code_to_name.get(c)}
 
-        for item in items:
-            if item.get('IsTripCanceled') is True:
-                code = item.get('RouteIntegrationCode')
-                route_name = code_to_name.get(code)
-                if route_name and route_name in route_names_set:
-                    canceled_map.setdefault(route_name, set()).add(data_alvo.date())
+        for code in api_canceled_codes:
+            route_name = code_to_name.get(code)
+            if route_name and route_name in route_names_set:
+                canceled_map.setdefault(route_name, set()).add(data_alvo.date())
 
         try:
             cursor.execute("SELECT DISTINCT RouteName FROM informacoes WHERE data_execucao = %s", (data_alvo.date(),))
@@ -198,7 +198,7 @@ def remover_rotas_canceladas_informacoes(dias_verificar=10):
             for dt in dates:
                 try:
                     cursor.execute(
-                        "DELETE FROM informacoes WHERE TRIM(LOWER(RouteName)) = TRIM(LOWER(%s)) AND data_execucao = %s",
+                        "DELETE FROM informacoes WHERE route_name_norm = TRIM(LOWER(%s)) AND data_execucao = %s",
                         (route_name, dt)
                     )
                     print(f"  - {route_name} removida de informacoes em {dt} (cancelada)")
@@ -212,7 +212,7 @@ def remover_rotas_canceladas_informacoes(dias_verificar=10):
             for dt in dates:
                 try:
                     cursor.execute(
-                        "DELETE FROM informacoes WHERE TRIM(LOWER(RouteName)) = TRIM(LOWER(%s)) AND data_execucao = %s",
+                        "DELETE FROM informacoes WHERE route_name_norm = TRIM(LOWER(%s)) AND data_execucao = %s",
                         (route_name, dt)
                     )
                     print(f"  - {route_name} removida de informacoes em {dt} (ausente na API)")
@@ -4,8 +4,11 @@ load_dotenv()
 
 import requests
 import mysql.connector
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from authtoken import obter_token
+from position_cache import buscar_posicoes
+from satx_client import TRIPS_NON_CONFORMITY_PATH, TokenBucket, get_client
 import time
 from dateutil import parser
 import pytz
@@ -16,8 +19,7 @@ def routeviolation(token):
     parana_tz = pytz.timezone("America/Sao_Paulo")
     hoje = datetime.now(parana_tz).date()
 
-    url = "https://integration.systemsatx.com.br/GlobalBus/Trip/TripsWithNonConformity"
-    headers = {"Authorization": f"Bearer {token}"}
+    client = get_client()
 
     try:
         conn = mysql.connector.connect(
@@ -28,27 +30,6 @@ def routeviolation(token):
         )
         cursor = conn.cursor()
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS informacoes (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                LineName VARCHAR(255),
-                RouteName VARCHAR(255),
-                Direction VARCHAR(255),
-                RealVehicle VARCHAR(255),
-                url VARCHAR(512),
-                data_execucao DATE,
-                violation_type VARCHAR(255),
-                UNIQUE (RouteName, data_execucao)
-            )
-        """)
-
-        for coluna in ['url', 'violation_type']:
-            try:
-                cursor.execute(f"ALTER TABLE informacoes ADD COLUMN {coluna} VARCHAR(512)")
-            except mysql.connector.Error as err:
-                if err.errno != 1060:
-                    raise
-
         initial_date = f"{hoje}T00:00:00.000Z"
         final_date = f"{hoje}T23:59:59.999Z"
 
@@ -61,7 +42,7 @@ def routeviolation(token):
             "InconformityType": 1
         }
 
-        response = requests.post(url, json=payload, headers=headers)
+        response = client.post(TRIPS_NON_CONFORMITY_PATH, json=payload)
         response.raise_for_status()
         data = response.json()
 
@@ -112,7 +93,123 @@ def routeviolation(token):
     except requests.exceptions.RequestException as e:
         print("❌ Erro na requisição:", e)
 
-def refresh_mv():
+MV_TABLE = "informacoes_com_cliente_mv"
+# Reconstrução completa periódica: cobre remoções em historico_grades que não
+# deixam rastro em `atualizado_em`.
+MV_FULL_REFRESH_HOURS = float(os.getenv("MV_FULL_REFRESH_HOURS", "24"))
+
+# Linha da MV por ocorrência em informacoes: junta com o registro mais recente
+# (maior id) da mesma rota normalizada/data em historico_grades.
+_MV_SELECT = """
+    SELECT
+        i.id,
+        i.LineName,
+        i.RouteName,
+        i.Direction,
+        i.RealVehicle,
+        i.data_execucao,
+        i.url,
+        i.violation_type,
+        h.client_name AS client_name,
+        h.real_departure,
+        h.real_arrival,
+        h.id AS id_grade
+    FROM informacoes i
+    {join_chaves}
+    JOIN historico_grades h ON h.id = (
+        SELECT MAX(hg.id)
+        FROM historico_grades hg
+        WHERE hg.route_name_norm = i.route_name_norm AND hg.data_registro = i.data_execucao
+    )
+    WHERE h.real_departure_dt IS NOT NULL
+"""
+
+def _ler_watermark(cursor, nome):
+    cursor.execute("SELECT valor FROM mv_watermarks WHERE nome = %s", (nome,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _gravar_watermark(cursor, nome, valor):
+    cursor.execute(
+        "INSERT INTO mv_watermarks (nome, valor) VALUES (%s, %s) ON DUPLICATE KEY UPDATE valor = VALUES(valor)",
+        (nome, valor),
+    )
+
+def _reconstruir_mv(conn, cursor, agora):
+    """Monta a MV inteira numa tabela sombra e troca as duas com RENAME TABLE (atômico)."""
+    cursor.execute(f"DROP TABLE IF EXISTS {MV_TABLE}_novo")
+    cursor.execute(f"DROP TABLE IF EXISTS {MV_TABLE}_antigo")
+    cursor.execute(f"CREATE TABLE {MV_TABLE}_novo LIKE {MV_TABLE}")
+    cursor.execute(f"INSERT INTO {MV_TABLE}_novo " + _MV_SELECT.format(join_chaves=""))
+    conn.commit()
+    cursor.execute(f"RENAME TABLE {MV_TABLE} TO {MV_TABLE}_antigo, {MV_TABLE}_novo TO {MV_TABLE}")
+    cursor.execute(f"DROP TABLE {MV_TABLE}_antigo")
+    _gravar_watermark(cursor, "mv_completo", agora)
+    _gravar_watermark(cursor, "mv_incremental", agora)
+    conn.commit()
+
+def _atualizar_mv_incremental(conn, cursor, desde, agora):
+    """Recalcula só as rotas/datas alteradas desde `desde`, numa única transação.
+
+    Retorna quantas chaves (rota normalizada, data) foram recalculadas.
+    """
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS mv_chaves")
+    cursor.execute("""
+        CREATE TEMPORARY TABLE mv_chaves (
+            route_name_norm VARCHAR(255) NOT NULL,
+            data DATE NOT NULL,
+            PRIMARY KEY (route_name_norm, data)
+        )
+    """)
+    cursor.execute("""
+        INSERT IGNORE INTO mv_chaves
+        SELECT route_name_norm, data_execucao FROM informacoes
+        WHERE atualizado_em >= %s AND route_name_norm IS NOT NULL AND data_execucao IS NOT NULL
+    """, (desde,))
+    cursor.execute("""
+        INSERT IGNORE INTO mv_chaves
+        SELECT route_name_norm, data_registro FROM historico_grades
+        WHERE atualizado_em >= %s AND route_name_norm IS NOT NULL AND data_registro IS NOT NULL
+    """, (desde,))
+    # Grades removidas (ex.: rotas canceladas): a ocorrência pode passar a usar outra grade.
+    cursor.execute(f"""
+        INSERT IGNORE INTO mv_chaves
+        SELECT i.route_name_norm, i.data_execucao
+        FROM {MV_TABLE} mv
+        JOIN informacoes i ON i.id = mv.id
+        LEFT JOIN historico_grades h ON h.id = mv.id_grade
+        WHERE h.id IS NULL AND i.route_name_norm IS NOT NULL AND i.data_execucao IS NOT NULL
+    """)
+    cursor.execute("SELECT COUNT(1) FROM mv_chaves")
+    total_chaves = cursor.fetchone()[0]
+
+    cursor.execute(f"""
+        DELETE mv FROM {MV_TABLE} mv
+        JOIN informacoes i ON i.id = mv.id
+        JOIN mv_chaves k ON k.route_name_norm = i.route_name_norm AND k.data = i.data_execucao
+    """)
+    # Ocorrências removidas de informacoes.
+    cursor.execute(f"""
+        DELETE mv FROM {MV_TABLE} mv
+        LEFT JOIN informacoes i ON i.id = mv.id
+        WHERE i.id IS NULL
+    """)
+    cursor.execute(f"INSERT INTO {MV_TABLE} " + _MV_SELECT.format(
+        join_chaves="JOIN mv_chaves k ON k.route_name_norm = i.route_name_norm AND k.data = i.data_execucao"
+    ))
+    _gravar_watermark(cursor, "mv_incremental", agora)
+    conn.commit()
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS mv_chaves")
+    return total_chaves
+
+def refresh_mv(completo=False):
+    """Atualiza informacoes_com_cliente_mv.
+
+    Normalmente recalcula só as rotas/datas alteradas desde a última execução
+    (watermark em mv_watermarks), em uma transação. Na primeira execução, a cada
+    MV_FULL_REFRESH_HOURS ou com `completo=True`, reconstrói a MV numa tabela
+    sombra e a troca atomicamente: o Power BI nunca lê uma tabela pela metade.
+    """
     try:
         conn = mysql.connector.connect(
             host=os.getenv("POWERBI_DB_HOST"),
@@ -124,65 +221,70 @@ def refresh_mv():
 
         print(f"🔄 Atualizando a Materialized View (MV) às {datetime.now()}...")
 
-        cursor.execute("TRUNCATE TABLE informacoes_com_cliente_mv;")
-        conn.commit()
-
-        # Processar em lotes menores para evitar timeouts no servidor
-        cursor.execute("SELECT COUNT(*) FROM informacoes;")
-        total = cursor.fetchone()[0]
-        batch_size = 500
-        offset = 0
-
-        while offset < total:
-            cursor.execute("SELECT id FROM informacoes ORDER BY id LIMIT %s OFFSET %s", (batch_size, offset))
-            ids = [row[0] for row in cursor.fetchall()]
-            if not ids:
-                break
+        # Relógio do banco: o mesmo de `atualizado_em`. Alterações feitas durante
+        # esta execução ficam >= agora e são reprocessadas na próxima.
+        cursor.execute("SELECT NOW()")
+        agora = cursor.fetchone()[0]
+        ultimo_completo = _ler_watermark(cursor, "mv_completo")
+        desde = _ler_watermark(cursor, "mv_incremental")
 
-            placeholders = ",".join(["%s"] * len(ids))
-
-            insert_sql = f"""
-                INSERT INTO informacoes_com_cliente_mv
-                SELECT 
-                    i.id,
-                    i.LineName,
-                    i.RouteName,
-                    i.Direction,
-                    i.RealVehicle,
-                    i.data_execucao,
-                    i.url,
-                    i.violation_type,
-                    h.client_name AS client_name,
-                    h.real_departure,
-                    h.real_arrival,
-                    h.id AS id_grade
-                FROM 
-                    u834686159_powerbi.informacoes i
-                JOIN (
-                    -- pega apenas o registro mais recente por rota/data na historico_grades
-                    SELECT hg.*
-                    FROM u834686159_powerbi.historico_grades hg
-                    JOIN (
-                        SELECT TRIM(LOWER(route_name)) AS route_name_norm, data_registro, MAX(id) AS max_id
-                        FROM u834686159_powerbi.historico_grades
-                        GROUP BY TRIM(LOWER(route_name)), data_registro
-                    ) latest
-                    ON TRIM(LOWER(hg.route_name)) = latest.route_name_norm AND hg.data_registro = latest.data_registro AND hg.id = latest.max_id
-                ) h ON TRIM(LOWER(i.RouteName)) = TRIM(LOWER(h.route_name)) AND i.data_execucao = h.data_registro
-                WHERE i.id IN ({placeholders}) AND h.id IS NOT NULL AND h.real_departure IS NOT NULL;
-            """
-
-            cursor.execute(insert_sql, tuple(ids))
-            conn.commit()
-
-            offset += batch_size
-
-        print("✅ MV atualizada com sucesso.")
+        if completo or desde is None or ultimo_completo is None or (agora - ultimo_completo) >= timedelta(hours=MV_FULL_REFRESH_HOURS):
+            _reconstruir_mv(conn, cursor, agora)
+            print("✅ MV reconstruída por completo.")
+        else:
+            total = _atualizar_mv_incremental(conn, cursor, desde, agora)
+            print(f"✅ MV atualizada com sucesso ({total} rotas/datas recalculadas).")
+        cursor.close()
         conn.close()
 
     except Exception as e:
         print(f"❌ Erro ao atualizar a MV: {e}")
 
+VIOLACAO_LOTE = int(os.getenv("VIOLACAO_LOTE", "200"))
+VIOLACAO_FETCH_CONCURRENCY = int(os.getenv("VIOLACAO_FETCH_CONCURRENCY", "4"))
+# Orçamento de consultas de posições à API (token bucket), no lugar do antigo sleep(1) por rota.
+VIOLACAO_REQUISICOES_POR_SEGUNDO = float(os.getenv("VIOLACAO_REQUISICOES_POR_SEGUNDO", "2"))
+VIOLACAO_RAJADA = int(os.getenv("VIOLACAO_RAJADA", "4"))
+
+GRADE_AUSENTE = "Dados Inconsistentes (grade ausente)"
+
+def _classificar_violacao(reg, limitador, parana_tz):
+    """Tipo de violação da ocorrência a partir das posições no trajeto; None se não houver posições."""
+    vehicle_code = reg['RealVehicle']
+    start = reg['real_departure']
+    end = reg['real_arrival']
+    if not (vehicle_code and start and end):
+        return None
+
+    start_dt = parser.parse(start, dayfirst=True) if isinstance(start, str) else start
+    end_dt = parser.parse(end, dayfirst=True) if isinstance(end, str) else end
+
+    if getattr(start_dt, 'tzinfo', None) is None:
+        start_dt = parana_tz.localize(start_dt)
+    else:
+        start_dt = start_dt.astimezone(parana_tz)
+    if getattr(end_dt, 'tzinfo', None) is None:
+        end_dt = parana_tz.localize(end_dt)
+    else:
+        end_dt = end_dt.astimezone(parana_tz)
+
+    start_utc = start_dt.astimezone(pytz.utc)
+    end_utc = end_dt.astimezone(pytz.utc)
+
+    limitador.acquire()
+    positions = buscar_posicoes(
+        vehicle_code,
+        start_utc.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        end_utc.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+    )
+    if not positions:
+        return None
+
+    for pos in positions:
+        if pos.get("Velocity", 0) > 70:
+            return "Velocidade Excedida"
+    return "Desvio de Rota"
+
 def verificar_violações_por_velocidade(token):
     def conectar_mysql():
         return mysql.connector.connect(
@@ -193,123 +295,67 @@ def verificar_violações_por_velocidade(token):
         )
 
     parana_tz = pytz.timezone("America/Sao_Paulo")
+    limitador = TokenBucket(VIOLACAO_REQUISICOES_POR_SEGUNDO, VIOLACAO_RAJADA)
 
     conn = conectar_mysql()
     cursor = conn.cursor(dictionary=True)
 
-    batch_size = 10  # Reduzido para evitar timeout
-    offset = 0
+    ultimo_id = 0
     lote = 1
-    while True:
-        print(f"🔹 Processando lote {lote} (offset {offset})...")
-        cursor.execute("""
-            SELECT id AS informacoes_id, RealVehicle, real_departure, real_arrival, RouteName, violation_type, id_grade
-            FROM informacoes_com_cliente_mv
-            WHERE real_departure IS NOT NULL AND real_arrival IS NOT NULL
-            LIMIT %s OFFSET %s
-        """, (batch_size, offset))
-        registros = cursor.fetchall()
-        if not registros:
-            break
-
-        for reg in registros:
-            if reg.get('violation_type'):
-                print(f"⏩ Pulando {reg['RouteName']} ({reg['RealVehicle']}) — violação já registrada: {reg['violation_type']}")
-                continue
-
-            try:
-                informacoes_id = reg.get('informacoes_id')
-                id_grade = reg.get('id_grade')
-
-                if id_grade is None:
-                    print(f"⚠️ ID_GRADE ausente na MV para informacoes_id={informacoes_id}; marcando como inconsistente.")
-                    cursor.execute("UPDATE informacoes SET violation_type = %s WHERE id = %s", ("Dados Inconsistentes (grade ausente)", informacoes_id))
-                    conn.commit()
-                    continue
-
-                validate_cursor = conn.cursor()
-                validate_cursor.execute("SELECT COUNT(*) FROM u834686159_powerbi.historico_grades WHERE id = %s", (id_grade,))
-                exists = validate_cursor.fetchone()[0] > 0
-                validate_cursor.close()
-
-                if not exists:
-                    print(f"⚠️ Grade id={id_grade} não encontrada para informacoes_id={informacoes_id}; marcando como inconsistente.")
-                    cursor.execute("UPDATE informacoes SET violation_type = %s WHERE id = %s", ("Dados Inconsistentes (grade ausente)", informacoes_id))
-                    conn.commit()
-                    continue
-
-                vehicle_code = reg['RealVehicle']
-                start = reg['real_departure']
-                end = reg['real_arrival']
-                route_name = reg['RouteName']
-
-                if not (vehicle_code and start and end):
-                    continue
-
-                start_dt = parser.parse(start, dayfirst=True) if isinstance(start, str) else start
-                end_dt = parser.parse(end, dayfirst=True) if isinstance(end, str) else end
-
-                if getattr(start_dt, 'tzinfo', None) is None:
-                    start_dt = parana_tz.localize(start_dt)
-                else:
-                    start_dt = start_dt.astimezone(parana_tz)
-                if getattr(end_dt, 'tzinfo', None) is None:
-                    end_dt = parana_tz.localize(end_dt)
+    with ThreadPoolExecutor(max_workers=max(1, VIOLACAO_FETCH_CONCURRENCY)) as executor:
+        while True:
+            print(f"🔹 Processando lote {lote} (a partir do id {ultimo_id})...")
+            # Só ocorrências ainda sem classificação (violation_type lido de informacoes,
+            # não da MV, que só é atualizada no próximo refresh). O LEFT JOIN valida
+            # a existência da grade para o lote inteiro.
+            cursor.execute(f"""
+                SELECT mv.id AS informacoes_id, mv.RealVehicle, mv.real_departure, mv.real_arrival,
+                       mv.RouteName, mv.id_grade, h.id AS grade_encontrada
+                FROM {MV_TABLE} mv
+                JOIN informacoes i ON i.id = mv.id
+                LEFT JOIN historico_grades h ON h.id = mv.id_grade
+                WHERE mv.id > %s
+                  AND mv.real_departure IS NOT NULL AND mv.real_arrival IS NOT NULL
+                  AND (i.violation_type IS NULL OR i.violation_type = '')
+                ORDER BY mv.id
+                LIMIT %s
+            """, (ultimo_id, VIOLACAO_LOTE))
+            registros = cursor.fetchall()
+            if not registros:
+                break
+            ultimo_id = registros[-1]['informacoes_id']
+
+            atualizacoes = []
+            pendentes = []
+            for reg in registros:
+                if reg.get('id_grade') is None or reg.get('grade_encontrada') is None:
+                    print(f"⚠️ Grade id={reg.get('id_grade')} não encontrada para informacoes_id={reg['informacoes_id']}; marcando como inconsistente.")
+                    atualizacoes.append((GRADE_AUSENTE, reg['informacoes_id']))
                 else:
-                    end_dt = end_dt.astimezone(parana_tz)
-
-                start_utc = start_dt.astimezone(pytz.utc)
-                end_utc = end_dt.astimezone(pytz.utc)
-
-                payload = {
-                    "TrackedUnitType": 1,
-                    "TrackedUnitIntegrationCode": vehicle_code,
-                    "StartDatePosition": start_utc.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-                    "EndDatePosition": end_utc.strftime("%Y-%m-%dT%H:%M:%S.000Z")
-                }
+                    pendentes.append(reg)
 
-                headers = {"Authorization": f"Bearer {token}"}
-
-                response = requests.post(
-                    "https://integration.systemsatx.com.br/Controlws/HistoryPosition/List",
-                    json=payload,
-                    headers=headers
-                )
-
-                if response.status_code == 204:
-                    continue
-                elif response.status_code == 200 and response.content:
-                    try:
-                        positions = response.json()
-                    except Exception:
-                        continue
-                else:
+            futuros = [(reg, executor.submit(_classificar_violacao, reg, limitador, parana_tz)) for reg in pendentes]
+            for reg, futuro in futuros:
+                try:
+                    violacao = futuro.result()
+                except Exception as e:
+                    print(f"💥 Erro inesperado na rota {reg.get('RouteName')} ({reg.get('RealVehicle')}): {e}")
                     continue
+                if violacao:
+                    atualizacoes.append((violacao, reg['informacoes_id']))
 
-                violacao = "Desvio de Rota"
-                for pos in positions:
-                    if pos.get("Velocity", 0) > 70:
-                        violacao = "Velocidade Excedida"
-                        break
-
+            if atualizacoes:
                 try:
                     conn.ping(reconnect=True)
                 except Exception:
                     conn = conectar_mysql()
                     cursor = conn.cursor(dictionary=True)
-
-                cursor.execute("UPDATE informacoes SET violation_type = %s WHERE id = %s", (violacao, informacoes_id))
+                cursor.executemany("UPDATE informacoes SET violation_type = %s WHERE id = %s", atualizacoes)
                 conn.commit()
+            print(f"✅ Lote {lote}: {len(atualizacoes)} de {len(registros)} ocorrências classificadas.")
+            lote += 1
 
-                time.sleep(1)
-
-            except Exception as e:
-                print(f"💥 Erro inesperado na rota {reg.get('RouteName')} ({reg.get('RealVehicle')}): {e}")
-                continue
-
-        offset += batch_size
-        lote += 1
-
+    cursor.close()
     conn.close()
 
 def iniciar_agendador():
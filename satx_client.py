@@ -0,0 +1,334 @@
+"""Cliente HTTP compartilhado da API systemsatx.
+
+Todos os jobs de ingestão (grid, odômetro, violações, tags, remoção de rotas)
+passam por aqui para reaproveitar conexões keep-alive e ter o mesmo tratamento de:
+- timeout de conexão/leitura
+- retry com backoff exponencial em 429/5xx e falhas de rede
+- novo login transparente quando a API responde 401
+- limite de requisições simultâneas ao mesmo servidor
+
+Há uma variante síncrona (`SatxClient`, via requests.Session) e uma asyncio
+(`AsyncSatxClient`, via aiohttp). `iter_json_items` lê respostas grandes
+(HistoryPosition, Grid) item a item, sem materializar o corpo inteiro.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import ijson
+except ImportError:  # opcional: sem ijson, o corpo é lido de uma vez com response.json()
+    ijson = None
+
+from authtoken import invalidar_token, obter_token
+
+BASE_URL = "https://integration.systemsatx.com.br"
+
+GRID_LIST_PATH = "/GlobalBus/Grid/List"
+HISTORY_POSITION_PATH = "/Controlws/HistoryPosition/List"
+TRIPS_NON_CONFORMITY_PATH = "/GlobalBus/Trip/TripsWithNonConformity"
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("SATX_MAX_CONCURRENCY", "8"))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("SATX_CONNECT_TIMEOUT_SECONDS", "10"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("SATX_READ_TIMEOUT_SECONDS", "120"))
+DEFAULT_MAX_RETRIES = int(os.getenv("SATX_MAX_RETRIES", "3"))
+DEFAULT_BACKOFF_SECONDS = float(os.getenv("SATX_BACKOFF_SECONDS", "1"))
+
+
+class _TokenHolder:
+    """Acesso ao token em cache do processo (ver `authtoken.obter_token`)."""
+
+    def __init__(self, token_provider, invalidate):
+        self._provider = token_provider
+        self._invalidate = invalidate
+
+    def get(self):
+        return self._provider()
+
+    def renew(self, rejected):
+        """Obtém novo token após um 401; vários 401 do mesmo token fazem um só login."""
+        self._invalidate(rejected)
+        return self._provider()
+
+
+def _retry_delay(attempt, backoff, retry_after=None):
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt)
+
+
+class _ChunkReader:
+    """Arquivo somente leitura sobre `response.iter_content` (já descomprimido), para o ijson."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def _fill(self):
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer += chunk
+                return True
+        return False
+
+    def first_byte(self):
+        """Primeiro caractere não branco do corpo (sem consumi-lo); b"" se vazio."""
+        while True:
+            self._buffer = self._buffer.lstrip()
+            if self._buffer:
+                return self._buffer[:1]
+            if not self._fill():
+                return b""
+
+    def read(self, size=-1):
+        if not self._buffer:
+            self._fill()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def iter_json_items(response):
+    """Itens de uma resposta JSON: os elementos de um array, ou o próprio objeto.
+
+    Com ijson, o corpo é decodificado incrementalmente (use `post(..., stream=True)`),
+    então o consumidor pode filtrar sem manter o payload inteiro em memória.
+    Corpo vazio não gera itens; JSON inválido levanta ValueError.
+    """
+    if ijson is None:
+        if not response.content:
+            return
+        data = response.json()
+        if isinstance(data, list):
+            yield from data
+        elif data is not None:
+            yield data
+        return
+
+    reader = _ChunkReader(response.iter_content(chunk_size=STREAM_CHUNK_BYTES))
+    try:
+        primeiro = reader.first_byte()
+        if not primeiro:
+            return
+        prefixo = "item" if primeiro == b"[" else ""
+        try:
+            yield from ijson.items(reader, prefixo, use_float=True)
+        except ijson.JSONError as e:
+            raise ValueError(f"JSON inválido na resposta: {e}") from e
+    finally:
+        response.close()
+
+
+class TokenBucket:
+    """Limitador de taxa (token bucket) compartilhável entre threads.
+
+    Libera até `capacity` chamadas de uma vez e, em regime, `rate` por segundo.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloqueia até haver uma ficha disponível (sem limite se rate <= 0)."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (agora - self._updated) * self.rate)
+                self._updated = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.rate
+            time.sleep(espera)
+
+
+class SatxClient:
+    """Cliente síncrono com pool de conexões keep-alive (thread-safe)."""
+
+    def __init__(
+        self,
+        *,
+        token_provider=obter_token,
+        invalidate_token=invalidar_token,
+        base_url=BASE_URL,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._tokens = _TokenHolder(token_provider, invalidate_token)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json", "Accept-Encoding": "gzip, deflate"})
+
+    def token(self):
+        """Token atual (faz login se necessário); None se a autenticação falhar."""
+        return self._tokens.get()
+
+    def post(self, path, *, json=None, params=None, stream=False):
+        """POST autenticado com retry; retorna a última resposta obtida.
+
+        Levanta `requests.RequestException` se a rede falhar em todas as tentativas.
+        """
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        current = self._tokens.get()
+        reauthenticated = False
+        attempt = 0
+        while True:
+            headers = {"Authorization": f"Bearer {current}"} if current else {}
+            try:
+                with self._slots:
+                    response = self.session.post(
+                        url, json=json, params=params, headers=headers, timeout=self.timeout, stream=stream
+                    )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = _retry_delay(attempt, self.backoff_seconds)
+                logging.warning(f"SATX {path}: falha de rede ({e}); nova tentativa em {delay:.1f}s.")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            if response.status_code == 401 and not reauthenticated:
+                response.close()
+                logging.info(f"SATX {path}: token rejeitado (401); autenticando novamente.")
+                current = self._tokens.renew(current)
+                reauthenticated = True
+                continue
+
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                delay = _retry_delay(attempt, self.backoff_seconds, response.headers.get("Retry-After"))
+                response.close()
+                logging.warning(f"SATX {path}: HTTP {response.status_code}; nova tentativa em {delay:.1f}s.")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            return response
+
+
+class AsyncSatxClient:
+    """Variante asyncio (aiohttp) com o mesmo comportamento de retry/reautenticação.
+
+    Uso:
+
+        async with AsyncSatxClient() as client:
+            status, data = await client.post_json(HISTORY_POSITION_PATH, json=payload)
+    """
+
+    def __init__(
+        self,
+        *,
+        token_provider=obter_token,
+        invalidate_token=invalidar_token,
+        base_url=BASE_URL,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._tokens = _TokenHolder(token_provider, invalidate_token)
+        self._session = None
+        self._slots = None
+
+    async def __aenter__(self):
+        import aiohttp
+
+        connect_timeout, read_timeout = self.timeout
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+            headers={"Content-Type": "application/json", "Accept-Encoding": "gzip, deflate"},
+        )
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        self._session = None
+
+    async def post_json(self, path, *, json=None, params=None):
+        """POST autenticado com retry; retorna (status, corpo JSON ou None)."""
+        import aiohttp
+
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        current = await asyncio.to_thread(self._tokens.get)
+        reauthenticated = False
+        attempt = 0
+        while True:
+            headers = {"Authorization": f"Bearer {current}"} if current else {}
+            try:
+                async with self._slots:
+                    async with self._session.post(url, json=json, params=params, headers=headers) as response:
+                        status = response.status
+                        retry_after = response.headers.get("Retry-After")
+                        data = await response.json(content_type=None) if status == 200 else None
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = _retry_delay(attempt, self.backoff_seconds)
+                logging.warning(f"SATX {path}: falha de rede ({e}); nova tentativa em {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            if status == 401 and not reauthenticated:
+                logging.info(f"SATX {path}: token rejeitado (401); autenticando novamente.")
+                current = await asyncio.to_thread(self._tokens.renew, current)
+                reauthenticated = True
+                continue
+
+            if status in RETRY_STATUS and attempt < self.max_retries:
+                delay = _retry_delay(attempt, self.backoff_seconds, retry_after)
+                logging.warning(f"SATX {path}: HTTP {status}; nova tentativa em {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            return status, data
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Cliente síncrono compartilhado pelo processo (um pool de conexões para todos os jobs)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SatxClient()
+        return _client
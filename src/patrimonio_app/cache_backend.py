@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Protocol
+
+from .settings import CacheSettings
+
+
+class CacheBackend(Protocol):
+    """Armazenamento versionado compartilhado pelos caches em memória.
+
+    Cada chave guarda um payload JSON e um contador de versão. Os caches comparam
+    a versão a cada leitura: se outro processo publicou algo mais novo, adotam o
+    payload publicado em vez de recarregar do MySQL.
+    """
+
+    def version(self, key: str) -> int: ...
+
+    def load(self, key: str) -> tuple[int, Any]: ...
+
+    def publish(self, key: str, payload: Any) -> int: ...
+
+    def update(self, key: str, mutate: Callable[[Any], Any]) -> tuple[int, int, Any]: ...
+
+
+def create_cache_backend(settings: CacheSettings) -> CacheBackend:
+    if settings.backend == "sqlite":
+        logging.info(f"Cache compartilhado entre workers em {settings.sqlite_path}.")
+        return SqliteCacheBackend(settings.sqlite_path)
+    return LocalCacheBackend()
+
+
+def try_publish(backend: CacheBackend, key: str, payload: Any) -> int | None:
+    """`publish` que não levanta: com o backend indisponível, registra e retorna None.
+
+    Os caches continuam servindo a cópia local; os demais workers ficam com o TTL.
+    """
+    try:
+        return backend.publish(key, payload)
+    except Exception as e:
+        logging.warning(f"Não foi possível publicar '{key}' no cache compartilhado: {e}")
+        return None
+
+
+def try_version(backend: CacheBackend, key: str) -> int | None:
+    """`version` que não levanta: com o backend indisponível, registra e retorna None.
+
+    Quem lê segue com o estado local do processo (e com o próprio TTL).
+    """
+    try:
+        return backend.version(key)
+    except Exception as e:
+        logging.warning(f"Não foi possível ler a versão de '{key}' no cache compartilhado: {e}")
+        return None
+
+
+def try_load(backend: CacheBackend, key: str) -> tuple[int, Any] | None:
+    """`load` que não levanta: com o backend indisponível, registra e retorna None."""
+    try:
+        return backend.load(key)
+    except Exception as e:
+        logging.warning(f"Não foi possível ler '{key}' do cache compartilhado: {e}")
+        return None
+
+
+class LocalCacheBackend:
+    """Backend em memória do próprio processo (comportamento de um único worker)."""
+
+    def __init__(self) -> None:
+        self._entries: dict[str, tuple[int, Any]] = {}
+        self._lock = threading.Lock()
+
+    def version(self, key: str) -> int:
+        with self._lock:
+            return self._entries.get(key, (0, None))[0]
+
+    def load(self, key: str) -> tuple[int, Any]:
+        with self._lock:
+            return self._entries.get(key, (0, None))
+
+    def publish(self, key: str, payload: Any) -> int:
+        with self._lock:
+            version = self._entries.get(key, (0, None))[0] + 1
+            self._entries[key] = (version, payload)
+            return version
+
+    def update(self, key: str, mutate: Callable[[Any], Any]) -> tuple[int, int, Any]:
+        """Aplica `mutate` ao payload atual de forma atômica.
+
+        Retorna (versão anterior, nova versão, novo payload).
+        """
+        with self._lock:
+            previous, payload = self._entries.get(key, (0, None))
+            payload = mutate(payload)
+            self._entries[key] = (previous + 1, payload)
+            return previous, previous + 1, payload
+
+
+class SqliteCacheBackend:
+    """Backend em arquivo SQLite local (de preferência em tmpfs, ex.: /dev/shm).
+
+    Todos os workers do gunicorn na mesma máquina abrem o mesmo arquivo; a
+    versão por chave funciona como sinal de invalidação entre processos e o
+    payload evita que cada worker recarregue a mesma tabela do banco.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    payload TEXT
+                )
+                """
+            )
+        finally:
+            conn.close()
+
+    def version(self, key: str) -> int:
+        row = self._conn().execute("SELECT version FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, key: str) -> tuple[int, Any]:
+        row = self._conn().execute("SELECT version, payload FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return 0, None
+        return row[0], _loads(row[1])
+
+    def publish(self, key: str, payload: Any) -> int:
+        return self.update(key, lambda _current: payload)[1]
+
+    def update(self, key: str, mutate: Callable[[Any], Any]) -> tuple[int, int, Any]:
+        conn = self._conn()
+        # BEGIN IMMEDIATE serializa escritores entre processos (lock de escrita do SQLite).
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT version, payload FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            previous, payload = (row[0], _loads(row[1])) if row else (0, None)
+            payload = mutate(payload)
+            conn.execute(
+                """
+                INSERT INTO cache_entries (key, version, payload) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET version = excluded.version, payload = excluded.payload
+                """,
+                (key, previous + 1, _dumps(payload)),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return previous, previous + 1, payload
+
+    def _conn(self) -> sqlite3.Connection:
+        # Uma conexão por thread e por processo (workers são criados via fork).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # O arquivo é descartável (reconstruído a partir do MySQL), então dispensa fsync.
+        conn.execute("PRAGMA synchronous=OFF")
+        return conn
+
+
+def _dumps(payload: Any) -> str | None:
+    return None if payload is None else json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def _loads(raw: str | None) -> Any:
+    return None if raw is None else json.loads(raw)
@@ -3,53 +3,166 @@ from __future__ import annotations
 import logging
 import threading
 import time
-from dataclasses import dataclass
+import unicodedata
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
 
 from mysql.connector import pooling
+from mysql.connector.errors import Error
 
+from .cache_backend import CacheBackend, LocalCacheBackend, try_load, try_publish, try_version
 from .db import db_connection
 
 
+# (quantidade de linhas, maior `atualizado_em`) de `colaboradores`
+Version = tuple[int, str]
+
+
 @dataclass
 class ColaboradoresCache:
     pool: pooling.MySQLConnectionPool
     ttl_seconds: int = 300
+    # Com um backend compartilhado, deltas e recargas feitos por um worker valem para todos.
+    backend: CacheBackend = field(default_factory=LocalCacheBackend)
+    backend_key: str = "colaboradores"
 
-    _cache: list[str] = None  # type: ignore[assignment]
+    _index: "_PrefixIndex" = field(default_factory=lambda: _PrefixIndex())
+    _version: Version | None = None
+    _loaded: bool = False
     _last_load: float = 0.0
-    _lock: threading.Lock = None  # type: ignore[assignment]
-
-    def __post_init__(self) -> None:
-        self._cache = []
-        self._lock = threading.Lock()
+    # Incrementado a cada delta; um refresh que leu antes de um delta é marcado como vencido.
+    _generation: int = 0
+    # Versão do payload do backend refletida em `_index`.
+    _shared_version: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+    # Garante um único refresh em andamento por vez (os demais aguardam e reaproveitam).
+    _refresh_lock: threading.Lock = field(default_factory=threading.Lock)
 
     def get(self, *, prefix: str, limit: int = 20) -> list[str]:
+        """Nomes que começam com `prefix` ou que têm alguma palavra começando com ele.
+
+        Comparação sem acentos e sem diferenciar maiúsculas. Os nomes cujo início
+        casa vêm primeiro; depois os que casam por outra palavra (ex.: sobrenome).
+        """
         prefix = (prefix or "").strip()
         if len(prefix) < 2:
             return []
 
         self.refresh_if_needed()
-        p = prefix.lower()
         with self._lock:
-            return [n for n in self._cache if n.lower().startswith(p)][:limit]
+            return self._index.search(fold_text(prefix), limit=limit)
+
+    # Deltas aplicados pelas rotas após o commit -------------------------------------
+
+    def apply_insert(self, name: str) -> None:
+        self._apply_delta(add=(name,))
+
+    def apply_rename(self, old_name: str, new_name: str) -> None:
+        self._apply_delta(remove=(old_name,), add=(new_name,))
+
+    def apply_delete(self, name: str) -> None:
+        self._apply_delta(remove=(name,))
+
+    def _apply_delta(self, *, remove: tuple[str, ...] = (), add: tuple[str, ...] = ()) -> None:
+        with self._lock:
+            if not self._loaded:
+                return
+        # Lida após o commit da rota, já inclui a escrita deste delta; sem ela
+        # (None) a próxima checagem de TTL faz a recarga completa.
+        version = self._read_version()
+
+        with self._lock:
+            if not self._loaded:
+                return
+
+            def mutate(payload):
+                if payload is None:
+                    # Invalidado (por este ou outro worker): fica vazio até a próxima recarga completa.
+                    return None
+                names = list(payload["names"])
+                for name in remove:
+                    if name in names:
+                        names.remove(name)
+                names.extend(name for name in add if name)
+                return {"names": names, "version": list(version) if version else None}
+
+            previous, current, payload = self.backend.update(self.backend_key, mutate)
+            if payload is None:
+                self._mark_stale()
+            elif previous == self._shared_version:
+                for name in remove:
+                    self._index.remove(name)
+                for name in add:
+                    self._index.add(name)
+            else:
+                # Outro worker publicou antes: adota a lista já com o delta aplicado.
+                self._index = _PrefixIndex()
+                self._index.load(payload["names"])
+            self._version = version
+            self._shared_version = current
+            self._generation += 1
+
+    def invalidate(self) -> None:
+        """Força a recarga completa aqui e, pelo backend, nos demais workers.
+
+        Usado quando um delta não pôde ser aplicado após o commit; não levanta
+        exceção (sem backend, os outros workers dependem do TTL).
+        """
+        shared_version = try_publish(self.backend, self.backend_key, None)
+        with self._lock:
+            self._mark_stale()
+            self._generation += 1
+            if shared_version is not None:
+                self._shared_version = shared_version
+
+    def _mark_stale(self) -> None:
+        """Descarta a versão local; a próxima consulta recarrega do MySQL. Chamar com `_lock`."""
+        self._loaded = False
+        self._version = None
+        self._last_load = 0.0
+
+    # Recarga -----------------------------------------------------------------------
 
     def refresh_if_needed(self) -> None:
+        """Ao vencer o TTL, compara a versão da tabela e só recarrega se ela mudou."""
+        self._sync_shared()
+
         now = time.time()
         with self._lock:
-            is_stale = (now - self._last_load) > self.ttl_seconds or not self._cache
-        if is_stale:
-            self.refresh(force=True)
+            is_stale = (now - self._last_load) > self.ttl_seconds or not self._loaded
+            loaded, version = self._loaded, self._version
+        if not is_stale:
+            return
+
+        if loaded and version is not None and self._read_version() == version:
+            with self._lock:
+                self._last_load = now
+            return
+
+        self.refresh(force=True)
 
     def refresh(self, *, force: bool = False) -> None:
+        if not self._refresh_lock.acquire(blocking=False):
+            # Já existe um refresh em andamento: aguarda e reaproveita o resultado.
+            with self._refresh_lock:
+                return
+        try:
+            self._refresh(force=force)
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self, *, force: bool) -> None:
         now = time.time()
         with self._lock:
-            if not force and (now - self._last_load) <= self.ttl_seconds and self._cache:
+            if not force and (now - self._last_load) <= self.ttl_seconds and self._loaded:
                 return
+            generation = self._generation
 
+        version = self._read_version()
         with db_connection(self.pool) as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("SELECT colaborador FROM colaboradores ORDER BY colaborador")
+                cursor.execute("SELECT colaborador FROM colaboradores")
                 rows = cursor.fetchall()
             finally:
                 try:
@@ -57,11 +170,147 @@ class ColaboradoresCache:
                 except Exception:
                     pass
 
+        names = [name for (name,) in rows if name]
+        index = _PrefixIndex()
+        index.load(names)
+        shared_version = try_publish(
+            self.backend, self.backend_key, {"names": names, "version": list(version) if version else None}
+        )
+
         with self._lock:
-            self._cache = [name for (name,) in rows]
-            self._last_load = now
+            self._index = index
+            self._version = version
+            if shared_version is not None:
+                self._shared_version = shared_version
+            self._loaded = True
+            # Se um delta chegou durante a leitura, a próxima consulta revalida a versão.
+            self._last_load = now if generation == self._generation else 0.0
 
-        logging.info(f"Cache de colaboradores carregado: {len(self._cache)} nomes.")
+        logging.info(f"Cache de colaboradores carregado: {len(index)} nomes.")
 
     def refresh_async(self, *, force: bool = True) -> None:
-        threading.Thread(target=self.refresh, kwargs={"force": force}, daemon=True).start()
+        if force:
+            threading.Thread(target=self.refresh, kwargs={"force": True}, daemon=True).start()
+        else:
+            # Reaproveita a lista já publicada por outro worker, quando houver.
+            threading.Thread(target=self.refresh_if_needed, daemon=True).start()
+
+    def _sync_shared(self) -> None:
+        """Adota a lista publicada no backend por outro worker, se for mais nova."""
+        shared_version = try_version(self.backend, self.backend_key)
+        with self._lock:
+            # Sem backend (None), segue com o estado local.
+            if shared_version is None or shared_version == self._shared_version:
+                return
+
+        carregado = try_load(self.backend, self.backend_key)
+        if carregado is None:
+            return
+        shared_version, payload = carregado
+        if payload is None:
+            # Outro worker invalidou a lista publicada.
+            with self._lock:
+                if shared_version != self._shared_version:
+                    self._shared_version = shared_version
+                    self._mark_stale()
+            return
+        index = _PrefixIndex()
+        index.load(payload["names"])
+
+        with self._lock:
+            if shared_version == self._shared_version:
+                return
+            self._index = index
+            self._version = tuple(payload["version"]) if payload.get("version") else None
+            self._shared_version = shared_version
+            self._loaded = True
+            self._last_load = time.time()
+
+    def _read_version(self) -> Version | None:
+        try:
+            with db_connection(self.pool) as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute("SELECT COUNT(1), MAX(atualizado_em) FROM colaboradores")
+                    count, max_updated = cursor.fetchone()
+                finally:
+                    try:
+                        cursor.close()
+                    except Exception:
+                        pass
+        except Error as e:
+            logging.warning(f"Não foi possível ler a versão de colaboradores: {e}")
+            return None
+        return int(count or 0), str(max_updated or "")
+
+
+def fold_text(text: str) -> str:
+    """Normaliza para busca: remove acentos e aplica casefold ("João" -> "joao")."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+class _PrefixIndex:
+    """Índice de prefixos em arrays ordenados, consultado com busca binária.
+
+    `_name_keys` cobre o nome completo; `_token_keys` cobre cada palavra do nome.
+    As entradas são pares (chave normalizada, nome original), o que permite
+    inserir/remover um nome com `insort`/`bisect` sem reconstruir o índice.
+    """
+
+    def __init__(self) -> None:
+        self._name_keys: list[tuple[str, str]] = []
+        self._token_keys: list[tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._name_keys)
+
+    def names(self) -> list[str]:
+        return [name for _, name in self._name_keys]
+
+    def load(self, names: list[str]) -> None:
+        self._name_keys = sorted(self._name_entry(n) for n in names)
+        self._token_keys = sorted(e for n in names for e in self._token_entries(n))
+
+    def add(self, name: str | None) -> None:
+        if not name:
+            return
+        insort(self._name_keys, self._name_entry(name))
+        for entry in self._token_entries(name):
+            insort(self._token_keys, entry)
+
+    def remove(self, name: str | None) -> None:
+        if not name:
+            return
+        _remove_sorted(self._name_keys, self._name_entry(name))
+        for entry in self._token_entries(name):
+            _remove_sorted(self._token_keys, entry)
+
+    def search(self, folded_prefix: str, *, limit: int) -> list[str]:
+        out: list[str] = []
+        seen: set[str] = set()
+        for keys in (self._name_keys, self._token_keys):
+            pos = bisect_left(keys, (folded_prefix,))
+            while pos < len(keys) and len(out) < limit and keys[pos][0].startswith(folded_prefix):
+                name = keys[pos][1]
+                if name not in seen:
+                    seen.add(name)
+                    out.append(name)
+                pos += 1
+            if len(out) >= limit:
+                break
+        return out
+
+    @staticmethod
+    def _name_entry(name: str) -> tuple[str, str]:
+        return fold_text(name).strip(), name
+
+    @staticmethod
+    def _token_entries(name: str) -> list[tuple[str, str]]:
+        return [(token, name) for token in set(fold_text(name).split())]
+
+
+def _remove_sorted(keys: list[tuple[str, str]], entry: tuple[str, str]) -> None:
+    pos = bisect_left(keys, entry)
+    if pos < len(keys) and keys[pos] == entry:
+        del keys[pos]
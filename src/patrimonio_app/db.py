@@ -19,8 +19,10 @@ def create_connection_pool(db: DbSettings) -> pooling.MySQLConnectionPool:
     )
 
     # Pequenas migrações/garantias idempotentes
-    _ensure_indexes(pool)
     _ensure_patrimonios_empresa_column(pool)
+    _ensure_patrimonios_em_estoque_column(pool)
+    _ensure_colaboradores_atualizado_em_column(pool)
+    _ensure_indexes(pool)
 
     return pool
 
@@ -38,7 +40,16 @@ def db_connection(pool: pooling.MySQLConnectionPool):
 
 
 def _ensure_indexes(pool: pooling.MySQLConnectionPool) -> None:
-    """Cria índice usado para autocomplete de colaboradores (idempotente)."""
+    """Cria índices usados pelo autocomplete e pela listagem paginada (idempotente)."""
+    _ensure_index(pool, table="colaboradores", index_name="idx_colaborador", columns="colaborador")
+
+    # Paginação por chave (ORDER BY nome/etiqueta, id) em /listar_patrimonios
+    _ensure_index(pool, table="patrimonios", index_name="idx_patrimonios_nome", columns="nome")
+    _ensure_index(pool, table="patrimonios", index_name="idx_patrimonios_etiqueta", columns="etiqueta")
+    _ensure_index(pool, table="patrimonios", index_name="idx_patrimonios_em_estoque", columns="em_estoque, id")
+
+
+def _ensure_index(pool: pooling.MySQLConnectionPool, *, table: str, index_name: str, columns: str) -> None:
     from mysql.connector.errors import Error
 
     with db_connection(pool) as conn:
@@ -49,16 +60,17 @@ def _ensure_indexes(pool: pooling.MySQLConnectionPool) -> None:
                 SELECT COUNT(1)
                 FROM INFORMATION_SCHEMA.STATISTICS
                 WHERE table_schema=DATABASE()
-                  AND table_name='colaboradores'
-                  AND index_name='idx_colaborador'
-                """
+                  AND table_name=%s
+                  AND index_name=%s
+                """,
+                (table, index_name),
             )
             if cursor.fetchone()[0] == 0:
-                cursor.execute("CREATE INDEX idx_colaborador ON colaboradores (colaborador)")
+                cursor.execute(f"CREATE INDEX {index_name} ON {table} ({columns})")
                 conn.commit()
-                logging.info("Índice idx_colaborador criado.")
+                logging.info(f"Índice {index_name} criado.")
         except Error as e:
-            logging.warning(f"Não foi possível garantir índice idx_colaborador: {e}")
+            logging.warning(f"Não foi possível garantir índice {index_name}: {e}")
         finally:
             try:
                 cursor.close()
@@ -95,3 +107,75 @@ def _ensure_patrimonios_empresa_column(pool: pooling.MySQLConnectionPool) -> Non
                 cursor.close()
             except Exception:
                 pass
+
+
+def _ensure_patrimonios_em_estoque_column(pool: pooling.MySQLConnectionPool) -> None:
+    """Garante a coluna gerada `patrimonios.em_estoque` (1 quando não há colaborador).
+
+    Substitui os predicados `TRIM(colaborador) = ''` (que não usam índice) por uma
+    coluna STORED indexável, mantida pelo próprio MySQL em todo INSERT/UPDATE.
+    """
+    with db_connection(pool) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                SELECT COUNT(1)
+                FROM INFORMATION_SCHEMA.COLUMNS
+                WHERE table_schema = DATABASE()
+                  AND table_name = 'patrimonios'
+                  AND column_name = 'em_estoque'
+                """
+            )
+            exists = cursor.fetchone()[0] > 0
+            if not exists:
+                cursor.execute(
+                    """
+                    ALTER TABLE patrimonios
+                    ADD COLUMN em_estoque TINYINT(1) AS (
+                        COALESCE(TRIM(colaborador), '') = '' AND COALESCE(TRIM(colaborador2), '') = ''
+                    ) STORED
+                    """
+                )
+                conn.commit()
+                logging.info("Coluna gerada patrimonios.em_estoque criada.")
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+def _ensure_colaboradores_atualizado_em_column(pool: pooling.MySQLConnectionPool) -> None:
+    """Garante `colaboradores.atualizado_em`, usado na checagem barata de versão do cache."""
+    from mysql.connector.errors import Error
+
+    with db_connection(pool) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                SELECT COUNT(1)
+                FROM INFORMATION_SCHEMA.COLUMNS
+                WHERE table_schema = DATABASE()
+                  AND table_name = 'colaboradores'
+                  AND column_name = 'atualizado_em'
+                """
+            )
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(
+                    """
+                    ALTER TABLE colaboradores
+                    ADD COLUMN atualizado_em TIMESTAMP NOT NULL
+                        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                    """
+                )
+                conn.commit()
+                logging.info("Coluna colaboradores.atualizado_em criada.")
+        except Error as e:
+            logging.warning(f"Não foi possível garantir coluna colaboradores.atualizado_em: {e}")
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
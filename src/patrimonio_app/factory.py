@@ -8,8 +8,12 @@ from flask import Flask
 from .settings import load_settings
 from .db import create_connection_pool
 from .drive import DriveClient
+from .logging_setup import configure_logging
+from .cache_backend import create_cache_backend
 from .colaboradores_cache import ColaboradoresCache
+from .patrimonios_cache import PatrimoniosAutocompleteCache
 from .routes import register_routes
+from .totais_cache import TotaisPatrimoniosCache
 from .scheduler import configure_scheduler
 
 
@@ -32,33 +36,46 @@ def create_app() -> Flask:
     app.permanent_session_lifetime = settings.session_lifetime
 
     # Logging básico (evita duplicar handlers em reloaders)
-    _configure_logging(settings.log_level)
+    configure_logging(settings.log_level)
 
     pool = create_connection_pool(settings.db)
     drive = DriveClient.from_settings(settings.drive)
-    colab_cache = ColaboradoresCache(pool=pool, ttl_seconds=settings.colaboradores_cache_ttl)
+    cache_backend = create_cache_backend(settings.cache)
+    colab_cache = ColaboradoresCache(
+        pool=pool,
+        ttl_seconds=settings.colaboradores_cache_ttl,
+        backend=cache_backend,
+    )
+    totais_cache = TotaisPatrimoniosCache(pool=pool, ttl_seconds=settings.totais_cache_ttl, backend=cache_backend)
+    patrimonios_cache = PatrimoniosAutocompleteCache(
+        pool=pool,
+        ttl_seconds=settings.colaboradores_cache_ttl,
+        backend=cache_backend,
+    )
 
-    register_routes(app=app, pool=pool, drive=drive, colaboradores_cache=colab_cache)
+    register_routes(
+        app=app,
+        pool=pool,
+        drive=drive,
+        colaboradores_cache=colab_cache,
+        totais_cache=totais_cache,
+        patrimonios_cache=patrimonios_cache,
+    )
 
     if settings.scheduler.enabled:
+        # Opt-in (SCHEDULER_ENABLED=1); por padrão os workers web só atendem requisições.
         configure_scheduler(settings=settings.scheduler, pool=pool)
 
-    # Carrega cache em segundo plano na inicialização
+    # Carrega caches em segundo plano na inicialização (sem forçar: com backend
+    # compartilhado, um worker que sobe depois reaproveita o que já foi publicado)
     try:
-        colab_cache.refresh_async(force=True)
+        colab_cache.refresh_async(force=False)
     except Exception:
         logging.exception("Falha ao disparar refresh_async do cache de colaboradores.")
+    try:
+        patrimonios_cache.refresh_async(force=False)
+    except Exception:
+        logging.exception("Falha ao disparar refresh_async do cache de autocomplete de patrimônios.")
 
     return app
 
-
-def _configure_logging(level: str) -> None:
-    root = logging.getLogger()
-    if root.handlers:
-        return
-
-    logging.basicConfig(
-        level=getattr(logging, level.upper(), logging.INFO),
-        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
-    )
-    logging.getLogger("apscheduler").setLevel(logging.WARNING)
@@ -14,6 +14,20 @@ def log_execution_time(func):
     return wrapper
 
 
+def run_migrations() -> bool:
+    """Aplica as migrações pendentes do banco POWERBI antes de os jobs rodarem."""
+    from migrations import aplicar_migracoes
+
+    try:
+        total = aplicar_migracoes()
+    except Exception as e:
+        logging.exception(f"Falha ao aplicar as migrações do banco POWERBI: {e}")
+        return False
+    if total:
+        logging.info(f"{total} migrações do banco POWERBI aplicadas.")
+    return True
+
+
 def routeviolation_completo():
     from authtoken import obter_token
     from routeviolation import routeviolation, verificar_violações_por_velocidade
@@ -44,9 +58,6 @@ def tags_job():
             consultar_api_escola,
             consultar_api_veiculo,
             corrigir_ordem_em_toda_tabela_aluno,
-            criar_tabela_aluno,
-            criar_tabela_escola,
-            criar_tabela_veiculo,
             preencher_tabela_aluno,
         )
 
@@ -56,10 +67,6 @@ def tags_job():
             logging.error("tags_job: falha ao obter token.")
             return
 
-        criar_tabela_escola()
-        criar_tabela_veiculo()
-        criar_tabela_aluno()
-
         consultar_api_escola(data_ref, token=token)
         consultar_api_veiculo(data_ref, token=token)
         preencher_tabela_aluno(data_ref)
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from mysql.connector.errors import Error
+
+
+@dataclass
+class LeaderLock:
+    """Eleição de líder via `GET_LOCK` do MySQL.
+
+    O lock pertence à conexão que o obteve: enquanto ela estiver aberta, nenhum
+    outro processo (em qualquer máquina) consegue o mesmo nome. Se o processo
+    morrer, o MySQL libera o lock e outro candidato assume.
+    """
+
+    connect: Callable[[], Any]
+    name: str = "patrimonio_scheduler"
+
+    _conn: Any = None
+
+    def try_acquire(self) -> bool:
+        """Tenta obter o lock sem esperar. Retorna True se este processo é o líder."""
+        if self._conn is not None and self.is_held():
+            return True
+        self._close()
+
+        try:
+            self._conn = self.connect()
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (self.name,))
+                acquired = cursor.fetchone()[0] == 1
+            finally:
+                cursor.close()
+        except Error as e:
+            logging.warning(f"Falha ao tentar obter o lock de líder '{self.name}': {e}")
+            self._close()
+            return False
+
+        if not acquired:
+            self._close()
+        return acquired
+
+    def is_held(self) -> bool:
+        """Confirma (e mantém viva) a conexão dona do lock."""
+        if self._conn is None:
+            return False
+        try:
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (self.name,))
+                return cursor.fetchone()[0] == 1
+            finally:
+                cursor.close()
+        except Error as e:
+            logging.warning(f"Conexão do lock de líder '{self.name}' perdida: {e}")
+            self._close()
+            return False
+
+    def release(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (self.name,))
+                cursor.fetchone()
+            finally:
+                cursor.close()
+        except Error:
+            pass
+        self._close()
+
+    def _close(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
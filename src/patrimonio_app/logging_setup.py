@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+import logging
+
+
+def configure_logging(level: str) -> None:
+    """Logging básico compartilhado pela aplicação web e pelo worker de jobs.
+
+    Não duplica handlers se o logging já estiver configurado (ex.: reloaders, gunicorn).
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+
+    logging.basicConfig(
+        level=getattr(logging, level.upper(), logging.INFO),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
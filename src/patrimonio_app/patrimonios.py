@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import base64
+import json
+from dataclasses import dataclass
+from typing import Any, Mapping
+
+
+# Ordem das colunas preservada para o template (usa posições: patrimonio[0..10]).
+COLUNAS_LISTAGEM = (
+    "id",
+    "nome",
+    "colaborador",
+    "colaborador2",
+    "etiqueta",
+    "especificacao",
+    "estado",
+    "valor",
+    "observacao",
+    "url",
+    "empresa",
+)
+
+# Colunas aceitas em `ordem`; todas possuem índice (ver db._ensure_indexes).
+ORDENS_VALIDAS = {"id", "nome", "etiqueta"}
+
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 200
+
+# `em_estoque` é coluna gerada e indexada (ver db._ensure_patrimonios_em_estoque_column).
+_PREDICADO_ESTOQUE = "em_estoque = 1"
+
+
+@dataclass(frozen=True)
+class ListagemParams:
+    somente_estoque: bool = False
+    nome: str = ""
+    etiqueta: str = ""
+    colaborador: str = ""
+    ordem: str = "id"
+    direcao: str = "asc"
+    cursor: str | None = None
+    limite: int = LIMITE_PADRAO
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "ListagemParams":
+        """Normaliza os parâmetros da querystring (valores inválidos caem no default)."""
+        ordem = (args.get("ordem") or "id").strip().lower()
+        if ordem not in ORDENS_VALIDAS:
+            ordem = "id"
+
+        direcao = (args.get("direcao") or "asc").strip().lower()
+        if direcao not in {"asc", "desc"}:
+            direcao = "asc"
+
+        try:
+            limite = int(args.get("limite") or LIMITE_PADRAO)
+        except ValueError:
+            limite = LIMITE_PADRAO
+        limite = max(1, min(limite, LIMITE_MAXIMO))
+
+        return cls(
+            somente_estoque=(args.get("estoque") or "").strip().lower() in {"1", "true", "sim", "yes"},
+            nome=(args.get("nome") or "").strip(),
+            etiqueta=(args.get("etiqueta") or "").strip(),
+            colaborador=(args.get("colaborador") or "").strip(),
+            ordem=ordem,
+            direcao=direcao,
+            cursor=(args.get("cursor") or "").strip() or None,
+            limite=limite,
+        )
+
+    def filtros_url(self) -> dict[str, str]:
+        """Parâmetros a repetir nos links de paginação (sem o cursor)."""
+        out: dict[str, str] = {}
+        if self.somente_estoque:
+            out["estoque"] = "1"
+        for chave in ("nome", "etiqueta", "colaborador"):
+            valor = getattr(self, chave)
+            if valor:
+                out[chave] = valor
+        if self.ordem != "id":
+            out["ordem"] = self.ordem
+        if self.direcao != "asc":
+            out["direcao"] = self.direcao
+        if self.limite != LIMITE_PADRAO:
+            out["limite"] = str(self.limite)
+        return out
+
+
+@dataclass(frozen=True)
+class PaginaPatrimonios:
+    itens: list[tuple]
+    proximo_cursor: str | None
+    total_filtrado: int
+
+
+def buscar_pagina(cursor, params: ListagemParams) -> PaginaPatrimonios:
+    """Busca uma página de patrimônios com paginação por chave (keyset).
+
+    O cursor guarda (valor da coluna de ordenação, id) do último item entregue;
+    a próxima página começa estritamente depois dele, sem OFFSET.
+    """
+    where, args = _montar_filtros(params)
+
+    cursor.execute(f"SELECT COUNT(1) FROM patrimonios {_where_sql(where)}", tuple(args))
+    total_filtrado = cursor.fetchone()[0] or 0
+
+    keyset = decode_cursor(params.cursor)
+    if keyset is not None:
+        valor, ultimo_id = keyset
+        op = ">" if params.direcao == "asc" else "<"
+        if params.ordem == "id":
+            where.append(f"id {op} %s")
+            args.append(ultimo_id)
+        else:
+            predicado, predicado_args = _predicado_keyset(params.ordem, op, valor, ultimo_id)
+            where.append(predicado)
+            args.extend(predicado_args)
+
+    direcao = "ASC" if params.direcao == "asc" else "DESC"
+    order_by = f"id {direcao}" if params.ordem == "id" else f"{params.ordem} {direcao}, id {direcao}"
+
+    # Busca um item a mais para saber se existe próxima página.
+    cursor.execute(
+        f"""
+        SELECT {", ".join(COLUNAS_LISTAGEM)}
+        FROM patrimonios
+        {_where_sql(where)}
+        ORDER BY {order_by}
+        LIMIT %s
+        """,
+        tuple(args) + (params.limite + 1,),
+    )
+    rows = cursor.fetchall()
+
+    proximo_cursor = None
+    if len(rows) > params.limite:
+        rows = rows[: params.limite]
+        ultimo = rows[-1]
+        proximo_cursor = encode_cursor(ultimo[COLUNAS_LISTAGEM.index(params.ordem)], ultimo[0])
+
+    return PaginaPatrimonios(itens=rows, proximo_cursor=proximo_cursor, total_filtrado=total_filtrado)
+
+
+def calcular_totais(cursor) -> dict[str, Any]:
+    """Totais gerais, de estoque e de alocados em uma única passada (independentes dos filtros)."""
+    cursor.execute(
+        """
+        SELECT
+            COALESCE(SUM(valor), 0),
+            COALESCE(SUM(em_estoque = 1), 0),
+            COALESCE(SUM(CASE WHEN em_estoque = 1 THEN valor END), 0),
+            COALESCE(SUM(em_estoque = 0), 0),
+            COALESCE(SUM(CASE WHEN em_estoque = 0 THEN valor END), 0)
+        FROM patrimonios
+        """
+    )
+    valor_total_geral, total_estoque, valor_total_estoque, total_alocados, valor_total_alocados = cursor.fetchone()
+
+    return {
+        "valor_total_geral": valor_total_geral,
+        "total_estoque": int(total_estoque),
+        "valor_total_estoque": valor_total_estoque,
+        "total_alocados": int(total_alocados),
+        "valor_total_alocados": valor_total_alocados,
+    }
+
+
+def row_to_dict(row: tuple) -> dict[str, Any]:
+    return dict(zip(COLUNAS_LISTAGEM, row))
+
+
+def encode_cursor(valor: Any, patrimonio_id: int) -> str:
+    raw = json.dumps([valor, patrimonio_id], default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str | None) -> tuple[Any, int] | None:
+    """Decodifica o cursor opaco; cursores inválidos reiniciam a listagem."""
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        valor, patrimonio_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return valor, int(patrimonio_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _montar_filtros(params: ListagemParams) -> tuple[list[str], list[Any]]:
+    where: list[str] = []
+    args: list[Any] = []
+
+    if params.somente_estoque:
+        where.append(_PREDICADO_ESTOQUE)
+
+    # Filtros por trecho (LIKE '%termo%'), como a busca que a página fazia no navegador.
+    if params.nome:
+        where.append("nome LIKE %s")
+        args.append(_trecho_like(params.nome))
+    if params.etiqueta:
+        where.append("etiqueta LIKE %s")
+        args.append(_trecho_like(params.etiqueta))
+    if params.colaborador:
+        where.append("(colaborador LIKE %s OR colaborador2 LIKE %s)")
+        termo = _trecho_like(params.colaborador)
+        args.extend([termo, termo])
+
+    return where, args
+
+
+def _where_sql(where: list[str]) -> str:
+    return ("WHERE " + " AND ".join(where)) if where else ""
+
+
+def _predicado_keyset(col: str, op: str, valor: Any, ultimo_id: int) -> tuple[str, list[Any]]:
+    """Condição "depois do cursor" para ORDER BY col, id.
+
+    No MySQL os NULL vêm antes de qualquer valor em ASC e depois em DESC;
+    comparar com NULL nunca é verdadeiro, então o NULL precisa de ramo próprio
+    (sem COALESCE, para o ORDER BY continuar usando o índice da coluna).
+    """
+    if valor is None:
+        if op == ">":
+            return f"({col} IS NOT NULL OR ({col} IS NULL AND id > %s))", [ultimo_id]
+        return f"({col} IS NULL AND id < %s)", [ultimo_id]
+    predicado = f"({col} {op} %s OR ({col} = %s AND id {op} %s)"
+    if op == "<":
+        predicado += f" OR {col} IS NULL"
+    return predicado + ")", [valor, valor, ultimo_id]
+
+
+def _trecho_like(termo: str) -> str:
+    escapado = termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escapado}%"
@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from mysql.connector import pooling
+
+from .cache_backend import CacheBackend, LocalCacheBackend, try_load, try_publish, try_version
+from .colaboradores_cache import fold_text
+from .db import db_connection
+
+
+class TrigramIndex:
+    """Índice de substrings por trigramas sobre valores distintos.
+
+    Cada valor guarda quantos patrimônios o usam, para que inserções/remoções
+    possam ser aplicadas incrementalmente sem recarregar a tabela.
+    """
+
+    def __init__(self) -> None:
+        self._counts: Counter[str] = Counter()
+        self._folded: dict[str, str] = {}
+        self._postings: dict[str, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    @classmethod
+    def from_counts(cls, counts: dict[str, int]) -> "TrigramIndex":
+        index = cls()
+        for value, count in counts.items():
+            index.add(value, count=count)
+        return index
+
+    def counts(self) -> dict[str, int]:
+        return dict(self._counts)
+
+    def add(self, value: str | None, *, count: int = 1) -> None:
+        value = (value or "").strip()
+        if not value or count <= 0:
+            return
+        self._counts[value] += count
+        if self._counts[value] > count:
+            return
+
+        folded = fold_text(value)
+        self._folded[value] = folded
+        for gram in _trigrams(folded):
+            self._postings.setdefault(gram, set()).add(value)
+
+    def remove(self, value: str | None) -> None:
+        value = (value or "").strip()
+        if not value or value not in self._counts:
+            return
+        self._counts[value] -= 1
+        if self._counts[value] > 0:
+            return
+
+        del self._counts[value]
+        folded = self._folded.pop(value)
+        for gram in _trigrams(folded):
+            bucket = self._postings.get(gram)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del self._postings[gram]
+
+    def search(self, term: str, *, limit: int) -> list[str]:
+        """Valores que contêm `term`, ordenados por relevância.
+
+        Ordem: igual ao termo, começa com o termo, alguma palavra começa com o
+        termo, demais; em cada faixa, os mais usados primeiro.
+        """
+        needle = fold_text(term)
+        grams = _trigrams(needle)
+        if grams:
+            postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:]) if postings[0] else set()
+        else:
+            # Termos com menos de 3 letras não formam trigramas: varre os valores distintos.
+            candidates = self._folded.keys()
+
+        matches = []
+        for value in candidates:
+            folded = self._folded[value]
+            pos = folded.find(needle)
+            if pos < 0:
+                continue
+            if folded == needle:
+                rank = 0
+            elif pos == 0:
+                rank = 1
+            elif f" {needle}" in folded:
+                rank = 2
+            else:
+                rank = 3
+            matches.append((rank, -self._counts[value], folded, value))
+
+        matches.sort()
+        return [value for *_, value in matches[:limit]]
+
+
+def _trigrams(folded: str) -> set[str]:
+    return {folded[i : i + 3] for i in range(len(folded) - 2)}
+
+
+@dataclass
+class PatrimoniosAutocompleteCache:
+    """Cache em memória de nomes e etiquetas distintos de `patrimonios`.
+
+    As rotas de escrita aplicam a alteração diretamente (`apply_change`) e a
+    publicam no backend, de onde os demais workers a adotam; o TTL garante que
+    escritas feitas fora da aplicação também apareçam.
+    """
+
+    pool: pooling.MySQLConnectionPool
+    ttl_seconds: int = 300
+    max_results: int = 20
+    backend: CacheBackend = field(default_factory=LocalCacheBackend)
+    backend_key: str = "patrimonios_autocomplete"
+
+    _nomes: TrigramIndex = field(default_factory=TrigramIndex)
+    _etiquetas: TrigramIndex = field(default_factory=TrigramIndex)
+    _loaded: bool = False
+    _last_load: float = 0.0
+    # Incrementado a cada alteração; um refresh que leu antes dela é descartado.
+    _generation: int = 0
+    _shared_version: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+    # Garante um único refresh em andamento por vez (os demais aguardam e reaproveitam).
+    _refresh_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def get_nomes(self, *, term: str) -> list[str]:
+        return self._search("_nomes", term)
+
+    def get_etiquetas(self, *, term: str) -> list[str]:
+        return self._search("_etiquetas", term)
+
+    def _search(self, attr: str, term: str) -> list[str]:
+        term = (term or "").strip()
+        if not term:
+            return []
+
+        self.refresh_if_needed()
+        with self._lock:
+            return getattr(self, attr).search(term, limit=self.max_results)
+
+    def apply_change(
+        self,
+        *,
+        removed: tuple[str | None, str | None] | None = None,
+        added: tuple[str | None, str | None] | None = None,
+    ) -> None:
+        """Aplica a alteração de um patrimônio já commitada: pares (nome, etiqueta)."""
+        with self._lock:
+            # Mesmo sem cache carregado: uma carga em andamento pode ter lido antes do commit.
+            self._generation += 1
+            if not self._loaded:
+                return
+
+            def mutate(payload):
+                if payload is None:
+                    # Invalidado (por este ou outro worker): fica vazio até a próxima recarga completa.
+                    return None
+                nomes = Counter(payload["nomes"])
+                etiquetas = Counter(payload["etiquetas"])
+                for alvo, valor, delta in _deltas(removed, added):
+                    contador = nomes if alvo == "nome" else etiquetas
+                    contador[valor] += delta
+                    if contador[valor] <= 0:
+                        del contador[valor]
+                return {"nomes": dict(nomes), "etiquetas": dict(etiquetas)}
+
+            previous, current, payload = self.backend.update(self.backend_key, mutate)
+            if payload is None:
+                self._mark_stale()
+            elif previous == self._shared_version:
+                if removed is not None:
+                    self._nomes.remove(removed[0])
+                    self._etiquetas.remove(removed[1])
+                if added is not None:
+                    self._nomes.add(added[0])
+                    self._etiquetas.add(added[1])
+            else:
+                # Outro worker publicou antes: adota o estado já com esta alteração.
+                self._nomes = TrigramIndex.from_counts(payload["nomes"])
+                self._etiquetas = TrigramIndex.from_counts(payload["etiquetas"])
+            self._shared_version = current
+
+    def invalidate(self) -> None:
+        """Força a recarga completa aqui e, pelo backend, nos demais workers.
+
+        Usado quando uma alteração não pôde ser aplicada após o commit; não
+        levanta exceção (sem backend, os outros workers dependem do TTL).
+        """
+        shared_version = try_publish(self.backend, self.backend_key, None)
+        with self._lock:
+            self._mark_stale()
+            self._generation += 1
+            if shared_version is not None:
+                self._shared_version = shared_version
+
+    def _mark_stale(self) -> None:
+        """A próxima consulta recarrega do MySQL. Chamar com `_lock`."""
+        self._loaded = False
+        self._last_load = 0.0
+
+    def refresh_if_needed(self) -> None:
+        self._sync_shared()
+
+        now = time.time()
+        with self._lock:
+            is_stale = (now - self._last_load) > self.ttl_seconds or not self._loaded
+        if is_stale:
+            self.refresh(force=True)
+
+    def refresh(self, *, force: bool = False) -> None:
+        if not self._refresh_lock.acquire(blocking=False):
+            # Já existe um refresh em andamento: aguarda e reaproveita o resultado.
+            with self._refresh_lock:
+                return
+        try:
+            self._refresh(force=force)
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self, *, force: bool) -> None:
+        now = time.time()
+        with self._lock:
+            if not force and (now - self._last_load) <= self.ttl_seconds and self._loaded:
+                return
+            generation = self._generation
+
+        with db_connection(self.pool) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT nome, etiqueta FROM patrimonios")
+                rows = cursor.fetchall()
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+        nomes = TrigramIndex()
+        etiquetas = TrigramIndex()
+        for nome, etiqueta in rows:
+            nomes.add(nome)
+            etiquetas.add(etiqueta)
+
+        # Sob `_lock`, como em apply_change: nenhuma alteração entra entre a checagem e a publicação.
+        with self._lock:
+            if generation != self._generation:
+                # Uma alteração chegou durante a leitura e pode faltar no snapshot:
+                # não o publica e mantém o estado atual; a próxima consulta relê.
+                return
+            shared_version = try_publish(
+                self.backend, self.backend_key, {"nomes": nomes.counts(), "etiquetas": etiquetas.counts()}
+            )
+            self._nomes = nomes
+            self._etiquetas = etiquetas
+            if shared_version is not None:
+                self._shared_version = shared_version
+            self._loaded = True
+            self._last_load = now
+
+        logging.info(
+            f"Cache de autocomplete de patrimônios carregado: {len(nomes)} nomes, {len(etiquetas)} etiquetas."
+        )
+
+    def refresh_async(self, *, force: bool = True) -> None:
+        if force:
+            threading.Thread(target=self.refresh, kwargs={"force": True}, daemon=True).start()
+        else:
+            # Reaproveita o estado já publicado por outro worker, quando houver.
+            threading.Thread(target=self.refresh_if_needed, daemon=True).start()
+
+    def _sync_shared(self) -> None:
+        """Adota o estado publicado no backend por outro worker, se for mais novo."""
+        shared_version = try_version(self.backend, self.backend_key)
+        with self._lock:
+            # Sem backend (None), segue com o estado local.
+            if shared_version is None or shared_version == self._shared_version:
+                return
+
+        carregado = try_load(self.backend, self.backend_key)
+        if carregado is None:
+            return
+        shared_version, payload = carregado
+        if payload is None:
+            # Outro worker invalidou o estado publicado.
+            with self._lock:
+                if shared_version != self._shared_version:
+                    self._shared_version = shared_version
+                    self._mark_stale()
+            return
+        nomes = TrigramIndex.from_counts(payload["nomes"])
+        etiquetas = TrigramIndex.from_counts(payload["etiquetas"])
+
+        with self._lock:
+            if shared_version == self._shared_version:
+                return
+            self._nomes = nomes
+            self._etiquetas = etiquetas
+            self._shared_version = shared_version
+            self._loaded = True
+            self._last_load = time.time()
+
+
+def _deltas(removed, added):
+    """(coluna, valor, delta) de uma alteração, ignorando valores vazios."""
+    for par, delta in ((removed, -1), (added, 1)):
+        if par is None:
+            continue
+        for alvo, valor in zip(("nome", "etiqueta"), par):
+            valor = (valor or "").strip()
+            if valor:
+                yield alvo, valor, delta
@@ -1,22 +1,43 @@
 from __future__ import annotations
 
+import logging
+from typing import Callable
+
 from flask import Flask, jsonify, redirect, render_template, request, session, url_for
 from mysql.connector import pooling
 
 from .colaboradores_cache import ColaboradoresCache
 from .db import db_connection
 from .drive import DriveClient
+from .patrimonios import ListagemParams, buscar_pagina, row_to_dict
+from .patrimonios_cache import PatrimoniosAutocompleteCache
+from .totais_cache import TotaisPatrimoniosCache
 
 
 EMPRESAS_PATRIMONIO_VALIDAS = {"TRACK", "RAPTOR"}
 
 
+def _atualizar_cache(cache: ColaboradoresCache | PatrimoniosAutocompleteCache, aplicar: Callable[[], None]) -> None:
+    """Aplica a alteração já commitada ao cache; uma falha aqui não pode virar erro da escrita.
+
+    Se o delta falhar (ex.: backend compartilhado indisponível), o cache é
+    invalidado para que este e os demais workers recarreguem do MySQL.
+    """
+    try:
+        aplicar()
+    except Exception:
+        logging.exception("Falha ao atualizar o cache após o commit; invalidando.")
+        cache.invalidate()
+
+
 def register_routes(
     *,
     app: Flask,
     pool: pooling.MySQLConnectionPool,
     drive: DriveClient,
     colaboradores_cache: ColaboradoresCache,
+    totais_cache: TotaisPatrimoniosCache,
+    patrimonios_cache: PatrimoniosAutocompleteCache,
 ) -> None:
     @app.before_request
     def _before_request():
@@ -31,36 +52,11 @@ def register_routes(
 
     @app.get("/autocomplete_nomes")
     def autocomplete_nomes():
-        term = request.args.get("term") or ""
-        with db_connection(pool) as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute("SELECT nome FROM patrimonios WHERE nome LIKE %s", (f"%{term}%",))
-                results = cursor.fetchall()
-            finally:
-                try:
-                    cursor.close()
-                except Exception:
-                    pass
-        return jsonify([row[0] for row in results])
+        return jsonify(patrimonios_cache.get_nomes(term=request.args.get("term") or ""))
 
     @app.get("/autocomplete_etiquetas")
     def autocomplete_etiquetas():
-        term = request.args.get("term") or ""
-        with db_connection(pool) as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute(
-                    "SELECT etiqueta FROM patrimonios WHERE etiqueta LIKE %s",
-                    (f"%{term}%",),
-                )
-                results = cursor.fetchall()
-            finally:
-                try:
-                    cursor.close()
-                except Exception:
-                    pass
-        return jsonify([row[0] for row in results])
+        return jsonify(patrimonios_cache.get_etiquetas(term=request.args.get("term") or ""))
 
     @app.get("/")
     def index():
@@ -72,67 +68,44 @@ def register_routes(
 
     @app.get("/listar_patrimonios")
     def listar_patrimonios():
-        somente_estoque = (request.args.get("estoque") or "").strip().lower() in {"1", "true", "sim", "yes"}
+        params = ListagemParams.from_args(request.args)
         with db_connection(pool) as conn:
             cursor = conn.cursor()
             try:
-                if somente_estoque:
-                    cursor.execute(
-                        """
-                        SELECT *
-                        FROM patrimonios
-                        WHERE (colaborador IS NULL OR TRIM(colaborador) = '')
-                          AND (colaborador2 IS NULL OR TRIM(colaborador2) = '')
-                        """
-                    )
-                else:
-                    cursor.execute("SELECT * FROM patrimonios")
-                patrimonios = cursor.fetchall()
-
-                # Totais gerais
-                cursor.execute("SELECT SUM(valor) FROM patrimonios")
-                valor_total_geral = cursor.fetchone()[0] or 0
-
-                # Totais de estoque
-                cursor.execute(
-                    """
-                    SELECT COUNT(1), COALESCE(SUM(valor), 0)
-                    FROM patrimonios
-                    WHERE (colaborador IS NULL OR TRIM(colaborador) = '')
-                      AND (colaborador2 IS NULL OR TRIM(colaborador2) = '')
-                    """
-                )
-                total_estoque, valor_total_estoque = cursor.fetchone()
-
-                # Totais alocados (qualquer colaborador preenchido)
-                cursor.execute(
-                    """
-                    SELECT COUNT(1), COALESCE(SUM(valor), 0)
-                    FROM patrimonios
-                    WHERE NOT ((colaborador IS NULL OR TRIM(colaborador) = '')
-                           AND (colaborador2 IS NULL OR TRIM(colaborador2) = ''))
-                    """
-                )
-                total_alocados, valor_total_alocados = cursor.fetchone()
+                pagina = buscar_pagina(cursor, params)
+                totais = totais_cache.get(cursor)
             finally:
                 try:
                     cursor.close()
                 except Exception:
                     pass
 
-        total_patrimonios = len(patrimonios)
         # Para a página de estoque, o “valor_total” mostrado deve ser o do recorte.
-        valor_total = valor_total_estoque if somente_estoque else valor_total_geral
+        valor_total = totais["valor_total_estoque"] if params.somente_estoque else totais["valor_total_geral"]
+
+        if (request.args.get("formato") or "").strip().lower() == "json":
+            return jsonify(
+                {
+                    "itens": [row_to_dict(row) for row in pagina.itens],
+                    "proximo_cursor": pagina.proximo_cursor,
+                    "total_filtrado": pagina.total_filtrado,
+                    "valor_total": valor_total,
+                    **totais,
+                }
+            )
+
         return render_template(
             "listar.html",
-            patrimonios=patrimonios,
+            patrimonios=pagina.itens,
+            proximo_cursor=pagina.proximo_cursor,
+            filtros=params,
             valor_total=valor_total,
-            total_patrimonios=total_patrimonios,
-            somente_estoque=somente_estoque,
-            total_estoque=total_estoque,
-            total_alocados=total_alocados,
-            valor_total_estoque=valor_total_estoque,
-            valor_total_alocados=valor_total_alocados,
+            total_patrimonios=pagina.total_filtrado,
+            somente_estoque=params.somente_estoque,
+            total_estoque=totais["total_estoque"],
+            total_alocados=totais["total_alocados"],
+            valor_total_estoque=totais["valor_total_estoque"],
+            valor_total_alocados=totais["valor_total_alocados"],
         )
 
     @app.get("/estoque")
@@ -179,7 +152,7 @@ def register_routes(
                 except Exception:
                     pass
 
-        colaboradores_cache.refresh_async(force=True)
+        _atualizar_cache(colaboradores_cache, lambda: colaboradores_cache.apply_insert(nome))
         return redirect(url_for("colaboradores_page"))
 
     @app.post("/editar_colaborador")
@@ -192,8 +165,9 @@ def register_routes(
         with db_connection(pool) as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("SELECT 1 FROM colaboradores WHERE cpf = %s", (cpf,))
-                if not cursor.fetchone():
+                cursor.execute("SELECT colaborador FROM colaboradores WHERE cpf = %s", (cpf,))
+                row = cursor.fetchone()
+                if not row:
                     return f"Erro: CPF {cpf} não encontrado.", 404
 
                 cursor.execute("UPDATE colaboradores SET colaborador = %s WHERE cpf = %s", (nome, cpf))
@@ -204,7 +178,7 @@ def register_routes(
                 except Exception:
                     pass
 
-        colaboradores_cache.refresh_async(force=True)
+        _atualizar_cache(colaboradores_cache, lambda: colaboradores_cache.apply_rename(row[0], nome))
         return redirect(url_for("colaboradores_page"))
 
     @app.post("/excluir_colaborador")
@@ -216,8 +190,9 @@ def register_routes(
         with db_connection(pool) as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("SELECT 1 FROM colaboradores WHERE cpf = %s", (cpf,))
-                if not cursor.fetchone():
+                cursor.execute("SELECT colaborador FROM colaboradores WHERE cpf = %s", (cpf,))
+                row = cursor.fetchone()
+                if not row:
                     return f"Erro: CPF {cpf} não encontrado.", 404
 
                 cursor.execute("DELETE FROM colaboradores WHERE cpf = %s", (cpf,))
@@ -228,7 +203,7 @@ def register_routes(
                 except Exception:
                     pass
 
-        colaboradores_cache.refresh_async(force=True)
+        _atualizar_cache(colaboradores_cache, lambda: colaboradores_cache.apply_delete(row[0]))
         return redirect(url_for("colaboradores_page"))
 
     @app.post("/cadastrar")
@@ -287,11 +262,17 @@ def register_routes(
                         ),
                     )
                     conn.commit()
+                    _atualizar_cache(
+                        patrimonios_cache,
+                        lambda: patrimonios_cache.apply_change(added=(nome, etiqueta)),
+                    )
             finally:
                 try:
                     cursor.close()
                 except Exception:
                     pass
+                # Também no retorno antecipado: etiquetas anteriores já foram commitadas.
+                totais_cache.invalidate()
 
         return redirect(url_for("index"))
 
@@ -314,6 +295,9 @@ def register_routes(
         with db_connection(pool) as conn:
             cursor = conn.cursor()
             try:
+                cursor.execute("SELECT nome, etiqueta FROM patrimonios WHERE id = %s", (patrimonio_id,))
+                anterior = cursor.fetchone()
+
                 cursor.execute(
                     """
                     UPDATE patrimonios
@@ -335,12 +319,18 @@ def register_routes(
                     ),
                 )
                 conn.commit()
+                if anterior:
+                    _atualizar_cache(
+                        patrimonios_cache,
+                        lambda: patrimonios_cache.apply_change(removed=anterior, added=(nome, etiqueta)),
+                    )
             finally:
                 try:
                     cursor.close()
                 except Exception:
                     pass
 
+        totais_cache.invalidate()
         return "OK", 200
 
     @app.post("/devolver_estoque")
@@ -370,6 +360,7 @@ def register_routes(
                 except Exception:
                     pass
 
+        totais_cache.invalidate()
         return redirect(request.referrer or url_for("listar_patrimonios"))
 
     @app.post("/excluir_patrimonio")
@@ -381,18 +372,21 @@ def register_routes(
         with db_connection(pool) as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("SELECT 1 FROM patrimonios WHERE id = %s", (patrimonio_id,))
-                if not cursor.fetchone():
+                cursor.execute("SELECT nome, etiqueta FROM patrimonios WHERE id = %s", (patrimonio_id,))
+                anterior = cursor.fetchone()
+                if not anterior:
                     return f"Erro: patrimônio id {patrimonio_id} não encontrado.", 404
 
                 cursor.execute("DELETE FROM patrimonios WHERE id = %s", (patrimonio_id,))
                 conn.commit()
+                _atualizar_cache(patrimonios_cache, lambda: patrimonios_cache.apply_change(removed=anterior))
             finally:
                 try:
                     cursor.close()
                 except Exception:
                     pass
 
+        totais_cache.invalidate()
         return redirect(url_for("listar_patrimonios"))
 
     @app.route("/login", methods=["GET", "POST"])
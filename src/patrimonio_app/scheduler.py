@@ -1,25 +1,83 @@
 from __future__ import annotations
 
 import logging
+import threading
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from mysql.connector import pooling
 
-from .jobs import log_execution_time, refresh_mv_job, routeviolation_completo, tags_job
+from .jobs import log_execution_time, refresh_mv_job, routeviolation_completo, run_migrations, tags_job
+from .leader_lock import LeaderLock
 from .settings import SchedulerSettings
 
 
+# Referência à thread do modo embutido (e, por ela, ao lock e à sua conexão).
+_embedded_thread: threading.Thread | None = None
+
+
+def run_as_leader(lock: LeaderLock, *, poll_seconds: int, stop: threading.Event) -> None:
+    """Executa os jobs somente enquanto este processo detiver o lock de líder.
+
+    Ao obter o lock, aplica as migrações pendentes (os jobs não executam DDL) e
+    só então inicia os jobs; se as migrações falharem, libera o lock e tenta de
+    novo no próximo ciclo. A posse do lock é conferida a cada `poll_seconds`: se
+    a conexão dona cair, o MySQL libera o lock e os jobs são parados.
+    """
+    while not stop.is_set():
+        if not lock.try_acquire():
+            stop.wait(poll_seconds)
+            continue
+
+        if not run_migrations():
+            logging.error(f"Jobs não iniciados: migrações falharam; nova tentativa em {poll_seconds}s.")
+            lock.release()
+            stop.wait(poll_seconds)
+            continue
+
+        logging.info("Liderança obtida; iniciando jobs agendados.")
+        scheduler = BackgroundScheduler()
+        register_jobs(scheduler)
+        scheduler.start()
+
+        while not stop.is_set() and lock.is_held():
+            stop.wait(poll_seconds)
+
+        scheduler.shutdown(wait=True)
+        if not stop.is_set():
+            logging.warning("Liderança perdida; jobs parados até obter o lock novamente.")
+
+    lock.release()
+
+
 def configure_scheduler(*, settings: SchedulerSettings, pool: pooling.MySQLConnectionPool) -> None:
-    # `pool` fica aqui para futuramente jobs que usem DB diretamente; por enquanto não usa.
-    _ = pool
+    """Inicia os jobs dentro do processo web (opt-in com SCHEDULER_ENABLED=1, ex.: `python app.py`).
+
+    Usa o mesmo lock de líder do worker dedicado (`worker.py`): sob gunicorn, só
+    o processo que o detém roda os jobs; os demais ficam de reserva e assumem
+    se ele perder o lock. A eleição roda numa thread daemon do processo.
+    """
+    global _embedded_thread
+
+    if _embedded_thread is not None and _embedded_thread.is_alive():
+        return
+    lock = LeaderLock(connect=pool.get_connection, name=settings.lock_name)
+    _embedded_thread = threading.Thread(
+        target=run_as_leader,
+        args=(lock,),
+        kwargs={"poll_seconds": settings.leader_poll_seconds, "stop": threading.Event()},
+        name="scheduler-leader",
+        daemon=True,
+    )
+    _embedded_thread.start()
+    logging.info("Agendador embutido aguardando liderança.")
 
+
+def register_jobs(scheduler) -> None:
     from grid import processar_grid
     from odometer import main as odometer_main
     from remover_rotas_canceladas import remover_rotas_canceladas
     from ultima_execucao import atualizar_ultima_execucao
 
-    scheduler = BackgroundScheduler()
-
     scheduler.add_job(
         func=log_execution_time(processar_grid),
         trigger="interval",
@@ -77,9 +135,3 @@ def configure_scheduler(*, settings: SchedulerSettings, pool: pooling.MySQLConne
         max_instances=1,
         coalesce=True,
     )
-
-    try:
-        scheduler.start()
-        logging.info("Agendador iniciado com sucesso.")
-    except Exception as e:
-        logging.error(f"Erro ao iniciar o agendador: {e}")
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import json
 import os
+import tempfile
 from dataclasses import dataclass
 from datetime import timedelta
 from pathlib import Path
@@ -27,6 +28,15 @@ class DriveSettings:
 @dataclass(frozen=True)
 class SchedulerSettings:
     enabled: bool
+    lock_name: str = "patrimonio_scheduler"
+    # Intervalo com que o worker em espera tenta assumir (e o líder confirma) o lock.
+    leader_poll_seconds: int = 30
+
+
+@dataclass(frozen=True)
+class CacheSettings:
+    backend: str  # "local" (por processo) ou "sqlite" (compartilhado entre workers)
+    sqlite_path: str
 
 
 @dataclass(frozen=True)
@@ -39,6 +49,8 @@ class Settings:
     drive: DriveSettings
 
     colaboradores_cache_ttl: int
+    totais_cache_ttl: int
+    cache: CacheSettings
     scheduler: SchedulerSettings
 
 
@@ -84,9 +96,20 @@ def load_settings(*, base_dir: Path) -> Settings:
     drive_credentials_json = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
 
     cache_ttl = _int_env("COLAB_CACHE_TTL_SECONDS", default=300)
+    totais_cache_ttl = _int_env("TOTAIS_CACHE_TTL_SECONDS", default=60)
 
-    # Scheduler: por padrão, ligado quando rodando standalone.
-    scheduler_enabled = _bool_env("SCHEDULER_ENABLED", default=True)
+    # Cache compartilhado: em gunicorn com vários workers use CACHE_BACKEND=sqlite.
+    cache_backend = (os.getenv("CACHE_BACKEND") or "local").strip().lower()
+    if cache_backend not in {"local", "sqlite"}:
+        raise RuntimeError(f"Variável CACHE_BACKEND deve ser 'local' ou 'sqlite'; recebido: {cache_backend!r}")
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    cache_sqlite_path = os.getenv("CACHE_SQLITE_PATH") or os.path.join(shm_dir, "patrimonio_cache.sqlite3")
+
+    # Scheduler embutido no processo web: só por opt-in (ex.: `SCHEDULER_ENABLED=1 python app.py`
+    # em desenvolvimento). Em produção os jobs rodam no processo dedicado (`python worker.py`).
+    scheduler_enabled = _bool_env("SCHEDULER_ENABLED", default=False)
+    scheduler_lock_name = os.getenv("SCHEDULER_LOCK_NAME") or "patrimonio_scheduler"
+    scheduler_poll = _int_env("SCHEDULER_LEADER_POLL_SECONDS", default=30)
 
     return Settings(
         flask_secret_key=secret_key,
@@ -101,7 +124,13 @@ def load_settings(*, base_dir: Path) -> Settings:
         ),
         drive=DriveSettings(folder_id=drive_folder_id, credentials_json=drive_credentials_json),
         colaboradores_cache_ttl=cache_ttl,
-        scheduler=SchedulerSettings(enabled=scheduler_enabled),
+        totais_cache_ttl=totais_cache_ttl,
+        cache=CacheSettings(backend=cache_backend, sqlite_path=cache_sqlite_path),
+        scheduler=SchedulerSettings(
+            enabled=scheduler_enabled,
+            lock_name=scheduler_lock_name,
+            leader_poll_seconds=scheduler_poll,
+        ),
     )
 
 
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from mysql.connector import pooling
+
+from .cache_backend import CacheBackend, LocalCacheBackend, try_publish, try_version
+from .db import db_connection
+from .patrimonios import calcular_totais
+
+
+@dataclass
+class TotaisPatrimoniosCache:
+    """Guarda os totais da listagem de patrimônios entre requisições.
+
+    As rotas que alteram `patrimonios` chamam `invalidate()` após o commit, que
+    também sinaliza os demais workers pelo backend; o TTL cobre escritas feitas
+    fora da aplicação.
+    """
+
+    pool: pooling.MySQLConnectionPool
+    ttl_seconds: int = 60
+    backend: CacheBackend = field(default_factory=LocalCacheBackend)
+    backend_key: str = "patrimonios_totais"
+
+    _totais: dict[str, Any] | None = None
+    _last_load: float = 0.0
+    _generation: int = 0
+    # Última versão do sinal de invalidação compartilhado já observada.
+    _shared_version: int = 0
+    _lock: threading.Lock = None  # type: ignore[assignment]
+
+    def __post_init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def get(self, cursor=None) -> dict[str, Any]:
+        """Retorna os totais, recalculando se expirados.
+
+        `cursor` permite reaproveitar a conexão já aberta pela rota.
+        """
+        now = time.time()
+        shared_version = try_version(self.backend, self.backend_key)
+        with self._lock:
+            # Sem backend (None), vale o estado local e o TTL.
+            if shared_version is not None and shared_version != self._shared_version:
+                # Outro worker alterou patrimônios desde o último cálculo.
+                self._totais = None
+                self._shared_version = shared_version
+                self._generation += 1
+            if self._totais is not None and (now - self._last_load) <= self.ttl_seconds:
+                return self._totais
+            generation = self._generation
+
+        if cursor is not None:
+            totais = calcular_totais(cursor)
+        else:
+            with db_connection(self.pool) as conn:
+                cur = conn.cursor()
+                try:
+                    totais = calcular_totais(cur)
+                finally:
+                    try:
+                        cur.close()
+                    except Exception:
+                        pass
+
+        with self._lock:
+            # Não publica um cálculo que começou antes de uma invalidação.
+            if generation == self._generation:
+                self._totais = totais
+                self._last_load = now
+        return totais
+
+    def invalidate(self) -> None:
+        """Descarta os totais; não levanta exceção se o backend falhar (vale o TTL nos outros workers)."""
+        shared_version = try_publish(self.backend, self.backend_key, None)
+        with self._lock:
+            self._totais = None
+            self._last_load = 0.0
+            if shared_version is not None:
+                self._shared_version = shared_version
+            self._generation += 1
@@ -0,0 +1,54 @@
+"""Processo dedicado aos jobs agendados (grid, odômetro, tags, MV...).
+
+Uso (na raiz do projeto):
+
+    python worker.py
+
+Os workers web não rodam jobs (`SCHEDULER_ENABLED` vem desligado). Várias
+instâncias deste worker podem subir ao mesmo tempo: só a que obtém o lock de
+líder no MySQL executa os jobs; as demais ficam em espera e assumem se o
+líder cair.
+"""
+
+from __future__ import annotations
+
+import logging
+import signal
+import threading
+from pathlib import Path
+
+import mysql.connector
+
+from .leader_lock import LeaderLock
+from .logging_setup import configure_logging
+from .scheduler import run_as_leader
+from .settings import load_settings
+
+
+def main() -> None:
+    base_dir = Path(__file__).resolve().parents[2]
+    settings = load_settings(base_dir=base_dir)
+    configure_logging(settings.log_level)
+
+    db = settings.db
+    lock = LeaderLock(
+        connect=lambda: mysql.connector.connect(
+            host=db.host,
+            user=db.user,
+            password=db.password,
+            database=db.database,
+        ),
+        name=settings.scheduler.lock_name,
+    )
+
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+
+    logging.info("Worker de jobs iniciado; aguardando liderança.")
+    run_as_leader(lock, poll_seconds=settings.scheduler.leader_poll_seconds, stop=stop)
+    logging.info("Worker de jobs encerrado.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,63 @@
+ESCOLA_PADRAO = "COL.ESTAD.DJALMA MARINHO"
+
+def _moda_por_aluno(df, coluna):
+    """Valor mais frequente de `coluna` por matrícula (no empate, o menor, como Series.mode()[0])."""
+    contagem = df.dropna(subset=[coluna]).groupby(['Matricula', coluna]).size().reset_index(name='n')
+    contagem = contagem.sort_values(['Matricula', 'n', coluna], ascending=[True, False, True])
+    return contagem.drop_duplicates('Matricula').set_index('Matricula')[coluna]
+
+def _limites_por_aluno(veiculo_df, escola_df):
+    """Entradas/saídas brutas de todos os alunos do dia, uma linha por matrícula.
+
+    Os logs de veículo são ordenados uma única vez e divididos em trechos por
+    aluno (gap > GAP_SECONDS) com diff/cumsum agrupados: o 1º trecho é a ida e
+    o 2º a volta. Na escola valem o primeiro e o último registro do aluno.
+    Valores ausentes saem como None.
+    """
+    import pandas as pd
+    partes = []
+
+    if not veiculo_df.empty:
+        v = veiculo_df.dropna(subset=['Matricula']).copy()
+        v['EventDate_dt'] = pd.to_datetime(v['EventDate'])
+        v = v.sort_values(['Matricula', 'EventDate_dt'], kind='mergesort')
+        gap = v.groupby('Matricula')['EventDate_dt'].diff().dt.total_seconds()
+        v['trecho'] = (gap > GAP_SECONDS).groupby(v['Matricula']).cumsum()
+        trechos = v[v['trecho'] < 2].groupby(['Matricula', 'trecho'])['EventDate'].agg(['min', 'max'])
+        # Trecho de um único horário: só a entrada.
+        trechos['max'] = trechos['max'].where(trechos['max'] != trechos['min'])
+        for numero, nome in ((0, 'ida'), (1, 'volta')):
+            trecho = trechos[trechos.index.get_level_values('trecho') == numero].droplevel('trecho')
+            partes.append(trecho.rename(columns={'min': f'entrada_{nome}', 'max': f'saida_{nome}'}))
+        partes.append(_moda_por_aluno(v, 'Placa').rename('veiculo_placa'))
+
+    if not escola_df.empty:
+        e = escola_df.dropna(subset=['Matricula'])
+        escola = e.groupby('Matricula')['EventDate'].agg(entrada_escola='min', saida_escola='max', registros='size')
+        unico = escola['registros'] == 1
+        repetido = ~unico & (escola['entrada_escola'] == escola['saida_escola'])
+        escola = escola.astype({'entrada_escola': object, 'saida_escola': object})
+        escola.loc[unico | repetido, 'saida_escola'] = None
+        escola.loc[repetido, 'entrada_escola'] = None
+        partes.append(escola.drop(columns='registros'))
+        partes.append(_moda_por_aluno(e, 'Nome').rename('escola_nome'))
+
+    colunas = ['escola_nome', 'veiculo_placa', 'entrada_ida', 'saida_ida',
+               'entrada_escola', 'saida_escola', 'entrada_volta', 'saida_volta']
+    limites = pd.concat(partes, axis=1).reindex(columns=colunas).sort_index().astype(object)
+    limites = limites.where(limites.notna(), None)
+    limites['escola_nome'] = limites['escola_nome'].where(limites['escola_nome'].notna(), ESCOLA_PADRAO)
+
+    # Caso excepcional: entrou na escola sem registrar a saída, mas há volta de veículo.
+    sem_saida = limites['entrada_escola'].notna() & limites['saida_escola'].isna() & limites['entrada_volta'].notna()
+    for matricula in limites.index[sem_saida]:
+        try:
+            entrada_volta = pd.to_datetime(limites.at[matricula, 'entrada_volta'])
+            limites.at[matricula, 'saida_escola'] = (entrada_volta - timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M:%S')
+        except Exception:
+            pass
+    return limites
+
 def preencher_tabela_aluno(data_execucao):
     import pandas as pd
     data_str = data_execucao.strftime('%Y-%m-%d')
@@ -18,205 +78,38 @@ def preencher_tabela_aluno(data_execucao):
         conn.close()
         return
 
-    alunos = sorted(set(veiculo_df['Matricula'].unique() if not veiculo_df.empty else []).union(
-                    set(escola_df['Matricula'].unique() if not escola_df.empty else [])))
-
-    for matricula in alunos:
-        veic_logs = veiculo_df[veiculo_df['Matricula'] == matricula].sort_values('EventDate') if not veiculo_df.empty else pd.DataFrame()
-        escola_logs = escola_df[escola_df['Matricula'] == matricula].sort_values('EventDate') if not escola_df.empty else pd.DataFrame()
-        # Processar mesmo se não houver logs de veículo, desde que haja logs da escola
-        if veic_logs.empty and escola_logs.empty:
-            continue
-        escola_nome = (escola_logs['Nome'].mode()[0] if not escola_logs.empty else "COL.ESTAD.DJALMA MARINHO")
-        veiculo_placa = veic_logs['Placa'].mode()[0] if not veic_logs.empty else None
-
-        # Somente preparar datetime/agrupamentos se houver logs de veículo
-        agrupamentos = []
-        if not veic_logs.empty:
-            veic_logs['EventDate_dt'] = pd.to_datetime(veic_logs['EventDate'])
-            veic_logs = veic_logs.sort_values('EventDate_dt').reset_index(drop=True)
-            agrupamentos = _split_by_gap(veic_logs, 'EventDate_dt', GAP_SECONDS)
-
-        entrada_ida_veic = saida_ida_veic = entrada_volta_veic = saida_volta_veic = None
-        if len(agrupamentos) >= 1:
-            ida_agrup = agrupamentos[0]
-            entrada_ida_veic = None
-            saida_ida_veic = None
-            if len(ida_agrup) == 1:
-                entrada_ida_veic = ida_agrup['EventDate'].iloc[0]
-            else:
-                entrada = ida_agrup['EventDate'].min()
-                saida = ida_agrup['EventDate'].max()
-                if entrada != saida:
-                    entrada_ida_veic = entrada
-                    saida_ida_veic = saida
-                else:
-                    entrada_ida_veic = entrada
-        if len(agrupamentos) >= 2:
-            volta_agrup = agrupamentos[1]
-            entrada_volta_veic = None
-            saida_volta_veic = None
-            if len(volta_agrup) == 1:
-                entrada_volta_veic = volta_agrup['EventDate'].iloc[0]
-            else:
-                entrada = volta_agrup['EventDate'].min()
-                saida = volta_agrup['EventDate'].max()
-                if entrada != saida:
-                    entrada_volta_veic = entrada
-                    saida_volta_veic = saida
-                else:
-                    entrada_volta_veic = entrada
-        entrada_escola = escola_logs['EventDate'].min() if not escola_logs.empty else None
-        saida_escola = escola_logs['EventDate'].max() if not escola_logs.empty else None
-        if len(escola_logs) == 1:
-            saida_escola = None
-        elif entrada_escola == saida_escola:
-            entrada_escola = None
-            saida_escola = None
-        if entrada_escola and not saida_escola and entrada_volta_veic:
-            try:
-                from datetime import datetime, timedelta
-                saida_escola = (pd.to_datetime(entrada_volta_veic) - timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M:%S')
-            except Exception:
-                pass
-
-        (
-            entrada_ida_veic,
-            saida_ida_veic,
-            entrada_escola,
-            saida_escola,
-            entrada_volta_veic,
-            saida_volta_veic
-        ) = ajustar_horarios_pelo_padrao(
-            matricula=matricula,
-            data_execucao=data_execucao,
-            entrada_ida=entrada_ida_veic,
-            saida_ida=saida_ida_veic,
-            entrada_escola=entrada_escola,
-            saida_escola=saida_escola,
-            entrada_volta=entrada_volta_veic,
-            saida_volta=saida_volta_veic
-        )
-
-        (
-            entrada_ida_veic,
-            saida_ida_veic,
-            entrada_escola,
-            saida_escola,
-            entrada_volta_veic,
-            saida_volta_veic
-        ) = inferir_horarios_por_semelhanca(
-            data_execucao=data_execucao,
-            placa=veiculo_placa,
-            entrada_ida=entrada_ida_veic,
-            saida_ida=saida_ida_veic,
-            entrada_escola=entrada_escola,
-            saida_escola=saida_escola,
-            entrada_volta=entrada_volta_veic,
-            saida_volta=saida_volta_veic
-        )
-
-        (
-            entrada_ida_veic,
-            saida_ida_veic,
-            entrada_escola,
-            saida_escola,
-            entrada_volta_veic,
-            saida_volta_veic
-        ) = garantir_ordem_cronologica_global(
-            entrada_ida_veic,
-            saida_ida_veic,
-            entrada_escola,
-            saida_escola,
-            entrada_volta_veic,
-            saida_volta_veic
-        )
+    limites = _limites_por_aluno(veiculo_df, escola_df)
+    indice = obter_indice(conn)  # recarrega os horários padrão se a tabela mudou
+    janelas = ajustar_janelas_do_dia(limites, data_execucao, indice)
 
+    linhas = [
         (
-            entrada_ida_veic,
-            saida_ida_veic,
-            entrada_escola,
-            saida_escola,
-            entrada_volta_veic,
-            saida_volta_veic
-        ) = ancorar_no_presente(
-            data_execucao,
-            entrada_ida_veic,
-            saida_ida_veic,
-            entrada_escola,
-            saida_escola,
-            entrada_volta_veic,
-            saida_volta_veic
-        )
-
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO Aluno (
-                Matricula, Escola, Veiculo,
-                Entrada_Ida_Veiculo, Saida_Ida_Veiculo,
-                Entrada_Escola, Saida_Escola,
-                Entrada_Volta_Veiculo, Saida_Volta_Veiculo,
-                Data_Execucao
-            ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            ON DUPLICATE KEY UPDATE
-                Entrada_Ida_Veiculo = VALUES(Entrada_Ida_Veiculo),
-                Saida_Ida_Veiculo = VALUES(Saida_Ida_Veiculo),
-                Entrada_Escola = VALUES(Entrada_Escola),
-                Saida_Escola = VALUES(Saida_Escola),
-                Entrada_Volta_Veiculo = VALUES(Entrada_Volta_Veiculo),
-                Saida_Volta_Veiculo = VALUES(Saida_Volta_Veiculo)
-        """, (
             matricula,
-            escola_nome,
-            veiculo_placa,
-            entrada_ida_veic,
-            saida_ida_veic,
-            entrada_escola,
-            saida_escola,
-            entrada_volta_veic,
-            saida_volta_veic,
-            data_execucao.strftime('%Y-%m-%d')
-        ))
-        cursor.close()
-    conn.commit()
-    conn.close()
-def criar_tabela_aluno():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Aluno (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            Matricula VARCHAR(50) NOT NULL,
-            Escola VARCHAR(255) NOT NULL,
-            Veiculo VARCHAR(20) DEFAULT NULL,
-            Entrada_Ida_Veiculo DATETIME,
-            Saida_Ida_Veiculo DATETIME,
-            Entrada_Escola DATETIME,
-            Saida_Escola DATETIME,
-            Entrada_Volta_Veiculo DATETIME,
-            Saida_Volta_Veiculo DATETIME,
-            Data_Execucao DATE NOT NULL,
-            UNIQUE KEY uniq_aluno_dia (Matricula, Data_Execucao)
+            lim['escola_nome'],
+            lim['veiculo_placa'],
+            *(janelas.at[matricula, c] for c in _COLUNAS_JANELAS),
+            data_str
         )
-    """)
+        for matricula, lim in limites.iterrows()
+    ]
+
     try:
-        cursor.execute("CREATE UNIQUE INDEX uniq_aluno_dia ON Aluno (Matricula, Data_Execucao)")
-    except Exception:
-        pass
-    conn.commit()
-    cursor.close()
-    conn.close()
+        upsert_em_lotes(conn, UPSERT_ALUNO, linhas)
+    finally:
+        conn.close()
 
 import mysql.connector
 from mysql.connector import pooling
 import os
 from dotenv import load_dotenv
 
-import requests
-
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Optional
 
-API_URL = "https://integration.systemsatx.com.br/Controlws/HistoryPosition/List"
+from horarios_padrao import CAMPOS as CAMPOS_HORARIOS, obter_indice
+from position_cache import buscar_posicoes
+from satx_client import HISTORY_POSITION_PATH, get_client, iter_json_items
+
 GAP_SECONDS = 600  # 10 minutos
 
 def _ajustar_timestamp_iso_para_local(dt_str: Optional[str], shift_hours: int = 3) -> Optional[str]:
@@ -267,144 +160,9 @@ DB_USER = os.getenv('POWERBI_DB_USER')
 DB_PASSWORD = os.getenv('POWERBI_DB_PASSWORD')
 DB_NAME = os.getenv('POWERBI_DB_NAME')
 
-# HORÁRIOS PADRAO POR MATRÍCULA
-HORARIOS_PADRAO = {
-    "5809670":   {"ida_entrada":"06:32","ida_saida":"06:33","escola_entrada":"12:10","escola_saida":"12:14","volta_entrada":"12:15","volta_saida":"12:17"},
-    "19808897":  {"ida_entrada":"06:39","ida_saida":"06:46","escola_entrada":"06:47","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:27"},
-    "11563534":  {"ida_entrada":"12:42","ida_saida":"12:47","escola_entrada":"12:48","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:24"},
-    "14599025":  {"ida_entrada":"12:40","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:17","volta_entrada":"18:17","volta_saida":"18:20"},
-    "14611467":  {"ida_entrada":"12:44","ida_saida":"12:45","escola_entrada":"12:49","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:17"},
-    "14612269":  {"ida_entrada":"12:40","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:16"},
-    "16498552":  {"ida_entrada":"12:42","ida_saida":"12:47","escola_entrada":"12:48","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:20"},
-    "183317":    {"ida_entrada":"12:40","ida_saida":"12:47","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:25"},
-    "4233022":   {"ida_entrada":"06:35","ida_saida":"06:37","escola_entrada":"06:42","escola_saida":"12:14","volta_entrada":"12:15","volta_saida":"12:23"},
-    "913443":    {"ida_entrada":"06:35","ida_saida":"06:36","escola_entrada":"06:55","escola_saida":"12:13","volta_entrada":"12:15","volta_saida":"12:22"},
-    "17519090":  {"ida_entrada":"06:40","ida_saida":"06:47","escola_entrada":"06:57","escola_saida":"12:20","volta_entrada":"12:21","volta_saida":"12:31"},
-    "30893251":  {"ida_entrada":"06:40","ida_saida":"06:46","escola_entrada":"06:47","escola_saida":"12:21","volta_entrada":"12:22","volta_saida":"12:31"},
-    "7906753":   {"ida_entrada":"06:38","ida_saida":"06:47","escola_entrada":"06:47","escola_saida":"12:17","volta_entrada":"12:22","volta_saida":"12:24"},
-    "933196":    {"ida_entrada":"06:39","ida_saida":"06:47","escola_entrada":"06:47","escola_saida":"12:26","volta_entrada":"12:27","volta_saida":"12:28"},
-    "14597596":  {"ida_entrada":"12:39","ida_saida":"12:46","escola_entrada":"12:46","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:18"},
-    "5809017":   {"ida_entrada":"06:31","ida_saida":"06:32","escola_entrada":"06:59","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:25"},
-    "863580":    {"ida_entrada":"06:28","ida_saida":"06:29","escola_entrada":"06:51","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:24"},
-    "863660":    {"ida_entrada":"06:39","ida_saida":"06:48","escola_entrada":"06:49","escola_saida":"12:17","volta_entrada":"12:17","volta_saida":"12:19"},
-    "2367271":   {"ida_entrada":"06:38","ida_saida":"06:45","escola_entrada":"06:50","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:27"},
-    "12265855":  {"ida_entrada":"06:28","ida_saida":"06:35","escola_entrada":"06:56","escola_saida":"12:14","volta_entrada":"12:15","volta_saida":"12:24"},
-    "12562698":  {"ida_entrada":"12:44","ida_saida":"12:45","escola_entrada":"12:45","escola_saida":"18:18","volta_entrada":"18:19","volta_saida":"18:20"},
-    "17205346":  {"ida_entrada":"06:39","ida_saida":"06:40","escola_entrada":"06:43","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:17"},
-    "6604079":   {"ida_entrada":"06:34","ida_saida":"06:39","escola_entrada":"06:44","escola_saida":"12:14","volta_entrada":"12:15","volta_saida":"12:21"},
-    "19309253":  {"ida_entrada":"06:32","ida_saida":"06:39","escola_entrada":"06:56","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:26"},
-    "12428428":  {"ida_entrada":"12:41","ida_saida":"12:49","escola_entrada":"12:49","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:23"},
-    "11852927":  {"ida_entrada":"06:45","ida_saida":"06:48","escola_entrada":"06:51","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:26"},
-    "12988318":  {"ida_entrada":"06:41","ida_saida":"06:48","escola_entrada":"06:48","escola_saida":"12:27","volta_entrada":"12:28","volta_saida":"12:31"},
-    "17109550":  {"ida_entrada":"06:41","ida_saida":"06:43","escola_entrada":"06:49","escola_saida":"12:27","volta_entrada":"12:28","volta_saida":"12:31"},
-    "32191025":  {"ida_entrada":"06:41","ida_saida":"06:42","escola_entrada":"06:47","escola_saida":"12:17","volta_entrada":"12:21","volta_saida":"12:25"},
-    "4247767":   {"ida_entrada":"06:40","ida_saida":"06:42","escola_entrada":"06:47","escola_saida":"12:26","volta_entrada":"12:27","volta_saida":"12:29"},
-    "6855837":   {"ida_entrada":"06:39","ida_saida":"06:45","escola_entrada":"06:47","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:20"},
-    "6856264":   {"ida_entrada":"06:38","ida_saida":"06:39","escola_entrada":"06:47","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:23"},
-    "746712":    {"ida_entrada":"06:45","ida_saida":"06:47","escola_entrada":"06:48","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:20"},
-    "7895239":   {"ida_entrada":"06:37","ida_saida":"06:46","escola_entrada":"06:49","escola_saida":"12:21","volta_entrada":"12:22","volta_saida":"12:23"},
-    "7896022":   {"ida_entrada":"06:48","ida_saida":"06:53","escola_entrada":"06:55","escola_saida":"12:18","volta_entrada":"12:18","volta_saida":"12:23"},
-    "810213":    {"ida_entrada":"06:39","ida_saida":"06:48","escola_entrada":"06:49","escola_saida":"12:18","volta_entrada":"12:18","volta_saida":"12:22"},
-    "1366996":   {"ida_entrada":"06:41","ida_saida":"06:42","escola_entrada":"06:52","escola_saida":"12:26","volta_entrada":"12:27","volta_saida":"12:29"},
-    "580994":    {"ida_entrada":"06:31","ida_saida":"06:39","escola_entrada":"06:52","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:23"},
-    "5997778":   {"ida_entrada":"06:29","ida_saida":"06:35","escola_entrada":"06:56","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:31"},
-    "9519327":   {"ida_entrada":"06:38","ida_saida":"06:42","escola_entrada":"06:44","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:23"},
-    "11541611":  {"ida_entrada":"12:18","ida_saida":"12:26","escola_entrada":"12:27","escola_saida":"18:28","volta_entrada":"18:29","volta_saida":"18:34"},
-    "1257957":   {"ida_entrada":"12:31","ida_saida":"12:33","escola_entrada":"12:40","escola_saida":"18:18","volta_entrada":"18:19","volta_saida":"18:24"},
-    "14297363":  {"ida_entrada":"12:37","ida_saida":"12:39","escola_entrada":"12:44","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:18"},
-    "14597456":  {"ida_entrada":"12:29","ida_saida":"12:30","escola_entrada":"12:40","escola_saida":"18:13","volta_entrada":"18:14","volta_saida":"18:16"},
-    "16399333":  {"ida_entrada":"12:25","ida_saida":"12:34","escola_entrada":"12:44","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:24"},
-    "16554886":  {"ida_entrada":"12:27","ida_saida":"12:35","escola_entrada":"12:37","escola_saida":"18:18","volta_entrada":"18:18","volta_saida":"18:20"},
-    "171251":    {"ida_entrada":"12:34","ida_saida":"12:37","escola_entrada":"12:38","escola_saida":"18:15","volta_entrada":"18:15","volta_saida":"18:20"},
-    "17166359":  {"ida_entrada":"12:31","ida_saida":"12:39","escola_entrada":"12:40","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:32"},
-    "17839388":  {"ida_entrada":"12:29","ida_saida":"12:35","escola_entrada":"12:40","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:25"},
-    "19805596":  {"ida_entrada":"12:27","ida_saida":"12:36","escola_entrada":"12:38","escola_saida":"18:18","volta_entrada":"18:19","volta_saida":"18:28"},
-    "201531":    {"ida_entrada":"06:45","ida_saida":"06:46","escola_entrada":"06:46","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:19"},
-    "29915454":  {"ida_entrada":"12:31","ida_saida":"12:39","escola_entrada":"12:39","escola_saida":"18:18","volta_entrada":"18:19","volta_saida":"18:28"},
-    "32184720":  {"ida_entrada":"12:27","ida_saida":"12:35","escola_entrada":"12:46","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:28"},
-    "32185564":  {"ida_entrada":"12:27","ida_saida":"12:35","escola_entrada":"12:49","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:28"},
-    "5946316":   {"ida_entrada":"06:29","ida_saida":"06:35","escola_entrada":"06:56","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:21"},
-    "681823":    {"ida_entrada":"06:35","ida_saida":"06:37","escola_entrada":"06:37","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:21"},
-    "7893368":   {"ida_entrada":"12:20","ida_saida":"12:21","escola_entrada":"12:22","escola_saida":"18:15","volta_entrada":"18:15","volta_saida":"18:19"},
-    "7897851":   {"ida_entrada":"06:46","ida_saida":"06:54","escola_entrada":"06:56","escola_saida":"12:30","volta_entrada":"12:31","volta_saida":"12:37"},
-    "9963959":   {"ida_entrada":"06:46","ida_saida":"06:47","escola_entrada":"06:48","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:18"},
-    "9991766":   {"ida_entrada":"06:35","ida_saida":"06:40","escola_entrada":"06:46","escola_saida":"12:27","volta_entrada":"12:28","volta_saida":"12:33"},
-    "10654919":  {"ida_entrada":"12:42","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:18"},
-    "14611661":  {"ida_entrada":"12:41","ida_saida":"12:45","escola_entrada":"12:46","escola_saida":"18:23","volta_entrada":"18:24","volta_saida":"18:28"},
-    "1534315":   {"ida_entrada":"12:42","ida_saida":"12:45","escola_entrada":"12:51","escola_saida":"18:17","volta_entrada":"18:26","volta_saida":"18:29"},
-    "1724510":   {"ida_entrada":"06:32","ida_saida":"06:39","escola_entrada":"06:42","escola_saida":"12:30","volta_entrada":"12:30","volta_saida":"12:37"},
-    "5148720":   {"ida_entrada":"06:50","ida_saida":"06:56","escola_entrada":"06:57","escola_saida":"12:15","volta_entrada":"12:18","volta_saida":"12:21"},
-    "5808690":   {"ida_entrada":"06:34","ida_saida":"06:39","escola_entrada":"06:46","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:20"},
-    "686094":    {"ida_entrada":"06:26","ida_saida":"06:27","escola_entrada":"06:47","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:18"},
-    "7977561":   {"ida_entrada":"12:46","ida_saida":"12:47","escola_entrada":"18:18","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:22"},
-    "873682":    {"ida_entrada":"06:50","ida_saida":"06:53","escola_entrada":"06:54","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:18"},
-    "9966095":   {"ida_entrada":"12:43","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:20"},
-    "10257286":  {"ida_entrada":"12:31","ida_saida":"12:39","escola_entrada":"12:40","escola_saida":"18:19","volta_entrada":"18:20","volta_saida":"18:24"},
-    "1390970":   {"ida_entrada":"06:43","ida_saida":"06:46","escola_entrada":"06:47","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:19"},
-    "4395332":   {"ida_entrada":"12:42","ida_saida":"12:47","escola_entrada":"12:48","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:20"},
-    "11294231":  {"ida_entrada":"06:44","ida_saida":"06:48","escola_entrada":"06:50","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:19"},
-    "1320806":   {"ida_entrada":"06:40","ida_saida":"06:45","escola_entrada":"06:49","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:19"},
-    "16211024":  {"ida_entrada":"06:40","ida_saida":"06:43","escola_entrada":"06:44","escola_saida":"12:27","volta_entrada":"12:28","volta_saida":"12:31"},
-    "27959039":  {"ida_entrada":"12:39","ida_saida":"12:46","escola_entrada":"12:48","escola_saida":"18:17","volta_entrada":"18:17","volta_saida":"18:18"},
-    "33754260":  {"ida_entrada":"12:44","ida_saida":"12:45","escola_entrada":"12:46","escola_saida":"18:15","volta_entrada":"18:15","volta_saida":"18:17"},
-    "4249190":   {"ida_entrada":"06:39","ida_saida":"06:47","escola_entrada":"06:52","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:23"},
-    "4269752":   {"ida_entrada":"06:26","ida_saida":"06:35","escola_entrada":"06:46","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:27"},
-    "9208220":   {"ida_entrada":"06:39","ida_saida":"06:43","escola_entrada":"06:44","escola_saida":"12:16","volta_entrada":"12:17","volta_saida":"12:19"},
-    "935566":    {"ida_entrada":"12:45","ida_saida":"12:46","escola_entrada":"12:46","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:17"},
-    "9441550":   {"ida_entrada":"06:39","ida_saida":"06:44","escola_entrada":"06:45","escola_saida":"12:17","volta_entrada":"12:18","volta_saida":"12:20"},
-    "12428355":  {"ida_entrada":"12:43","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:22"},
-    "14598690":  {"ida_entrada":"12:42","ida_saida":"12:46","escola_entrada":"12:49","escola_saida":"18:17","volta_entrada":"18:18","volta_saida":"18:20"},
-    "9962685":   {"ida_entrada":"12:39","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:25"},
-    "16678119":  {"ida_entrada":"06:41","ida_saida":"06:45","escola_entrada":"06:46","escola_saida":"12:26","volta_entrada":"12:27","volta_saida":"12:30"},
-    "30893260":  {"ida_entrada":"12:31","ida_saida":"12:38","escola_entrada":"12:39","escola_saida":"18:18","volta_entrada":"18:18","volta_saida":"18:22"},
-    "633272":    {"ida_entrada":"06:46","ida_saida":"06:47","escola_entrada":"06:48","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:18"},
-    "7899242":   {"ida_entrada":"06:49","ida_saida":"06:52","escola_entrada":"06:53","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:18"},
-    "7893554":   {"ida_entrada":"06:49","ida_saida":"06:55","escola_entrada":"06:56","escola_saida":"12:14","volta_entrada":"12:14","volta_saida":"12:20"},
-    "8852118":   {"ida_entrada":"06:46","ida_saida":"06:47","escola_entrada":"06:48","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:18"},
-    "12734049":  {"ida_entrada":"12:41","ida_saida":"12:45","escola_entrada":"12:46","escola_saida":"18:27","volta_entrada":"18:28","volta_saida":"18:32"},
-    "15417354":  {"ida_entrada":"12:39","ida_saida":"12:41","escola_entrada":"12:42","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:18"},
-    "27608910":  {"ida_entrada":"06:40","ida_saida":"06:43","escola_entrada":"06:44","escola_saida":"12:15","volta_entrada":"12:16","volta_saida":"12:19"},
-    "5999010":   {"ida_entrada":"06:39","ida_saida":"06:42","escola_entrada":"06:43","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:19"},
-    "686517":    {"ida_entrada":"12:27","ida_saida":"12:28","escola_entrada":"12:29","escola_saida":"18:15","volta_entrada":"18:16","volta_saida":"18:18"},
-    "12508715":  {"ida_entrada":"06:46","ida_saida":"06:57","escola_entrada":"06:58","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:24"},
-    "2373479":   {"ida_entrada":"12:28","ida_saida":"12:37","escola_entrada":"12:39","escola_saida":"18:17","volta_entrada":"18:17","volta_saida":"18:25"},
-    "7894354":   {"ida_entrada":"06:39","ida_saida":"06:43","escola_entrada":"06:44","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:20"},
-    "14708878":  {"ida_entrada":"12:42","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:21"},
-    "7902294":   {"ida_entrada":"12:35","ida_saida":"12:39","escola_entrada":"12:40","escola_saida":"18:15","volta_entrada":"18:15","volta_saida":"18:21"},
-    "5809360":   {"ida_entrada":"06:39","ida_saida":"06:51","escola_entrada":"06:52","escola_saida":"12:16","volta_entrada":"12:16","volta_saida":"12:26"},
-    "12428380":  {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:19","volta_entrada":"18:19","volta_saida":"18:22"},
-    "1258076":   {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:29","volta_entrada":"18:30","volta_saida":"18:34"},
-    "1263162":   {"ida_entrada":"12:38","ida_saida":"12:43","escola_entrada":"12:44","escola_saida":"18:28","volta_entrada":"18:29","volta_saida":"18:34"},
-    "14293163":  {"ida_entrada":"12:38","ida_saida":"12:43","escola_entrada":"12:44","escola_saida":"18:27","volta_entrada":"18:28","volta_saida":"18:32"},
-    "14304122":  {"ida_entrada":"12:36","ida_saida":"12:43","escola_entrada":"12:44","escola_saida":"18:18","volta_entrada":"18:29","volta_saida":"18:35"},
-    "1588253":   {"ida_entrada":"12:36","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:17","volta_entrada":"18:18","volta_saida":"18:28"},
-    "16495340":  {"ida_entrada":"12:43","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:14","volta_entrada":"18:32","volta_saida":"18:33"},
-    "17145084":  {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:22"},
-    "1765293":   {"ida_entrada":"12:41","ida_saida":"12:42","escola_entrada":"12:43","escola_saida":"18:14","volta_entrada":"18:15","volta_saida":"18:16"},
-    "17808431":  {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:15","volta_entrada":"18:34","volta_saida":"18:38"},
-    "18808079":  {"ida_entrada":"12:40","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:32","volta_entrada":"18:32","volta_saida":"18:35"},
-    "29853246":  {"ida_entrada":"12:41","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:16","volta_entrada":"18:33","volta_saida":"18:36"},
-    "5875125":   {"ida_entrada":"12:41","ida_saida":"12:44","escola_entrada":"12:45","escola_saida":"18:17","volta_entrada":"18:28","volta_saida":"18:31"},
-    "884342":    {"ida_entrada":"12:40","ida_saida":"12:43","escola_entrada":"12:44","escola_saida":"18:33","volta_entrada":"18:34","volta_saida":"18:36"},
-    "13391595":  {"ida_entrada":"12:45","ida_saida":"12:50","escola_entrada":"12:51","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:22"},
-    "1706262":   {"ida_entrada":"12:42","ida_saida":"12:46","escola_entrada":"12:47","escola_saida":"18:16","volta_entrada":"18:16","volta_saida":"18:22"},
-    "12428517":  {"ida_entrada":"12:42","ida_saida":"12:48","escola_entrada":"12:49","escola_saida":"18:16","volta_entrada":"18:17","volta_saida":"18:20"},
-    "9962120":   {"ida_entrada":"06:50","ida_saida":"06:52","escola_entrada":"06:53","escola_saida":"12:14","volta_entrada":"12:14","volta_saida":"12:16"},
-}
-
 THRESHOLD_MINUTOS_DERIVA = 90
 
 from datetime import datetime, timedelta
-from statistics import median
-
-def _combinar_data_hora(data_dt, hora_str):
-    if not hora_str:
-        return None
-    try:
-        hh, mm = map(int, str(hora_str).split(':')[:2])
-        return datetime(data_dt.year, data_dt.month, data_dt.day, hh, mm, 0)
-    except Exception:
-        return None
 
 def _to_datetime_or_none(val):
     if val is None:
@@ -437,7 +195,7 @@ def ajustar_horarios_pelo_padrao(
     entrada_volta,
     saida_volta
 ):
-    padrao = HORARIOS_PADRAO.get(str(matricula))
+    padrao = obter_indice().get(str(matricula))
     if not padrao:
         return (
             _fmt(_to_datetime_or_none(entrada_ida)),
@@ -460,8 +218,8 @@ def ajustar_horarios_pelo_padrao(
     thr = timedelta(minutes=THRESHOLD_MINUTOS_DERIVA)
 
     def apply_pair(cur_in, cur_out, key_in, key_out):
-        std_in = _combinar_data_hora(base, padrao.get(key_in))
-        std_out = _combinar_data_hora(base, padrao.get(key_out))
+        std_in = _dt_from_minutos(base, padrao.get(key_in))
+        std_out = _dt_from_minutos(base, padrao.get(key_out))
         if cur_in is None and cur_out is None:
             return None, None
         if cur_in is None:
@@ -486,14 +244,6 @@ def ajustar_horarios_pelo_padrao(
     return (_fmt(ei), _fmt(si), _fmt(ee), _fmt(se), _fmt(ev), _fmt(sv))
 
 
-def _to_minutos(hhmm):
-    if not hhmm: return None
-    try:
-        hh, mm = map(int, str(hhmm).split(':')[:2])
-        return hh*60 + mm
-    except Exception:
-        return None
-
 def _dt_from_minutos(base_date, minutos):
     if minutos is None or base_date is None:
         return None
@@ -501,32 +251,6 @@ def _dt_from_minutos(base_date, minutos):
     mm = minutos % 60
     return datetime(base_date.year, base_date.month, base_date.day, hh, mm, 0)
 
-def _calcular_medianas_horarios_padrao():
-    campos = ['ida_entrada','ida_saida','escola_entrada','escola_saida','volta_entrada','volta_saida']
-    buckets = {'manha': {c: [] for c in campos}, 'tarde': {c: [] for c in campos}}
-    for v in HORARIOS_PADRAO.values():
-        ent_escola_min = _to_minutos(v.get('escola_entrada'))
-        ref_min = ent_escola_min
-        if ref_min is None:
-            for c in ['ida_entrada','volta_entrada','ida_saida','volta_saida','escola_saida']:
-                ref_min = _to_minutos(v.get(c))
-                if ref_min is not None:
-                    break
-        turno = 'manha' if (ref_min is not None and ref_min < 12*60) else 'tarde'
-        for c in buckets[turno].keys():
-            m = _to_minutos(v.get(c))
-            if m is not None:
-                buckets[turno][c].append(m)
-    def _medianas(lista_por_campo):
-        out = {}
-        for k, lst in lista_por_campo.items():
-            if lst:
-                out[k] = int(median(lst))
-        return out
-    return {'manha': _medianas(buckets['manha']), 'tarde': _medianas(buckets['tarde'])}
-
-SHIFT_MEDIANS = _calcular_medianas_horarios_padrao()
-
 def inferir_horarios_por_semelhanca(
     data_execucao,
     placa,
@@ -548,7 +272,7 @@ def inferir_horarios_por_semelhanca(
 
     ref = ee or ei or ev or si or se or sv
     turno = 'manha' if (ref and ref.hour < 12) else 'tarde'
-    meds = SHIFT_MEDIANS.get(turno, {})
+    meds = obter_indice().medianas.get(turno, {})
 
     def fill_pair(cur_in, cur_out, key_in, key_out):
         if cur_in is None and cur_out is None:
@@ -582,212 +306,199 @@ connection_pool = pooling.MySQLConnectionPool(pool_name="mypool_tags", pool_size
 def get_db_connection():
     return connection_pool.get_connection()
 
-def criar_tabela_escola():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Escola (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            Nome VARCHAR(255) NOT NULL,
-            EventDate DATETIME NOT NULL,
-            UpdateDate DATETIME NOT NULL,
-            Matricula VARCHAR(50) NOT NULL,
-            Data_Execucao DATE NOT NULL,
-            UNIQUE KEY uniq_escola_evento (EventDate, Matricula)
-        )
-    """)
+# Linhas por executemany (um INSERT multi-linha e um commit por lote) nas tabelas Escola, Veiculo e Aluno.
+TAGS_UPSERT_CHUNK = int(os.getenv('TAGS_UPSERT_CHUNK', '500'))
+
+UPSERT_ESCOLA = """
+    INSERT INTO Escola (Nome, EventDate, UpdateDate, Matricula, Data_Execucao)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        Nome = VALUES(Nome),
+        UpdateDate = VALUES(UpdateDate)
+"""
+
+UPSERT_VEICULO = """
+    INSERT INTO Veiculo (Placa, EventDate, UpdateDate, Ignition, Matricula, Latitude, Longitude, Data_Execucao)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        UpdateDate = VALUES(UpdateDate),
+        Ignition = VALUES(Ignition),
+        Latitude = VALUES(Latitude),
+        Longitude = VALUES(Longitude)
+"""
+
+UPSERT_ALUNO = """
+    INSERT INTO Aluno (
+        Matricula, Escola, Veiculo,
+        Entrada_Ida_Veiculo, Saida_Ida_Veiculo,
+        Entrada_Escola, Saida_Escola,
+        Entrada_Volta_Veiculo, Saida_Volta_Veiculo,
+        Data_Execucao
+    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+    ON DUPLICATE KEY UPDATE
+        Entrada_Ida_Veiculo = VALUES(Entrada_Ida_Veiculo),
+        Saida_Ida_Veiculo = VALUES(Saida_Ida_Veiculo),
+        Entrada_Escola = VALUES(Entrada_Escola),
+        Saida_Escola = VALUES(Saida_Escola),
+        Entrada_Volta_Veiculo = VALUES(Entrada_Volta_Veiculo),
+        Saida_Volta_Veiculo = VALUES(Saida_Volta_Veiculo)
+"""
+
+# Frota e escolas: TAGS_PLACAS / TAGS_ESCOLAS (separadas por vírgula) têm prioridade
+# sobre as tabelas tags_veiculos / tags_escolas.
+TAGS_FETCH_CONCURRENCY = int(os.getenv('TAGS_FETCH_CONCURRENCY', '8'))
+PLACAS_PADRAO = ["AXM9A53", "CUE2D20", "IUZ4F94"]
+
+def _lista_configurada(variavel, tabela, coluna, padrao):
+    """Itens ativos da configuração: variável de ambiente, senão a tabela; `padrao` se a tabela falhar."""
+    valor = os.getenv(variavel)
+    if valor:
+        return [item.strip() for item in valor.split(',') if item.strip()]
     try:
-        cursor.execute("CREATE UNIQUE INDEX uniq_escola_evento ON Escola (EventDate, Matricula)")
-    except Exception:
-        pass
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn = get_db_connection()
+    except mysql.connector.Error as e:
+        print(f"Erro ao carregar {tabela}: {e}; usando a lista padrão.")
+        return list(padrao)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {coluna} FROM {tabela} WHERE ativo = 1 ORDER BY {coluna}")
+        itens = [row[0] for row in cursor.fetchall() if row[0]]
+        cursor.close()
+        return itens
+    except mysql.connector.Error as e:
+        print(f"Erro ao carregar {tabela}: {e}; usando a lista padrão.")
+        return list(padrao)
+    finally:
+        conn.close()
 
-def criar_tabela_veiculo():
-    conn = get_db_connection()
+def carregar_placas():
+    return _lista_configurada('TAGS_PLACAS', 'tags_veiculos', 'placa', PLACAS_PADRAO)
+
+def carregar_escolas():
+    return _lista_configurada('TAGS_ESCOLAS', 'tags_escolas', 'codigo', [ESCOLA_PADRAO])
+
+def upsert_em_lotes(conn, sql, linhas, tamanho_lote=None):
+    """Grava `linhas` com executemany em lotes de `tamanho_lote` (TAGS_UPSERT_CHUNK), um commit por lote."""
+    tamanho_lote = max(1, tamanho_lote or TAGS_UPSERT_CHUNK)
     cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Veiculo (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            Placa VARCHAR(20) NOT NULL,
-            EventDate DATETIME NOT NULL,
-            UpdateDate DATETIME NOT NULL,
-            Ignition BOOLEAN NOT NULL,
-            Matricula VARCHAR(50) NOT NULL,
-            Latitude DOUBLE NOT NULL,
-            Longitude DOUBLE NOT NULL,
-            Data_Execucao DATE NOT NULL,
-            UNIQUE KEY uniq_veic_evento (Placa, Matricula, EventDate)
-        )
-    """)
     try:
-        cursor.execute("CREATE UNIQUE INDEX uniq_veic_evento ON Veiculo (Placa, Matricula, EventDate)")
+        for inicio in range(0, len(linhas), tamanho_lote):
+            cursor.executemany(sql, linhas[inicio:inicio + tamanho_lote])
+            conn.commit()
     except Exception:
-        pass
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
 
+def _evento_de_motorista(item):
+    """Posição de identificação do motorista (IdEvent 65) com matrícula preenchida."""
+    matricula = item.get('Driver')
+    return matricula is not None and str(matricula).strip() != "" and item.get('IdEvent') == 65
 
-def consultar_api_escola(data_consulta, token=None):
-    url = API_URL
-    from datetime import datetime
-    data_inicio = data_consulta.strftime('%Y-%m-%dT00:00:00.000Z')
-    data_fim = data_consulta.strftime('%Y-%m-%dT23:59:59.595Z')
+def _evento_de_motorista_com_ignicao(item):
+    return item.get('Ignition') == True and _evento_de_motorista(item)
+
+def _consultar_eventos_escola(client, codigo, data_inicio, data_fim):
+    """Eventos de motorista do dia na unidade `codigo`, lidos em streaming; None em erro."""
     payload = {
         "TrackedUnitType": 1,
-        "TrackedUnitIntegrationCode": "COL.ESTAD.DJALMA MARINHO",
+        "TrackedUnitIntegrationCode": codigo,
         "StartDatePosition": data_inicio,
         "EndDatePosition": data_fim
     }
-    if token is None:
-        from authtoken import obter_token
-        token = obter_token()
-    if not token:
-        print("Não foi possível obter o token de autenticação.")
+    response = client.post(HISTORY_POSITION_PATH, json=payload, stream=True)
+    if response.status_code not in (200, 204):
+        print(f"Erro na consulta de {codigo}:", response.status_code, response.text)
         return None
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
-    response = requests.post(url, json=payload, headers=headers)
+
+    # Lê o dia inteiro de posições item a item e guarda só os eventos de motorista.
+    dados = []
     if response.status_code == 200:
-        import dateutil.parser
-        from datetime import timedelta
-        dados = response.json()
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        if isinstance(dados, list):
-            for item in dados:
-                matricula = item.get('Driver')
-                idevent = item.get('IdEvent')
-                if (matricula is not None and str(matricula).strip() != "" and idevent == 65):
-                    nome = item.get('TrackedUnit')
-                    event_date_raw = item.get('EventDate')
-                    update_date_raw = item.get('UpdateDate')
-
-                    data_execucao_sql = _derivar_data_execucao_do_evento(event_date_raw, data_consulta)
-                    if data_execucao_sql != data_consulta.strftime('%Y-%m-%d'):
-                        continue
-                    event_date = _ajustar_timestamp_iso_para_local(event_date_raw, 3)
-                    update_date = _ajustar_timestamp_iso_para_local(update_date_raw, 3)
-
-                    cursor.execute("""
-                        INSERT INTO Escola (Nome, EventDate, UpdateDate, Matricula, Data_Execucao)
-                        VALUES (%s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                            Nome = VALUES(Nome),
-                            UpdateDate = VALUES(UpdateDate)
-                    """, (nome, event_date, update_date, matricula, data_execucao_sql))
-        else:
-            item = dados
-            matricula = item.get('Driver')
-            idevent = item.get('IdEvent')
-            if (matricula is not None and str(matricula).strip() != "" and idevent == 65):
-                nome = item.get('TrackedUnit')
-                event_date_raw = item.get('EventDate')
-                update_date_raw = item.get('UpdateDate')
-
-                data_execucao_sql = _derivar_data_execucao_do_evento(event_date_raw, data_consulta)
-                if data_execucao_sql != data_consulta.strftime('%Y-%m-%d'):
-                    return dados
-                event_date = _ajustar_timestamp_iso_para_local(event_date_raw, 3)
-                update_date = _ajustar_timestamp_iso_para_local(update_date_raw, 3)
-
-                cursor.execute("""
-                    INSERT INTO Escola (Nome, EventDate, UpdateDate, Matricula, Data_Execucao)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE
-                        Nome = VALUES(Nome),
-                        UpdateDate = VALUES(UpdateDate)
-                """, (nome, event_date, update_date, matricula, data_execucao_sql))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return dados
-    else:
-        print("Erro na consulta:", response.status_code, response.text)
-        return None
+        try:
+            dados = [item for item in iter_json_items(response) if _evento_de_motorista(item)]
+        except ValueError as e:
+            print(f"Resposta inválida na consulta de {codigo}:", e)
+            return None
+    response.close()
+    return dados
+
+def _linhas_escola(dados, data_consulta):
+    data_sql = data_consulta.strftime('%Y-%m-%d')
+    linhas = []
+    for item in dados:
+        event_date_raw = item.get('EventDate')
+        data_execucao_sql = _derivar_data_execucao_do_evento(event_date_raw, data_consulta)
+        if data_execucao_sql != data_sql:
+            continue
+        event_date = _ajustar_timestamp_iso_para_local(event_date_raw, 3)
+        update_date = _ajustar_timestamp_iso_para_local(item.get('UpdateDate'), 3)
+        linhas.append((item.get('TrackedUnit'), event_date, update_date, item.get('Driver'), data_execucao_sql))
+    return linhas
 
-def consultar_api_veiculo(data_consulta, token=None):
-    import pandas as pd
-    url = API_URL
-    placas = ["AXM9A53", "CUE2D20", "IUZ4F94"]
-    if token is None:
-        from authtoken import obter_token
-        token = obter_token()
-    if not token:
-        print("Não foi possível obter o token de autenticação.")
-        return None
-    from datetime import datetime
+def consultar_api_escola(data_consulta, token=None):
+    """Grava em Escola os eventos de motorista do dia de todas as escolas configuradas.
+
+    As escolas são consultadas em paralelo (até TAGS_FETCH_CONCURRENCY) e cada
+    resposta é gravada assim que chega. Retorna os eventos lidos.
+    """
+    client = get_client()
     data_inicio = data_consulta.strftime('%Y-%m-%dT00:00:00.000Z')
     data_fim = data_consulta.strftime('%Y-%m-%dT23:59:59.595Z')
-    todos_logs = []
-    from datetime import datetime, timedelta, timezone
-    import dateutil.parser
-    for placa in placas:
-        payload = {
-            "TrackedUnitType": 1,
-            "TrackedUnitIntegrationCode": placa,
-            "StartDatePosition": data_inicio,
-            "EndDatePosition": data_fim
-        }
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {token}"
-        }
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code == 200:
-            dados = response.json()
-            if isinstance(dados, list):
-                for item in dados:
-                    matricula = item.get('Driver')
-                    idevent = item.get('IdEvent')
-                    if (item.get('Ignition') == True and matricula is not None and str(matricula).strip() != "" and idevent == 65):
-                        eventdate_raw = item.get('EventDate')
-                        updatedate_raw = item.get('UpdateDate')
-                        data_execucao_sql = _derivar_data_execucao_do_evento(eventdate_raw, data_consulta)
-                        if data_execucao_sql != data_consulta.strftime('%Y-%m-%d'):
-                            continue
-                        eventdate = _ajustar_timestamp_iso_para_local(eventdate_raw, 3)
-                        updatedate = _ajustar_timestamp_iso_para_local(updatedate_raw, 3)
-
-                        todos_logs.append({
-                            'Placa': item.get('TrackedUnitIntegrationCode'),
-                            'EventDate': eventdate,
-                            'UpdateDate': updatedate,
-                            'Ignition': item.get('Ignition'),
-                            'Matricula': matricula,
-                            'Latitude': item.get('Latitude'),
-                            'Longitude': item.get('Longitude'),
-                            'Data_Execucao': data_execucao_sql
-                        })
-            else:
-                matricula = dados.get('Driver')
-                idevent = dados.get('IdEvent')
-                if dados.get('Ignition') == True and matricula is not None and str(matricula).strip() != "" and idevent == 65:
-                    eventdate_raw = dados.get('EventDate')
-                    updatedate_raw = dados.get('UpdateDate')
-                    data_execucao_sql = _derivar_data_execucao_do_evento(eventdate_raw, data_consulta)
-                    if data_execucao_sql != data_consulta.strftime('%Y-%m-%d'):
-                        continue
-                    eventdate = _ajustar_timestamp_iso_para_local(eventdate_raw, 3)
-                    updatedate = _ajustar_timestamp_iso_para_local(updatedate_raw, 3)
-
-                    todos_logs.append({
-                        'Placa': dados.get('TrackedUnitIntegrationCode'),
-                        'EventDate': eventdate,
-                        'UpdateDate': updatedate,
-                        'Ignition': dados.get('Ignition'),
-                        'Matricula': matricula,
-                        'Latitude': dados.get('Latitude'),
-                        'Longitude': dados.get('Longitude'),
-                        'Data_Execucao': data_execucao_sql
-                    })
-    if not todos_logs:
-        return
-    df = pd.DataFrame(todos_logs)
+    if not client.token():
+        print("Não foi possível obter o token de autenticação.")
+        return None
+
+    escolas = carregar_escolas()
+    eventos = []
+    linhas = []
+    conn = get_db_connection()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(TAGS_FETCH_CONCURRENCY, len(escolas)))) as executor:
+            futuros = {
+                executor.submit(_consultar_eventos_escola, client, codigo, data_inicio, data_fim): codigo
+                for codigo in escolas
+            }
+            for futuro in as_completed(futuros):
+                try:
+                    dados = futuro.result()
+                except Exception as e:
+                    print(f"Erro ao consultar a escola {futuros[futuro]}: {e}")
+                    continue
+                if dados is None:
+                    continue
+                eventos.extend(dados)
+                linhas.extend(_linhas_escola(dados, data_consulta))
+                if len(linhas) >= TAGS_UPSERT_CHUNK:
+                    upsert_em_lotes(conn, UPSERT_ESCOLA, linhas)
+                    linhas = []
+        upsert_em_lotes(conn, UPSERT_ESCOLA, linhas)
+    finally:
+        conn.close()
+    return eventos
+
+def _linhas_veiculo(dados, data_consulta):
+    """Entrada e saída de cada trecho (gap > GAP_SECONDS) por placa/matrícula, como linhas de UPSERT_VEICULO."""
+    import pandas as pd
+    logs = []
+    for item in dados:
+        eventdate_raw = item.get('EventDate')
+        data_execucao_sql = _derivar_data_execucao_do_evento(eventdate_raw, data_consulta)
+        if data_execucao_sql != data_consulta.strftime('%Y-%m-%d'):
+            continue
+        logs.append({
+            'Placa': item.get('TrackedUnitIntegrationCode'),
+            'EventDate': _ajustar_timestamp_iso_para_local(eventdate_raw, 3),
+            'UpdateDate': _ajustar_timestamp_iso_para_local(item.get('UpdateDate'), 3),
+            'Ignition': item.get('Ignition'),
+            'Matricula': item.get('Driver'),
+            'Latitude': item.get('Latitude'),
+            'Longitude': item.get('Longitude'),
+            'Data_Execucao': data_execucao_sql
+        })
+    if not logs:
+        return []
+    df = pd.DataFrame(logs)
     df['EventDate'] = pd.to_datetime(df['EventDate'])
     df['UpdateDate'] = pd.to_datetime(df['UpdateDate'])
     df = df.sort_values(['Placa', 'Matricula', 'EventDate'])
@@ -800,18 +511,8 @@ def consultar_api_veiculo(data_consulta, token=None):
             else:
                 eventos_filtrados.append(sub.iloc[0].to_dict())   # entrada
                 eventos_filtrados.append(sub.iloc[-1].to_dict())  # saída
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    for item in eventos_filtrados:
-        cursor.execute("""
-            INSERT INTO Veiculo (Placa, EventDate, UpdateDate, Ignition, Matricula, Latitude, Longitude, Data_Execucao)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                UpdateDate = VALUES(UpdateDate),
-                Ignition = VALUES(Ignition),
-                Latitude = VALUES(Latitude),
-                Longitude = VALUES(Longitude)
-        """, (
+    return [
+        (
             item['Placa'],
             item['EventDate'],
             item['UpdateDate'],
@@ -820,10 +521,50 @@ def consultar_api_veiculo(data_consulta, token=None):
             item['Latitude'],
             item['Longitude'],
             item['Data_Execucao']
-        ))
-    conn.commit()
-    cursor.close()
-    conn.close()
+        )
+        for item in eventos_filtrados
+    ]
+
+def consultar_api_veiculo(data_consulta, token=None):
+    """Grava em Veiculo a entrada/saída de cada trecho dos veículos configurados.
+
+    Os veículos são consultados em paralelo (até TAGS_FETCH_CONCURRENCY); cada
+    resposta é dividida em trechos e gravada assim que chega.
+    """
+    client = get_client()
+    if not client.token():
+        print("Não foi possível obter o token de autenticação.")
+        return None
+    data_inicio = data_consulta.strftime('%Y-%m-%dT00:00:00.000Z')
+    data_fim = data_consulta.strftime('%Y-%m-%dT23:59:59.595Z')
+
+    placas = carregar_placas()
+    linhas = []
+    conn = get_db_connection()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(TAGS_FETCH_CONCURRENCY, len(placas)))) as executor:
+            # O filtro é aplicado enquanto as posições são lidas: só os eventos de motorista ficam em memória.
+            futuros = {
+                executor.submit(buscar_posicoes, placa, data_inicio, data_fim, _evento_de_motorista_com_ignicao): placa
+                for placa in placas
+            }
+            for futuro in as_completed(futuros):
+                placa = futuros[futuro]
+                try:
+                    dados = futuro.result()
+                except Exception as e:
+                    print(f"Erro ao consultar o veículo {placa}: {e}")
+                    continue
+                if dados is None:
+                    print(f"Falha ao consultar as posições do veículo {placa}.")
+                    continue
+                linhas.extend(_linhas_veiculo(dados, data_consulta))
+                if len(linhas) >= TAGS_UPSERT_CHUNK:
+                    upsert_em_lotes(conn, UPSERT_VEICULO, linhas)
+                    linhas = []
+        upsert_em_lotes(conn, UPSERT_VEICULO, linhas)
+    finally:
+        conn.close()
 
 def garantir_ordem_cronologica_global(entrada_ida, saida_ida, entrada_escola, saida_escola, entrada_volta, saida_volta):
     ei = _to_datetime_or_none(entrada_ida)
@@ -861,6 +602,98 @@ def ancorar_no_presente(data_execucao, ei, si, ee, se, ev, sv):
         return tuple(_fmt(x) for x in dts)
     return (ei, si, ee, se, ev, sv)
 
+_COLUNAS_JANELAS = ('entrada_ida', 'saida_ida', 'entrada_escola', 'saida_escola', 'entrada_volta', 'saida_volta')
+# (coluna de entrada, coluna de saída, campo de entrada, campo de saída) nos horários padrão.
+_PARES_JANELAS = (
+    ('entrada_ida', 'saida_ida', 'ida_entrada', 'ida_saida'),
+    ('entrada_escola', 'saida_escola', 'escola_entrada', 'escola_saida'),
+    ('entrada_volta', 'saida_volta', 'volta_entrada', 'volta_saida'),
+)
+
+def ajustar_janelas_do_dia(limites, data_execucao, indice, agora=None):
+    """Aplica, de uma vez para todos os alunos, as regras de ajuste dos horários.
+
+    Equivale a encadear ajustar_horarios_pelo_padrao, inferir_horarios_por_semelhanca,
+    garantir_ordem_cronologica_global e ancorar_no_presente em cada linha de
+    `limites` (índice = matrícula, colunas de _COLUNAS_JANELAS), mas sobre colunas
+    datetime64: deriva em relação ao padrão, preenchimento pela mediana do turno,
+    ordem cronológica e descarte de horários futuros. Essas funções continuam
+    sendo a referência de comportamento. Retorna as colunas formatadas
+    ('%Y-%m-%d %H:%M:%S' ou None).
+    """
+    import numpy as np
+    import pandas as pd
+
+    agora = agora or datetime.now()
+    base_dt = data_execucao if isinstance(data_execucao, datetime) else _to_datetime_or_none(data_execucao)
+    base = pd.Timestamp(base_dt.date()) if base_dt else None
+    meia_hora, um_minuto = pd.Timedelta(minutes=30), pd.Timedelta(minutes=1)
+
+    col = {
+        c: pd.to_datetime(limites[c], errors='coerce', format='mixed').dt.floor('s')
+        for c in _COLUNAS_JANELAS
+    }
+
+    def horario(minutos):
+        """Minutos desde a meia-noite (NaN = ausente) na data de execução."""
+        if base is None:
+            return pd.Series(pd.NaT, index=limites.index, dtype='datetime64[ns]')
+        return base + pd.to_timedelta(pd.Series(minutos, index=limites.index), unit='m')
+
+    # 1) Horários padrão da matrícula: preenche lacunas e corrige deriva > THRESHOLD_MINUTOS_DERIVA.
+    posicoes = np.array([indice.posicao.get(str(m), -1) for m in limites.index], dtype=int)
+    tem_padrao = pd.Series(posicoes >= 0, index=limites.index)
+    padrao = np.full((len(posicoes), len(CAMPOS_HORARIOS)), np.nan)
+    if tem_padrao.any():
+        padrao[tem_padrao.to_numpy()] = indice.minutos[posicoes[tem_padrao.to_numpy()]]
+    deriva = pd.Timedelta(minutes=THRESHOLD_MINUTOS_DERIVA)
+    for c_in, c_out, k_in, k_out in _PARES_JANELAS:
+        std_in = horario(padrao[:, CAMPOS_HORARIOS.index(k_in)])
+        std_out = horario(padrao[:, CAMPOS_HORARIOS.index(k_out)])
+        vazio = col[c_in].isna() & col[c_out].isna()
+        cin = col[c_in].fillna(std_in)
+        cout = col[c_out].fillna(std_out)
+        cin = cin.mask(std_in.notna() & ((cin - std_in).abs() > deriva), std_in)
+        cout = cout.mask(std_out.notna() & ((cout - std_out).abs() > deriva), std_out)
+        invertido = cin > cout
+        usa_padrao = invertido & (std_out >= cin)
+        cout = cout.mask(usa_padrao, std_out).mask(invertido & ~usa_padrao, cin + meia_hora)
+        ajustar = tem_padrao & ~vazio
+        col[c_in] = cin.where(ajustar, col[c_in])
+        col[c_out] = cout.where(ajustar, col[c_out])
+
+    # 2) Lacunas restantes: mediana do turno (pelo primeiro horário conhecido, como inferir_horarios_por_semelhanca).
+    referencia = col['entrada_escola']
+    for c in ('entrada_ida', 'entrada_volta', 'saida_ida', 'saida_escola', 'saida_volta'):
+        referencia = referencia.fillna(col[c])
+    manha = (referencia.dt.hour < 12).fillna(False).to_numpy(dtype=bool)
+    for c_in, c_out, k_in, k_out in _PARES_JANELAS:
+        med_in = horario(np.where(manha, indice.medianas['manha'].get(k_in, np.nan), indice.medianas['tarde'].get(k_in, np.nan)))
+        med_out = horario(np.where(manha, indice.medianas['manha'].get(k_out, np.nan), indice.medianas['tarde'].get(k_out, np.nan)))
+        vazio = col[c_in].isna() & col[c_out].isna()
+        cin = col[c_in].fillna(med_in)
+        cout = col[c_out].fillna(med_out)
+        cout = cout.mask(cin > cout, cin + meia_hora)
+        col[c_in] = cin.mask(vazio)
+        col[c_out] = cout.mask(vazio)
+
+    # 3) Ordem cronológica: saída após entrada, escola após a ida, volta após a escola.
+    for c_in, c_out, _, _ in _PARES_JANELAS:
+        col[c_out] = col[c_out].mask(col[c_out] < col[c_in], col[c_in] + meia_hora)
+    for anterior, c_in, c_out in (('saida_ida', 'entrada_escola', 'saida_escola'), ('saida_escola', 'entrada_volta', 'saida_volta')):
+        empurrar = col[c_in] <= col[anterior]
+        col[c_in] = col[c_in].mask(empurrar, col[anterior] + um_minuto)
+        col[c_out] = col[c_out].mask(empurrar & (col[c_out] < col[c_in]), col[c_in] + meia_hora)
+
+    # 4) No dia corrente, horários ainda no futuro são descartados.
+    if base_dt and base_dt.date() == agora.date():
+        limite = pd.Timestamp(agora)
+        for c in _COLUNAS_JANELAS:
+            col[c] = col[c].mask(col[c] > limite)
+
+    resultado = pd.DataFrame({c: col[c].dt.strftime('%Y-%m-%d %H:%M:%S') for c in _COLUNAS_JANELAS}, index=limites.index)
+    return resultado.astype(object).where(resultado.notna(), None)
+
 def corrigir_ordem_em_toda_tabela_aluno(data_execucao: str | None = None):
     """
     Se data_execucao for fornecida ('YYYY-MM-DD'), limita as correções a esse dia.
@@ -956,9 +789,8 @@ if __name__ == "__main__":
     if not token_unico:
         print("Falha ao obter token. Encerrando.")
     else:
-        criar_tabela_escola()
-        criar_tabela_veiculo()
-        criar_tabela_aluno()
+        from migrations import aplicar_migracoes
+        aplicar_migracoes()
         hoje = datetime.now()
         dia_consulta = hoje - timedelta(days=4)
         print(f"Consultando e alimentando banco para o dia: {dia_consulta.strftime('%d/%m/%Y')}")
@@ -0,0 +1,162 @@
+"""ajustar_janelas_do_dia x encadeamento das funções de referência de tags.py.
+
+Compara, em dias gerados aleatoriamente, o ajuste vetorizado com
+ajustar_horarios_pelo_padrao -> inferir_horarios_por_semelhanca ->
+garantir_ordem_cronologica_global -> ancorar_no_presente aplicado linha a linha.
+"""
+import importlib.util
+import random
+import sys
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+RAIZ = Path(__file__).resolve().parents[1]
+
+
+def _importar_tags():
+    """Importa tags.py sem banco: o pool MySQL é criado na importação do módulo."""
+    pooling = types.ModuleType("mysql.connector.pooling")
+    pooling.MySQLConnectionPool = lambda **kwargs: None
+    connector = types.ModuleType("mysql.connector")
+    connector.pooling = pooling
+    connector.Error = Exception
+    mysql = types.ModuleType("mysql")
+    mysql.connector = connector
+    falsos = {"mysql": mysql, "mysql.connector": connector, "mysql.connector.pooling": pooling}
+
+    if importlib.util.find_spec("dotenv") is None:
+        dotenv = types.ModuleType("dotenv")
+        dotenv.load_dotenv = lambda *args, **kwargs: None
+        falsos["dotenv"] = dotenv
+    if importlib.util.find_spec("requests") is None:
+        requests = types.ModuleType("requests")
+        requests.RequestException = Exception
+        adapters = types.ModuleType("requests.adapters")
+        adapters.HTTPAdapter = object
+        requests.adapters = adapters
+        falsos.update({"requests": requests, "requests.adapters": adapters})
+    if importlib.util.find_spec("aiohttp") is None:
+        falsos["aiohttp"] = types.ModuleType("aiohttp")
+
+    sys.path.insert(0, str(RAIZ))
+    try:
+        with mock.patch.dict(sys.modules, falsos):
+            sys.modules.pop("tags", None)
+            import tags
+    finally:
+        sys.path.remove(str(RAIZ))
+    return tags
+
+
+tags = _importar_tags()
+INDICE = tags.obter_indice()
+MATRICULAS_COM_PADRAO = sorted(INDICE.matriculas)
+FORMATO = "%Y-%m-%d %H:%M:%S"
+
+
+def _relogio(agora):
+    """Substituto de tags.datetime cujo now() devolve `agora` (usado por ancorar_no_presente)."""
+
+    class Relogio(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return agora
+
+    return Relogio
+
+
+def _referencia(matricula, data_execucao, valores):
+    r = tags.ajustar_horarios_pelo_padrao(matricula, data_execucao, *valores)
+    r = tags.inferir_horarios_por_semelhanca(data_execucao, None, *r)
+    r = tags.garantir_ordem_cronologica_global(*r)
+    return tags.ancorar_no_presente(data_execucao, *r)
+
+
+def _horario(rng, dia, padrao_minutos=None):
+    """Horário do dia: perto do padrão (dentro ou além da deriva) ou qualquer um."""
+    if padrao_minutos is not None and rng.random() < 0.6:
+        deriva = tags.THRESHOLD_MINUTOS_DERIVA
+        desvio = rng.choice([rng.randint(-deriva, deriva), rng.randint(deriva + 1, 3 * deriva)])
+        minutos = min(max(int(padrao_minutos) + desvio, 0), 24 * 60 - 1)
+    else:
+        minutos = rng.randint(5 * 60, 20 * 60)
+    return dia + timedelta(minutes=minutos, seconds=rng.choice([0, 0, 17]))
+
+
+def _linha(rng, matricula, dia):
+    """Seis horários de um aluno, com pares vazios, pares invertidos e tipos mistos."""
+    posicao = INDICE.posicao.get(matricula)
+    valores = []
+    for c_in, c_out, k_in, k_out in tags._PARES_JANELAS:
+        par = []
+        for campo in (k_in, k_out):
+            padrao = None
+            if posicao is not None:
+                minutos = INDICE.minutos[posicao][tags.CAMPOS_HORARIOS.index(campo)]
+                padrao = None if pd.isna(minutos) else minutos
+            par.append(_horario(rng, dia, padrao))
+        sorteio = rng.random()
+        if sorteio < 0.2:
+            par = [None, None]
+        elif sorteio < 0.35:
+            par[rng.randrange(2)] = None
+        elif sorteio < 0.55:
+            par = sorted(par, reverse=True)
+        valores.extend(par)
+    # Como o banco: datetime; pd.Timestamp e texto aparecem no caminho do DataFrame.
+    saida = []
+    for v in valores:
+        sorteio = rng.random()
+        if v is not None and sorteio < 0.2:
+            v = pd.Timestamp(v)
+        elif v is not None and sorteio < 0.3:
+            v = v.strftime(FORMATO)
+        saida.append(v)
+    # saida_escola derivada da entrada_volta, em texto, como em _limites_por_aluno.
+    if saida[2] is not None and saida[4] is not None and rng.random() < 0.3:
+        entrada_volta = pd.to_datetime(saida[4])
+        saida[3] = (entrada_volta - timedelta(minutes=1)).strftime(FORMATO)
+    return saida
+
+
+def _limites(linhas):
+    limites = pd.DataFrame.from_dict(linhas, orient="index", columns=list(tags._COLUNAS_JANELAS)).astype(object)
+    return limites.where(limites.notna(), None)
+
+
+@pytest.mark.parametrize("semente", range(40))
+def test_equivale_ao_encadeamento_de_referencia(semente, monkeypatch):
+    rng = random.Random(semente)
+    dia = datetime(2024, 5, 1)
+    if semente % 2:
+        # Dia corrente: ancorar_no_presente descarta horários depois de `agora`.
+        agora = dia + timedelta(hours=rng.randint(7, 17), minutes=rng.randint(0, 59))
+        data_execucao = agora
+    else:
+        agora = datetime(2024, 5, 2, 8, 0)
+        data_execucao = dia + timedelta(hours=9, minutes=30)
+    monkeypatch.setattr(tags, "datetime", _relogio(agora))
+
+    linhas = {}
+    for k in range(rng.randint(1, 25)):
+        if rng.random() < 0.6:
+            matricula = rng.choice(MATRICULAS_COM_PADRAO)
+        else:
+            matricula = str(900000 + k)  # sem horário padrão
+        linhas[matricula] = _linha(rng, matricula, dia)
+
+    resultado = tags.ajustar_janelas_do_dia(_limites(linhas), data_execucao, INDICE, agora=agora)
+
+    for matricula, valores in linhas.items():
+        assert tuple(resultado.loc[matricula]) == _referencia(matricula, data_execucao, valores), matricula
+
+
+def test_sem_padrao_e_sem_horarios_fica_vazio():
+    limites = _limites({"999999": [None] * 6})
+    resultado = tags.ajustar_janelas_do_dia(limites, datetime(2024, 5, 1), INDICE, agora=datetime(2024, 5, 2))
+    assert tuple(resultado.loc["999999"]) == (None,) * 6
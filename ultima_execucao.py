@@ -27,14 +27,6 @@ def atualizar_ultima_execucao():
         conn = connection_pool.get_connection()
         cursor = conn.cursor()
         
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS ultima_execucao (
-            id INT PRIMARY KEY,
-            last_execution DATETIME
-        );
-        """
-        cursor.execute(create_table_query)
-        
         upsert_query = """
         INSERT INTO ultima_execucao (id, last_execution)
         VALUES (1, %s)
@@ -0,0 +1,28 @@
+"""Entrypoint do worker de jobs agendados.
+
+Roda os jobs fora dos workers web (que não os executam por padrão):
+
+    python worker.py
+
+O código do worker está em `src/patrimonio_app/worker.py`.
+"""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent
+SRC_DIR = BASE_DIR / "src"
+# A raiz precisa estar no path: os jobs importam grid.py, odometer.py, tags.py...
+for path in (str(BASE_DIR), str(SRC_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+from patrimonio_app.worker import main  # noqa: E402
+
+
+if __name__ == "__main__":
+    main()